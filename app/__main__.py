@@ -12,6 +12,7 @@ import math
 import os
 import socket
 import ssl
+import time
 from contextlib import asynccontextmanager
 from io import BytesIO
 from ipaddress import IPv4Address
@@ -23,13 +24,15 @@ import uvloop
 from loguru import logger
 from pydantic import ValidationError
 from sqlalchemy import select, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from config import Settings
 from ldap_protocol import LDAPRequestMessage, Session
 from ldap_protocol.messages import LDAPMessage, LDAPResponseMessage
-from models.database import create_session_factory
+from ldap_protocol.utils import tree_index
+from models.database import get_database
 from models.ldap3 import NetworkPolicy
 
 log = logger.bind(name='ldap')
@@ -65,7 +68,8 @@ class PoolClientHandler:
         """Set workers number for single client concurrent handling."""
         self.num_workers = num_workers
         self.settings = settings
-        self.AsyncSessionFactory = create_session_factory(self.settings)
+        self.database = get_database(self.settings)
+        self.AsyncSessionFactory = self.database.session
         self._size = rcv_size
 
         if settings.DEBUG:
@@ -246,9 +250,10 @@ class PoolClientHandler:
                 await ldap_session.queue.put(request)
 
     @asynccontextmanager
-    async def create_session(self) -> AsyncIterator[AsyncSession]:
-        """Create session for request."""
-        async with self.AsyncSessionFactory() as session:
+    async def create_session(
+            self, read_only: bool = False) -> AsyncIterator[AsyncSession]:
+        """Create session for request, read only one may use replica."""
+        async with self.AsyncSessionFactory(read_only=read_only) as session:
             yield session
 
     @staticmethod
@@ -274,13 +279,20 @@ class PoolClientHandler:
                 message = await ldap_session.queue.get()
                 self.req_log(ldap_session.addr, message)
 
-                async with self.create_session() as session:
+                use_replica = message.context.use_replica and \
+                    time.monotonic() >= ldap_session.primary_until
+
+                async with self.create_session(use_replica) as session:
                     async for response in message.create_response(
                             ldap_session, session):
                         self.rsp_log(ldap_session.addr, response)
                         ldap_session.writer.write(response.encode())
                         await ldap_session.writer.drain()
 
+                if not message.context.read_only:  # read own writes
+                    ldap_session.primary_until = \
+                        time.monotonic() + self.database.sticky_seconds
+
                 ldap_session.queue.task_done()
             except Exception as err:
                 raise RuntimeError(err) from err
@@ -315,10 +327,21 @@ class PoolClientHandler:
         addrs = ', '.join(str(sock.getsockname()) for sock in server.sockets)
         log.info(f'Server on {addrs}')
 
+    async def load_tree_index(self) -> None:
+        """Load tree index before requests, otherwise the first one does."""
+        try:
+            async with self.create_session() as session:
+                await tree_index.refresh(session)
+        except SQLAlchemyError as err:
+            log.warning(f'Tree index is not loaded: {err}')
+        else:
+            log.info(f'Tree index loaded, {len(tree_index)} entries')
+
     async def start(self) -> None:
         """Run and log tcp server."""
         server = await self._get_server()
         self.log_addrs(server)
+        await self.load_tree_index()
         try:
             await self._run_server(server)
         finally:
@@ -345,6 +368,8 @@ if __name__ == '__main__':
         await asyncio.gather(
             PoolClientHandler(settings).start(),
             PoolClientHandler(settings.get_copy_4_tls()).start(),
+            get_database(settings).log_stats(
+                settings.POSTGRES_POOL_STATS_SECONDS),
         )
 
     if args.loop == 'uvloop':
@@ -0,0 +1,58 @@
+"""Add nested memberships closure.
+
+Revision ID: 4e8772277cfe
+Revises: 6355e97cd073
+Create Date: 2024-07-08 11:21:40.392612
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4e8772277cfe'
+down_revision = '6355e97cd073'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'NestedMemberships',
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('directoryId', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['group_id'], ['Groups.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['directoryId'], ['Directory.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('group_id', 'directoryId'),
+    )
+    op.create_index(
+        op.f('ix_NestedMemberships_directoryId'),
+        'NestedMemberships', ['directoryId'], unique=False)
+
+    op.execute(sa.text("""
+INSERT INTO "NestedMemberships" (group_id, "directoryId")
+WITH RECURSIVE nested(root_id, group_id) AS (
+    SELECT id, id FROM "Groups"
+    UNION
+    SELECT nested.root_id, gm.group_child_id
+    FROM "GroupMemberships" gm
+    JOIN nested ON gm.group_id = nested.group_id
+)
+SELECT nested.root_id, g."directoryId"
+FROM nested JOIN "Groups" g ON g.id = nested.group_id
+WHERE nested.root_id != nested.group_id
+UNION
+SELECT nested.root_id, u."directoryId"
+FROM nested
+JOIN "UserMemberships" um ON um.group_id = nested.group_id
+JOIN "Users" u ON u.id = um.user_id;"""))
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f('ix_NestedMemberships_directoryId'),
+        table_name='NestedMemberships')
+    op.drop_table('NestedMemberships')
@@ -0,0 +1,25 @@
+"""Add directory changes counter.
+
+Revision ID: 8c2fa6b2d1e0
+Revises: 4e8772277cfe
+Create Date: 2024-07-15 10:42:11.204317
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8c2fa6b2d1e0'
+down_revision = '4e8772277cfe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('DirectoryChanges')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('DirectoryChanges')))
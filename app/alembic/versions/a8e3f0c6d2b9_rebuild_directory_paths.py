@@ -0,0 +1,39 @@
+"""Rebuild directory ancestors table.
+
+Revision ID: a8e3f0c6d2b9
+Revises: f1c9a6e2b7d4
+Create Date: 2024-07-29 11:07:45.218634
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a8e3f0c6d2b9'
+down_revision = 'f1c9a6e2b7d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        op.f('ix_Paths_endpoint_id'), 'Paths', ['endpoint_id'], unique=False)
+
+    # links were added from stale collections of siblings, rebuild by parents
+    op.execute(sa.text('DELETE FROM "DirectoryPaths"'))
+    op.execute(sa.text(
+        'WITH RECURSIVE ancestors(id, "ancestorId") AS ('
+        ' SELECT id, id FROM "Directory"'
+        ' UNION ALL'
+        ' SELECT ancestors.id, "Directory"."parentId" FROM ancestors'
+        ' JOIN "Directory" ON "Directory".id = ancestors."ancestorId"'
+        ' WHERE "Directory"."parentId" IS NOT NULL) '
+        'INSERT INTO "DirectoryPaths" (dir_id, path_id) '
+        'SELECT ancestors."ancestorId", "Paths".id FROM ancestors '
+        'JOIN "Paths" ON "Paths".endpoint_id = ancestors.id'))
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_Paths_endpoint_id'), table_name='Paths')
@@ -0,0 +1,37 @@
+"""Add uSNCreated and uSNChanged.
+
+Revision ID: b3e1d5a7c9f2
+Revises: 8c2fa6b2d1e0
+Create Date: 2024-07-17 16:05:48.731952
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b3e1d5a7c9f2'
+down_revision = '8c2fa6b2d1e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    next_usn = sa.text("nextval('\"DirectoryChanges\"')")
+
+    op.add_column('Directory', sa.Column(
+        'uSNCreated', sa.BigInteger(),
+        server_default=next_usn, nullable=False))
+    op.add_column('Directory', sa.Column(
+        'uSNChanged', sa.BigInteger(),
+        server_default=next_usn, nullable=False))
+    op.create_index(
+        op.f('ix_Directory_uSNChanged'),
+        'Directory', ['uSNChanged'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_Directory_uSNChanged'), table_name='Directory')
+    op.drop_column('Directory', 'uSNChanged')
+    op.drop_column('Directory', 'uSNCreated')
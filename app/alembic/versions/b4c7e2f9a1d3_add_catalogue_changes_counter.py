@@ -0,0 +1,25 @@
+"""Add catalogue changes counter.
+
+Revision ID: b4c7e2f9a1d3
+Revises: a8e3f0c6d2b9
+Create Date: 2024-07-30 09:51:03.641279
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b4c7e2f9a1d3'
+down_revision = 'a8e3f0c6d2b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('CatalogueChanges')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('CatalogueChanges')))
@@ -0,0 +1,40 @@
+"""Add lowercase objectClass array of directory.
+
+Revision ID: c2d8e4f7a9b1
+Revises: b4c7e2f9a1d3
+Create Date: 2024-08-06 11:27:45.318204
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c2d8e4f7a9b1'
+down_revision = 'b4c7e2f9a1d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('Directory', sa.Column(
+        'objectClasses', postgresql.ARRAY(sa.String()),
+        server_default='{}', nullable=False))
+
+    op.execute(sa.text(
+        'UPDATE "Directory" d SET "objectClasses" = ARRAY('
+        'SELECT DISTINCT lower(a.value) FROM "Attributes" a '
+        'JOIN "AttributeTypes" t ON t.id = a."typeId" '
+        'WHERE a."directoryId" = d.id AND t."lowerName" = \'objectclass\' '
+        'AND a.value IS NOT NULL)'))
+
+    op.create_index(
+        'ix_Directory_objectClasses', 'Directory', ['objectClasses'],
+        postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_Directory_objectClasses', table_name='Directory')
+    op.drop_column('Directory', 'objectClasses')
@@ -0,0 +1,48 @@
+"""Add trigram indexes for substring filters.
+
+Revision ID: d7a4c2e8f016
+Revises: b3e1d5a7c9f2
+Create Date: 2024-07-22 12:31:07.518220
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd7a4c2e8f016'
+down_revision = 'b3e1d5a7c9f2'
+branch_labels = None
+depends_on = None
+
+# GIN pg_trgm indexes serve `ILIKE` with any wildcards position
+TRGM_INDEXES = {
+    'ix_Attributes_value_trgm': ('Attributes', 'value'),
+    'ix_Directory_name_trgm': ('Directory', 'name'),
+    'ix_Users_sAMAccountName_trgm': ('Users', 'sAMAccountName'),
+    'ix_Users_userPrincipalName_trgm': ('Users', 'userPrincipalName'),
+    'ix_Users_displayName_trgm': ('Users', 'displayName'),
+    'ix_Users_mail_trgm': ('Users', 'mail'),
+}
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    is_available = conn.scalar(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"))
+
+    if not is_available:  # contrib package is not installed
+        return
+
+    op.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+    for name, (table, column) in TRGM_INDEXES.items():
+        op.execute(sa.text(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" '
+            f'USING GIN ("{column}" gin_trgm_ops)'))
+
+
+def downgrade() -> None:
+    for name in TRGM_INDEXES:
+        op.execute(sa.text(f'DROP INDEX IF EXISTS "{name}"'))
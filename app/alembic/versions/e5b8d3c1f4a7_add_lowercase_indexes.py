@@ -0,0 +1,46 @@
+"""Add lowercase expression indexes for equality filters.
+
+Revision ID: e5b8d3c1f4a7
+Revises: d7a4c2e8f016
+Create Date: 2024-07-24 10:14:52.906317
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8d3c1f4a7'
+down_revision = 'd7a4c2e8f016'
+branch_labels = None
+depends_on = None
+
+# expressions must match `filter_interpreter` conditions exactly,
+# unbounded values exceed btree tuple size, so hash index is used
+INDEXES = {
+    'ix_Attributes_name_lower': ('Attributes', 'btree', 'lower(name)'),
+    'ix_Attributes_value_lower': ('Attributes', 'hash', 'lower(value)'),
+    'ix_Attributes_bvalue': ('Attributes', 'hash', 'bvalue'),
+    'ix_Directory_name_lower': ('Directory', 'btree', 'lower(name)'),
+    'ix_Directory_objectSid_lower': (
+        'Directory', 'btree', 'lower("objectSid")'),
+    'ix_Users_sAMAccountName_lower': (
+        'Users', 'btree', 'lower("sAMAccountName")'),
+    'ix_Users_userPrincipalName_lower': (
+        'Users', 'btree', 'lower("userPrincipalName")'),
+    'ix_Users_mail_lower': ('Users', 'btree', 'lower(mail)'),
+    'ix_Users_displayName_lower': ('Users', 'hash', 'lower("displayName")'),
+}
+
+
+def upgrade() -> None:
+    for name, (table, method, expr) in INDEXES.items():
+        op.execute(sa.text(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" '
+            f'USING {method} ({expr})'))
+
+
+def downgrade() -> None:
+    for name in INDEXES:
+        op.execute(sa.text(f'DROP INDEX IF EXISTS "{name}"'))
@@ -0,0 +1,69 @@
+"""Add attribute types dictionary.
+
+Revision ID: f1c9a6e2b7d4
+Revises: e5b8d3c1f4a7
+Create Date: 2024-07-26 15:42:19.331804
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f1c9a6e2b7d4'
+down_revision = 'e5b8d3c1f4a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'AttributeTypes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('lowerName', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('lowerName'),
+    )
+    op.execute(sa.text(  # first used spelling is kept
+        'INSERT INTO "AttributeTypes" (name, "lowerName") '
+        'SELECT DISTINCT ON (lower(name)) name, lower(name) '
+        'FROM "Attributes" ORDER BY lower(name), id'))
+
+    op.add_column(
+        'Attributes', sa.Column('typeId', sa.Integer(), nullable=True))
+    op.execute(sa.text(
+        'UPDATE "Attributes" SET "typeId" = "AttributeTypes".id '
+        'FROM "AttributeTypes" '
+        'WHERE "AttributeTypes"."lowerName" = lower("Attributes".name)'))
+    op.alter_column('Attributes', 'typeId', nullable=False)
+    op.create_foreign_key(
+        'Attributes_typeId_fkey', 'Attributes', 'AttributeTypes',
+        ['typeId'], ['id'])
+    op.create_index(
+        op.f('ix_Attributes_typeId'), 'Attributes', ['typeId'], unique=False)
+
+    op.execute(sa.text('DROP INDEX IF EXISTS "ix_Attributes_name_lower"'))
+    op.drop_index(op.f('ix_Attributes_name'), table_name='Attributes')
+    op.drop_column('Attributes', 'name')
+
+
+def downgrade() -> None:
+    op.add_column('Attributes', sa.Column('name', sa.String(), nullable=True))
+    op.execute(sa.text(
+        'UPDATE "Attributes" SET name = "AttributeTypes".name '
+        'FROM "AttributeTypes" '
+        'WHERE "AttributeTypes".id = "Attributes"."typeId"'))
+    op.alter_column('Attributes', 'name', nullable=False)
+    op.create_index(
+        op.f('ix_Attributes_name'), 'Attributes', ['name'], unique=False)
+    op.execute(sa.text(
+        'CREATE INDEX IF NOT EXISTS "ix_Attributes_name_lower" '
+        'ON "Attributes" USING btree (lower(name))'))
+
+    op.drop_index(op.f('ix_Attributes_typeId'), table_name='Attributes')
+    op.drop_constraint(
+        'Attributes_typeId_fkey', 'Attributes', type_='foreignkey')
+    op.drop_column('Attributes', 'typeId')
+    op.drop_table('AttributeTypes')
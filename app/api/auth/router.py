@@ -8,20 +8,21 @@ from typing import Annotated
 
 from extra.setup_dev import setup_enviroment
 from fastapi import APIRouter, Body, Depends, HTTPException, status
-from sqlalchemy import exists, select
+from sqlalchemy import exists, select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import Settings, get_settings
+from ldap_protocol.catalogue import bump_catalogue_counter, catalogue
 from ldap_protocol.multifactor import MultifactorAPI
+from ldap_protocol.notifications import notify_change
 from ldap_protocol.password_policy import (
     PasswordPolicySchema,
     post_save_password_actions,
 )
 from ldap_protocol.utils import (
-    get_base_dn,
-    get_domain_guid,
-    get_domain_sid,
+    bump_change_counter,
+    reserve_usn,
     set_last_logon_user,
 )
 from models.database import get_session
@@ -185,7 +186,13 @@ async def password_reset(
 
     await post_save_password_actions(user, session)
     user.password = get_password_hash(new_password)
+    await reserve_usn(session)
+    await session.execute(
+        update(Directory).where(Directory.id == user.directory_id))
+    session.expire(user.directory, ['updated_at', 'usn_changed'])
+    await notify_change(session, user.directory_id)
     await session.commit()
+    await bump_change_counter(session)
 
 
 @auth_router.get('/setup')
@@ -292,7 +299,7 @@ async def first_setup(
         except IntegrityError:
             await session.rollback()
             raise HTTPException(status.HTTP_423_LOCKED)
-        else:
-            get_base_dn.cache_clear()
-            get_domain_sid.cache_clear()
-            get_domain_guid.cache_clear()
+        finally:
+            catalogue.clear()  # loaded by setup transaction
+
+    await bump_catalogue_counter(session)
@@ -18,6 +18,7 @@ from sqlalchemy import delete
 
 from api.auth import get_current_user
 from config import Settings, get_settings
+from ldap_protocol.catalogue import bump_catalogue_counter
 from ldap_protocol.multifactor import (
     Creds,
     MultifactorAPI,
@@ -68,6 +69,8 @@ async def setup_mfa(
             CatalogueSetting(name=mfa.secret_name, value=mfa.mfa_secret))
         await session.commit()
 
+    await bump_catalogue_counter(session)
+
     return True
 
 
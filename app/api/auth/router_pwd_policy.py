@@ -9,6 +9,7 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, status
 
 from api.auth import get_current_user
+from ldap_protocol.catalogue import bump_catalogue_counter
 from ldap_protocol.password_policy import PasswordPolicySchema
 from models.database import AsyncSession, get_session
 
@@ -25,7 +26,10 @@ async def create_policy(
     session: Annotated[AsyncSession, Depends(get_session)],
 ) -> PasswordPolicySchema:
     """Create current policy setting."""
-    return await policy.create_policy_settings(session)
+    await policy.create_policy_settings(session)
+    await session.commit()
+    await bump_catalogue_counter(session)
+    return policy
 
 
 @pwd_router.get('')
@@ -4,9 +4,10 @@ Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 
 from fastapi.params import Depends
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
 
 from api.auth import User, get_current_user
@@ -18,7 +19,7 @@ from ldap_protocol.ldap_requests import (
     ModifyDNRequest,
     ModifyRequest,
 )
-from ldap_protocol.ldap_responses import LDAPResult
+from ldap_protocol.ldap_responses import BaseResponse, LDAPResult
 from models.database import AsyncSession, get_session
 
 from .schema import SearchRequest, SearchResponse, SearchResultDone
@@ -50,9 +51,36 @@ async def search(
         search_result=responses,
         total_objects=metadata.total_objects,
         total_pages=metadata.total_pages,
+        next_cursor=metadata.next_cursor,
     )
 
 
+async def _ndjson(
+        responses: AsyncIterator[BaseResponse]) -> AsyncIterator[str]:
+    async for response in responses:
+        yield response.model_dump_json(by_alias=True) + '\n'
+
+
+@entry_router.post(
+    '/search/stream',
+    response_class=StreamingResponse,
+    responses={200: {'content': {'application/x-ndjson': {}}}},
+)
+async def search_stream(
+    request: SearchRequest,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    ldap_session: Annotated[LDAPSession, Depends(ldap_session)],
+) -> StreamingResponse:
+    """LDAP SEARCH entry request, streamed as newline delimited JSON.
+
+    Each line is a `SearchResultEntry`, written as soon as it is read,
+    the last line is `SearchResultDone` with result code and counts.
+    """
+    return StreamingResponse(
+        _ndjson(request.stream_api(ldap_session, session)),
+        media_type='application/x-ndjson')
+
+
 @entry_router.post('/add')
 async def add(
     request: AddRequest,
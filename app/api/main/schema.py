@@ -4,29 +4,40 @@ Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
+from functools import cached_property, lru_cache
+
 from pydantic import Field
-from sqlalchemy.sql.expression import Select
 
 from ldap_protocol.filter_interpreter import (
-    BoundQ,
     Filter,
-    cast_str_filter2sql,
+    FilterNode,
+    FilterParams,
+    parse_str_filter,
 )
 from ldap_protocol.ldap_requests import SearchRequest as LDAPSearchRequest
 from ldap_protocol.ldap_requests.base import APIMultipleResponseMixin
 from ldap_protocol.ldap_responses import SearchResultDone, SearchResultEntry
 
 
+@lru_cache(maxsize=1024)
+def _parse_str_filter(
+        filter_: str, base_dn: str) -> tuple[FilterNode, FilterParams]:
+    filter_ = filter_.lower().replace('objectcategory', 'objectclass')
+    return parse_str_filter(Filter.parse(filter_).simplify(), base_dn)
+
+
 class SearchRequest(APIMultipleResponseMixin, LDAPSearchRequest):  # noqa: D101
     filter: str = Field(..., examples=["(objectClass=*)"])  # noqa: A003
 
-    def cast_filter(
-        self, filter_: str, query: Select, base_dn: str,
-    ) -> BoundQ:
-        """Cast str filter to sa sql."""
-        filter_ = filter_.lower().replace('objectcategory', 'objectclass')
-        return cast_str_filter2sql(
-            Filter.parse(filter_).simplify(), query, base_dn)
+    @cached_property
+    def skip_values(self) -> bool:
+        """Values are always returned to web clients."""
+        return False
+
+    def parse_filter(self, base_dn: str) -> tuple[FilterNode, FilterParams]:
+        """Parse str filter, repeated filters are parsed once."""
+        node, params = _parse_str_filter(self.filter, base_dn)
+        return node, params.copy()
 
 
 class SearchResponse(SearchResultDone):  # noqa: D101
@@ -15,7 +15,12 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 
 from api.auth import get_current_user
-from ldap_protocol.utils import get_base_dn, get_groups, get_path_dn
+from ldap_protocol.utils import (
+    get_base_dn,
+    get_groups,
+    get_path_dn,
+    validate_dn_cache,
+)
 from models.database import AsyncSession, get_session
 from models.ldap3 import Directory, Group, NetworkPolicy
 
@@ -57,6 +62,7 @@ async def add_network_policy(
     mfa_group_dns = []
 
     base_dn = await get_base_dn(session)
+    await validate_dn_cache(session)
 
     if policy.groups:
         groups = await get_groups(policy.groups, session)
@@ -104,6 +110,7 @@ async def get_network_policies(
     :return list[PolicyResponse]: all policies
     """  # noqa: D205, D301
     base_dn = await get_base_dn(session)
+    await validate_dn_cache(session)
     groups = selectinload(NetworkPolicy.groups)\
         .selectinload(Group.directory)\
         .selectinload(Directory.path)
@@ -244,6 +251,7 @@ async def update_network_policy(
         selected_policy.mfa_status = request.mfa_status
 
     base_dn = await get_base_dn(session)
+    await validate_dn_cache(session)
 
     if request.groups is not None and len(request.groups) > 0:
         groups = await get_groups(request.groups, session)
@@ -43,6 +43,36 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str
 
     POSTGRES_URI: PostgresDsn = None  # type: ignore
+    POSTGRES_STATEMENT_CACHE_SIZE: int = 500
+
+    # connection pool of a process, shared by all handlers
+    POSTGRES_POOL_SIZE: int = 10
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_TIMEOUT: float = 30.0
+    POSTGRES_POOL_RECYCLE: int = -1  # max connection age, -1 is unlimited
+    POSTGRES_POOL_PRE_PING: bool = False
+    POSTGRES_POOL_STATS_SECONDS: float = 60.0  # stats log interval, 0 is off
+    # pgbouncer transaction pooling, statement caches are disabled,
+    # pgbouncer must track protocol prepared statements (1.21+)
+    POSTGRES_PGBOUNCER: bool = False
+
+    # read replicas, searches and binds are routed to them
+    POSTGRES_REPLICA_URIS: list[PostgresDsn] = []
+    POSTGRES_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    POSTGRES_REPLICA_CHECK_SECONDS: float = 5.0
+
+    # search results cache, disabled with zero ttl
+    SEARCH_CACHE_TTL_SECONDS: int = 0
+    SEARCH_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # search result, read before sending to release db connection,
+    # results over limits are spilled to temporary files
+    SEARCH_SPOOL_MAX_BYTES: int = 16 * 1024 * 1024
+    SEARCH_SPOOL_TOTAL_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # change notification searches per process
+    NOTIFICATION_MAX_SUBSCRIBERS: int = 100
+    NOTIFICATION_QUEUE_SIZE: int = 1000
 
     HOSTNAME: str | None = None
 
@@ -25,10 +25,15 @@ from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from config import Settings
-from ldap_protocol.utils import create_object_sid, generate_domain_sid
+from ldap_protocol.attribute_types import create_attributes
+from ldap_protocol.catalogue import catalogue
+from ldap_protocol.utils import (
+    create_object_sid,
+    generate_domain_sid,
+    refresh_nested_memberships,
+)
 from models.database import create_session_factory
 from models.ldap3 import (
-    Attribute,
     CatalogueSetting,
     Directory,
     Group,
@@ -65,8 +70,7 @@ async def _create_dir(
     async with session.begin_nested():
         session.add_all([dir_, path])
         if parent:
-            path.directories.extend(
-                [p.endpoint for p in parent.paths + [path]])
+            path.directories.extend(parent.path.directories + [dir_])
         else:
             dir_.paths.append(path)
 
@@ -92,14 +96,8 @@ async def _create_dir(
             data["attributes"].items(),
             [('objectClass', [dir_.object_class])])
 
-        for name, values in attrs:
-            for value in values:
-                session.add(Attribute(
-                    directory=dir_,
-                    name=name,
-                    value=value if isinstance(value, str) else None,
-                    bvalue=value if isinstance(value, bytes) else None,
-                ))
+        session.add_all(await create_attributes(session, dir_, (
+            (name, value) for name, values in attrs for value in values)))
 
     if 'organizationalPerson' in data:
         user_data = data['organizationalPerson']
@@ -113,10 +111,8 @@ async def _create_dir(
         )
         session.add(user)
         await session.flush()
-        session.add(Attribute(
-            directory=dir_,
-            name='homeDirectory',
-            value=f"/home/{user.uid}"))
+        session.add_all(await create_attributes(
+            session, dir_, [('homeDirectory', f"/home/{user.uid}")]))
 
         for group_name in user_data.get('groups', []):
             parent_group = await _get_group(group_name, session)
@@ -145,7 +141,7 @@ async def setup_enviroment(
 
     object_sid = generate_domain_sid()
 
-    catalogue = CatalogueSetting(
+    naming_context = CatalogueSetting(
         name='defaultNamingContext', value=dn)
     domain_sid = CatalogueSetting(
         name='domain_object_sid', value=object_sid)
@@ -153,7 +149,7 @@ async def setup_enviroment(
         name='domain_object_guid', value=str(uuid.uuid4()))
 
     async with session.begin_nested():
-        session.add(catalogue)
+        session.add(naming_context)
         session.add(domain_sid)
         session.add(domain_guid)
         session.add(NetworkPolicy(
@@ -163,10 +159,14 @@ async def setup_enviroment(
             priority=1,
         ))
         await session.flush()
+        catalogue.clear()  # read by current transaction, until commit
 
     try:
         for unit in data:
             await _create_dir(unit, session)
+
+        await refresh_nested_memberships(
+            session, await session.scalars(select(Group.id)))
     except Exception:
         import traceback
         logger.error(traceback.format_exc())  # noqa
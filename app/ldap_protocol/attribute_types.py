@@ -0,0 +1,134 @@
+"""Attribute types dictionary.
+
+Attribute values reference types by integer id, types are created
+on first use. Id of a committed type never changes, so ids are cached
+per process, while types created by a current transaction are not cached,
+as transaction may be rolled back.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.selectable import ScalarSelect
+
+from models.ldap3 import Attribute, AttributeType, Directory
+
+_CREATED_KEY = 'created_attribute_types'
+
+
+def get_type_id_query(name: str) -> ScalarSelect:
+    """Get attribute type id subquery, evaluated once per statement.
+
+    Unlike ids from `AttributeTypeMap`, subquery keeps compiled
+    statements independent of process state, for e.g. cached search plans.
+
+    :param str name: case-insensitive attribute name
+    :return ScalarSelect: type id or NULL for unknown attribute
+    """
+    return select(AttributeType.id).where(
+        AttributeType.lower_name == name.lower()).scalar_subquery()
+
+
+class AttributeTypeMap:
+    """In-process map of lowercase attribute names to types ids."""
+
+    def __init__(self) -> None:
+        """Set empty map."""
+        self._ids: dict[str, int] = {}
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._ids)
+
+    def clear(self) -> None:
+        """Drop cached ids."""
+        self._ids.clear()
+
+    async def get_ids(
+        self, session: AsyncSession, names: Iterable[str],
+        create: bool = True,
+    ) -> dict[str, int]:
+        """Get types ids.
+
+        :param AsyncSession session: db
+        :param Iterable[str] names: attribute names
+        :param bool create: create missing types, else skip them
+        :return dict[str, int]: ids by lowercase names
+        """
+        names_map = {name.lower(): name for name in names}
+        ids = {
+            lower_name: self._ids[lower_name]
+            for lower_name in names_map if lower_name in self._ids}
+        missing = sorted(names_map.keys() - ids.keys())  # lock order
+
+        if not missing:
+            return ids
+
+        created: set[str] = session.info.setdefault(_CREATED_KEY, set())
+        if create:
+            created.update(await session.scalars(
+                insert(AttributeType)
+                .values([
+                    {'name': names_map[lower_name], 'lowerName': lower_name}
+                    for lower_name in missing])
+                .on_conflict_do_nothing(index_elements=['lowerName'])
+                .returning(AttributeType.lower_name)))
+
+        result = await session.execute(
+            select(AttributeType.lower_name, AttributeType.id)
+            .where(AttributeType.lower_name.in_(missing)))
+
+        for lower_name, type_id in result:
+            ids[lower_name] = type_id
+            if lower_name not in created:
+                self._ids[lower_name] = type_id
+
+        return ids
+
+    async def get_id(self, session: AsyncSession, name: str) -> int | None:
+        """Get existing type id.
+
+        :param AsyncSession session: db
+        :param str name: attribute name
+        :return int | None: id, None if attribute was never set
+        """
+        ids = await self.get_ids(session, [name], create=False)
+        return ids.get(name.lower())
+
+
+attribute_types = AttributeTypeMap()
+
+
+async def create_attributes(
+    session: AsyncSession,
+    directory: Directory,
+    values: Iterable[tuple[str, str | bytes]],
+) -> list[Attribute]:
+    """Create attributes of directory, not added to session.
+
+    :param AsyncSession session: db
+    :param Directory directory: attributes owner
+    :param Iterable[tuple[str, str | bytes]] values: names and values
+    :return list[Attribute]: attributes
+    """
+    values = list(values)
+    type_ids = await attribute_types.get_ids(
+        session, (name for name, _ in values))
+
+    directory.add_object_classes(
+        value for name, value in values
+        if name.lower() == 'objectclass' and isinstance(value, str))
+
+    return [
+        Attribute(
+            type_id=type_ids[name.lower()],
+            value=value if isinstance(value, str) else None,
+            bvalue=value if isinstance(value, bytes) else None,
+            directory=directory,
+        )
+        for name, value in values
+    ]
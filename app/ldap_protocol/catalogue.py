@@ -0,0 +1,131 @@
+"""Catalogue settings snapshot.
+
+Naming context, domain identifiers, MFA credentials and password policy
+are read on most requests and change rarely, so they are loaded once
+into an immutable per-process snapshot. Writers increment catalogue
+change counter, shared by app replicas, after commit, other replicas
+reload snapshot once they notice the new counter value.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from sqlalchemy import case, column, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.ldap3 import CatalogueSetting, PasswordPolicy, catalogue_changes
+
+# max seconds to serve a snapshot, changed by another replica
+CATALOGUE_REFRESH_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class CatalogueSnapshot:
+    """Immutable catalogue settings."""
+
+    counter: int
+    settings: Mapping[str, str]
+    password_policy: Mapping[str, Any] | None
+
+    @property
+    def base_dn(self) -> str:
+        """Get base dn, e.g. `dc=multifactor,dc=dev`."""
+        return ','.join(
+            f'dc={value}' for value in self.domain.split('.'))
+
+    @property
+    def domain(self) -> str:
+        """Get domain name, e.g. `multifactor.dev`."""
+        return self.settings['defaultNamingContext']
+
+
+async def get_catalogue_counter(session: AsyncSession) -> int:
+    """Get catalogue change counter.
+
+    :param AsyncSession session: db
+    :return int: counter, 0 if settings were never changed
+    """
+    return await session.scalar(
+        select(case(
+            (column('is_called'), column('last_value')), else_=0))
+        .select_from(table(catalogue_changes.name)))
+
+
+class CatalogueCache:
+    """Per-process catalogue snapshot, swapped as a whole on change."""
+
+    def __init__(self, refresh_interval: float) -> None:
+        """Set empty cache.
+
+        :param float refresh_interval: seconds between counter checks
+        """
+        self._refresh_interval = refresh_interval
+        self._snapshot: CatalogueSnapshot | None = None
+        self._checked_at = 0.0
+        self._generation = 0
+
+    def clear(self) -> None:
+        """Drop snapshot, loads started before are not stored."""
+        self._snapshot = None
+        self._generation += 1
+
+    async def get(self, session: AsyncSession) -> CatalogueSnapshot:
+        """Get snapshot, reload if counter was changed.
+
+        :param AsyncSession session: db
+        :return CatalogueSnapshot: snapshot
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+
+        if snapshot is not None and \
+                now - self._checked_at < self._refresh_interval:
+            return snapshot
+
+        generation = self._generation
+        counter = await get_catalogue_counter(session)
+
+        if snapshot is None or snapshot.counter != counter:
+            snapshot = await self._load(session, counter)
+
+        if generation == self._generation:
+            self._snapshot = snapshot
+            self._checked_at = now
+
+        return snapshot
+
+    @staticmethod
+    async def _load(
+            session: AsyncSession, counter: int) -> CatalogueSnapshot:
+        settings = await session.execute(
+            select(CatalogueSetting.name, CatalogueSetting.value))
+        policy = await session.scalar(select(PasswordPolicy))
+
+        return CatalogueSnapshot(
+            counter=counter,
+            settings=MappingProxyType({
+                name: value for name, value in settings}),
+            password_policy=None if policy is None else MappingProxyType({
+                col.key: getattr(policy, col.key)
+                for col in PasswordPolicy.__mapper__.column_attrs}),
+        )
+
+
+catalogue = CatalogueCache(CATALOGUE_REFRESH_INTERVAL)
+
+
+async def bump_catalogue_counter(session: AsyncSession) -> None:
+    """Increment catalogue change counter and drop local snapshot.
+
+    Must be called after commit, so replicas never keep
+    a snapshot of a previous state with a new counter.
+
+    :param AsyncSession session: db
+    """
+    await session.execute(select(catalogue_changes.next_value()))
+    catalogue.clear()
@@ -0,0 +1,292 @@
+"""LDAP controls.
+
+RFC 4511 4.1.11, RFC 2891, draft-ietf-ldapext-ldapv3-vlv-09
+and MS-ADTS 3.1.1.3.4.1 reference.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+from asn1 import Classes, Decoder, Encoder, Numbers, Types
+from pydantic import BaseModel
+
+from .asn1parser import ASN1Row
+
+LDAP_SERVER_DIRSYNC_OID = '1.2.840.113556.1.4.841'
+LDAP_SERVER_NOTIFICATION_OID = '1.2.840.113556.1.4.528'
+LDAP_SERVER_SORT_OID = '1.2.840.113556.1.4.473'
+LDAP_SERVER_RESP_SORT_OID = '1.2.840.113556.1.4.474'
+LDAP_CONTROL_VLVREQUEST = '2.16.840.1.113730.3.4.9'
+LDAP_CONTROL_VLVRESPONSE = '2.16.840.1.113730.3.4.10'
+
+
+class Control(BaseModel):
+    """Controls class."""
+
+    control_type: str
+    criticality: bool = False
+    control_value: str | bytes = ''
+
+    @classmethod
+    def from_row(cls, row: ASN1Row) -> 'Control':
+        """Create control from decoded sequence.
+
+        ```
+        Control ::= SEQUENCE {
+            controlType             LDAPOID,
+            criticality             BOOLEAN DEFAULT FALSE,
+            controlValue            OCTET STRING OPTIONAL }
+        ```
+        """
+        control_type, *fields = row.value
+        control = cls(control_type=control_type.value)
+
+        for field in fields:
+            if field.tag_id.value == Numbers.Boolean:
+                control.criticality = field.value
+            else:
+                control.control_value = field.value
+
+        return control
+
+    @property
+    def value_bytes(self) -> bytes:
+        """Get raw control value, decoded by parser to a string if valid."""
+        if isinstance(self.control_value, bytes):
+            return self.control_value
+        return self.control_value.replace('\\x00', '\x00').encode()
+
+
+class DirSyncRequestValue(BaseModel):
+    """DirSync request control value.
+
+    ```
+    DirSyncRequestValue ::= SEQUENCE {
+        Flags       INTEGER,
+        MaxBytes    INTEGER,
+        Cookie      OCTET STRING }
+    ```
+
+    Cookie is an opaque USN, all entries with greater `uSNChanged`
+    are returned, empty cookie starts full synchronization.
+    """
+
+    flags: int = 0
+    max_bytes: int = 0
+    usn: int = 0
+
+    @classmethod
+    def from_control(cls, control: Control) -> 'DirSyncRequestValue':
+        """Decode control value.
+
+        :param Control control: request control
+        :raises ValueError: on invalid value or cookie
+        :return DirSyncRequestValue: request value
+        """
+        dec = Decoder()
+        dec.start(control.value_bytes)
+        dec.enter()
+        _, flags = dec.read()
+        _, max_bytes = dec.read()
+        _, cookie = dec.read()
+
+        return cls(
+            flags=flags, max_bytes=max_bytes,
+            usn=int(cookie) if cookie else 0)
+
+    def get_response(self, usn: int) -> Control:
+        """Create response control with a new cookie.
+
+        ```
+        DirSyncResponseValue ::= SEQUENCE {
+            MoreResults     INTEGER,
+            unused          INTEGER,
+            CookieServer    OCTET STRING }
+        ```
+
+        :param int usn: highest USN, committed before search
+        :return Control: response control
+        """
+        enc = Encoder()
+        enc.start()
+        enc.enter(Numbers.Sequence)
+        enc.write(0, Numbers.Integer)
+        enc.write(0, Numbers.Integer)
+        enc.write(str(usn).encode(), Numbers.OctetString)
+        enc.leave()
+
+        return Control(
+            control_type=LDAP_SERVER_DIRSYNC_OID,
+            control_value=enc.output())
+
+
+class SortKey(BaseModel):
+    """Server side sort key."""
+
+    attribute_type: str
+    ordering_rule: str | None = None
+    reverse_order: bool = False
+
+
+class SortRequestValue(BaseModel):
+    """Server side sort request control value.
+
+    ```
+    SortKeyList ::= SEQUENCE OF SEQUENCE {
+        attributeType   AttributeDescription,
+        orderingRule    [0] MatchingRuleId OPTIONAL,
+        reverseOrder    [1] BOOLEAN DEFAULT FALSE }
+    ```
+    """
+
+    keys: list[SortKey]
+
+    @classmethod
+    def from_control(cls, control: Control) -> 'SortRequestValue':
+        """Decode control value.
+
+        :param Control control: request control
+        :raises ValueError: on invalid value or empty key list
+        :return SortRequestValue: request value
+        """
+        dec = Decoder()
+        dec.start(control.value_bytes)
+        dec.enter()
+        keys = []
+
+        while not dec.eof():
+            dec.enter()
+            _, attribute_type = dec.read()
+            key = SortKey(attribute_type=attribute_type.decode())
+
+            while not dec.eof():
+                tag, value = dec.read()
+                if tag.nr == 0:
+                    key.ordering_rule = value.decode()
+                elif tag.nr == 1:
+                    key.reverse_order = value != b'\x00'
+
+            dec.leave()
+            keys.append(key)
+
+        if not keys:
+            raise ValueError('Empty sort key list')
+
+        return cls(keys=keys)
+
+    @staticmethod
+    def get_response(
+            result: int, attribute_type: str | None = None) -> Control:
+        """Create response control.
+
+        ```
+        SortResult ::= SEQUENCE {
+            sortResult      ENUMERATED,
+            attributeType   [0] AttributeDescription OPTIONAL }
+        ```
+
+        :param int result: LDAP result code of sorting
+        :param str | None attribute_type: key, that caused an error
+        :return Control: response control
+        """
+        enc = Encoder()
+        enc.start()
+        enc.enter(Numbers.Sequence)
+        enc.write(result, Numbers.Enumerated)
+        if attribute_type is not None:
+            enc.write(
+                attribute_type.encode(), nr=0,
+                typ=Types.Primitive, cls=Classes.Context)
+        enc.leave()
+
+        return Control(
+            control_type=LDAP_SERVER_RESP_SORT_OID,
+            control_value=enc.output())
+
+
+class VLVRequestValue(BaseModel):
+    """Virtual list view request control value.
+
+    ```
+    VirtualListViewRequest ::= SEQUENCE {
+        beforeCount     INTEGER (0..maxInt),
+        afterCount      INTEGER (0..maxInt),
+        target          CHOICE {
+            byOffset            [0] SEQUENCE {
+                offset          INTEGER (1 .. maxInt),
+                contentCount    INTEGER (0 .. maxInt) },
+            greaterThanOrEqual  [1] AssertionValue },
+        contextID       OCTET STRING OPTIONAL }
+    ```
+
+    Window is `beforeCount` entries before target, target
+    and `afterCount` entries after it, in order of sort control.
+    """
+
+    before_count: int
+    after_count: int
+    offset: int = 0
+    content_count: int = 0
+    assertion_value: str | None = None  # set if target is not by offset
+    context_id: bytes | None = None
+
+    @classmethod
+    def from_control(cls, control: Control) -> 'VLVRequestValue':
+        """Decode control value.
+
+        :param Control control: request control
+        :raises ValueError: on invalid value
+        :return VLVRequestValue: request value
+        """
+        dec = Decoder()
+        dec.start(control.value_bytes)
+        dec.enter()
+        _, before_count = dec.read()
+        _, after_count = dec.read()
+        value = cls(before_count=before_count, after_count=after_count)
+
+        if dec.peek().nr == 0:
+            dec.enter()
+            _, value.offset = dec.read()
+            _, value.content_count = dec.read()
+            dec.leave()
+        else:
+            _, assertion_value = dec.read()
+            value.assertion_value = assertion_value.decode()
+
+        if not dec.eof():
+            _, value.context_id = dec.read()
+
+        return value
+
+    def get_response(
+            self, target_position: int, content_count: int,
+            result: int) -> Control:
+        """Create response control.
+
+        ```
+        VirtualListViewResponse ::= SEQUENCE {
+            targetPosition          INTEGER (0 .. maxInt),
+            contentCount            INTEGER (0 .. maxInt),
+            virtualListViewResult   ENUMERATED,
+            contextID               OCTET STRING OPTIONAL }
+        ```
+
+        :param int target_position: 1-based target position
+        :param int content_count: entries count in list
+        :param int result: LDAP result code of list view
+        :return Control: response control
+        """
+        enc = Encoder()
+        enc.start()
+        enc.enter(Numbers.Sequence)
+        enc.write(target_position, Numbers.Integer)
+        enc.write(content_count, Numbers.Integer)
+        enc.write(result, Numbers.Enumerated)
+        if self.context_id is not None:
+            enc.write(self.context_id, Numbers.OctetString)
+        enc.leave()
+
+        return Control(
+            control_type=LDAP_CONTROL_VLVRESPONSE,
+            control_value=enc.output())
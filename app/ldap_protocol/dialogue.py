@@ -5,11 +5,11 @@ License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
 import asyncio
-from contextlib import asynccontextmanager, suppress
+from contextlib import suppress
 from enum import IntEnum
 from ipaddress import IPv4Address, ip_address
 from types import TracebackType
-from typing import TYPE_CHECKING, AsyncIterator
+from typing import TYPE_CHECKING
 
 import httpx
 from loguru import logger
@@ -69,7 +69,10 @@ class LDAPCodes(IntEnum):
     UNAVAILABLE = 52
     UNWILLING_TO_PERFORM = 53
     LOOP_DETECT = 54
-    # -- 55-63 unused --
+    # -- 55-59 unused --
+    SORT_CONTROL_MISSING = 60
+    OFFSET_RANGE_ERROR = 61
+    # -- 62-63 unused --
     NAMING_VIOLATION = 64
     OBJECT_CLASS_VIOLATION = 65
     NOT_ALLOWED_ON_NON_LEAF = 66
@@ -117,7 +120,10 @@ class LDAPCodes(IntEnum):
     UNAVAILABLE = 52
     UNWILLING_TO_PERFORM = 53
     LOOP_DETECT = 54
-    # -- 55-63 unused --
+    # -- 55-59 unused --
+    SORT_CONTROL_MISSING = 60
+    OFFSET_RANGE_ERROR = 61
+    # -- 62-63 unused --
     NAMING_VIOLATION = 64
     OBJECT_CLASS_VIOLATION = 65
     NOT_ALLOWED_ON_NON_LEAF = 66
@@ -150,10 +156,12 @@ class Session:
         user: User | None = None,
         settings: Settings | None = None,
     ) -> None:
-        """Set lock."""
-        self._lock = asyncio.Lock()
+        """Set session."""
         self._user: User | None = user
         self.queue: asyncio.Queue['LDAPRequestMessage'] = asyncio.Queue()
+        self.closed = asyncio.Event()
+        # monotonic time, until which reads go to primary after a write
+        self.primary_until = 0.0
 
         if settings:
             self.settings = settings
@@ -177,25 +185,16 @@ class Session:
             'Cannot manually set user, use `set_user()` instead')
 
     async def set_user(self, user: User) -> None:
-        """Bind user to session concurrently save."""
-        async with self._lock:
-            self._user = user
+        """Bind user to session, operations in progress keep previous one."""
+        self._user = user
 
     async def delete_user(self) -> None:
-        """Unbind user from session concurrently save."""
-        async with self._lock:
-            self._user = None
+        """Unbind user from session."""
+        self._user = None
 
     async def get_user(self) -> User:
-        """Get user from session concurrently save."""
-        async with self._lock:
-            return self._user
-
-    @asynccontextmanager
-    async def lock(self) -> AsyncIterator[User]:
-        """Lock session, user cannot be deleted or get while lock is set."""
-        async with self._lock:
-            yield self._user
+        """Get bound user, snapshot is not changed by next binds."""
+        return self._user
 
     async def __aenter__(self) -> 'Session':  # noqa
         self.client = await httpx.AsyncClient().__aenter__()
@@ -208,6 +207,7 @@ class Session:
         tb: TracebackType | None,
     ) -> None:
         """Close writer and queue."""
+        self.closed.set()  # stop long running requests, e.g. notifications
         with suppress(RuntimeError):
             await self.queue.join()
             self.writer.close()
@@ -2,63 +2,215 @@
 
 RFC 4511 reference.
 
+Filters are parsed into a tree of `FilterGroup` and `FilterTerm` nodes,
+where assertion values are replaced with names of bound parameters.
+Tree is hashable and equal for filters of the same shape,
+so it is used as a key of compiled statements cache,
+while parameters are passed on execution.
+
 Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 import uuid
+from dataclasses import dataclass
 from operator import eq, ge, le, ne
+from typing import Any, Callable, Union
 
 from ldap_filter import Filter
-from sqlalchemy import and_, func, not_, or_, select
+from sqlalchemy import (
+    and_,
+    bindparam,
+    cast,
+    false,
+    func,
+    not_,
+    or_,
+    select,
+    true,
+)
+from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.orm import aliased
-from sqlalchemy.sql.elements import UnaryExpression
+from sqlalchemy.sql.elements import (
+    BindParameter,
+    ColumnElement,
+    UnaryExpression,
+)
 from sqlalchemy.sql.expression import Select
 from sqlalchemy.sql.operators import ColumnOperators
-
-from models.ldap3 import Attribute, Directory, Group, GroupMembership, User
+from sqlalchemy.sql.selectable import ScalarSelect
+from sqlalchemy.types import Integer, NullType, String
+
+from models.ldap3 import (
+    Attribute,
+    Directory,
+    Group,
+    GroupMembership,
+    NestedMembership,
+    Path,
+    User,
+)
 
 from .asn1parser import ASN1Row
+from .attribute_types import get_type_id_query
 from .utils import get_path_filter, get_search_path
 
-BoundQ = tuple[UnaryExpression, Select]
+BoundQ = tuple[ColumnElement, Select]
+FilterParams = dict[str, Any]
+
+LDAP_MATCHING_RULE_IN_CHAIN = '1.2.840.113556.1.4.1941'
+
+SUBSTRING = '*='
+_OPERATORS = {'=': eq, '>=': ge, '<=': le, '~=': ne}
+_GROUP_OPERATORS: dict[str, Callable[..., ColumnElement]] = {
+    '&': and_, '|': or_, '!': not_}
+
+# compared as numbers, for e.g. `(uSNChanged>=1024)` is an index range scan
+INTEGER_COLUMNS = frozenset(
+    attr for model, fields in (
+        (Directory, Directory.search_fields), (User, User.search_fields))
+    for attr in fields if isinstance(getattr(model, attr).type, Integer))
+
+
+@dataclass(frozen=True)
+class FilterTerm:
+    """Filter assertion without value.
+
+    kind: `present`, `column` (native User or Directory field),
+        `attribute`, `bvalue` (binary attribute value),
+        `objectclass` (value of `Directory.object_classes` array),
+        `memberof` and `in_chain` (LDAP_MATCHING_RULE_IN_CHAIN).
+    attr: lowercase attribute name
+    op: comparison, one of `=`, `>=`, `<=`, `~=` or `*=` for substring
+    param: name of bound parameter with assertion value
+    """
+
+    kind: str
+    attr: str
+    op: str = '='
+    param: str | None = None
+
+
+@dataclass(frozen=True)
+class FilterGroup:
+    """Filter set: `&`, `|` or `!`."""
+
+    op: str
+    items: tuple['FilterNode', ...]
+
+
+FilterNode = Union[FilterTerm, FilterGroup]
+
+# absolute true and false filters, RFC 4526
+FILTER_TRUE = FilterGroup('&', ())
+FILTER_FALSE = FilterGroup('|', ())
+
+
+def _add_param(params: FilterParams, value: Any) -> str:
+    name = f'filter_{len(params)}'
+    params[name] = value
+    return name
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
 
 
 def _get_substring(right: ASN1Row) -> str:  # RFC 4511
-    expr = right.value[0]
-    value = expr.value
-    index = expr.tag_id.value
-    return [f"{value}%", f"%{value}%", f"%{value}"][index]
+    """Get `LIKE` pattern from substring filter components.
+
+    ```
+    substrings SEQUENCE SIZE (1..MAX) OF substring CHOICE {
+        initial [0] AssertionValue,  -- can occur at most once
+        any     [1] AssertionValue,
+        final   [2] AssertionValue } -- can occur at most once
+    ```
+    """
+    initial, final = '', ''
+    middle = []
+
+    for expr in right.value:
+        value = expr.value
+        if isinstance(value, bytes):  # final [2] is decoded as integer tag
+            value = value.decode()
+        value = _escape_like(str(value))
+
+        if expr.tag_id.value == 0:
+            initial = value
+        elif expr.tag_id.value == 1:
+            middle.append(value)
+        else:
+            final = value
 
+    return '%'.join([initial, *middle, final])
 
-def _from_filter(
-    model: type, item: ASN1Row, attr: str, right: ASN1Row,
-) -> UnaryExpression:
-    is_substring = item.tag_id.value == 4
-    col = getattr(model, attr)
 
-    if is_substring:
-        return col.ilike(_get_substring(right))
-    op_method = {3: eq, 5: ge, 6: le, 8: ne}[item.tag_id.value]
-    if attr == 'objectguid':
-        col = col
-        value = str(uuid.UUID(bytes_le=right.value))
-    else:
+def _get_str_substring(value: str) -> str:
+    """Get `LIKE` pattern from string substring assertion `a*b*c`."""
+    return '%'.join(_escape_like(part) for part in value.split('*'))
+
+
+def _native_cond(model: type, cond: ColumnElement) -> ColumnElement:
+    """Get two-valued condition on a native column.
+
+    `User` row is optional for directory, so user conditions are
+    wrapped with `IN` semijoin, which never yields `NULL`
+    and keeps `NOT` and presence filters correct.
+    """
+    if model is User:
+        return Directory.id.in_(select(User.directory_id).where(cond))
+    return cond
+
+
+def _attribute_cond(attr: str, *conditions: ColumnElement) -> ColumnElement:
+    """Get `IN` semijoin on directory attribute values.
+
+    Unlike outer join per term, semijoin never multiplies directory rows
+    and `NOT` is applied to the whole set of attribute values.
+    Uncorrelated subquery is planned as a semi join inside `AND`
+    and as a hashed subplan inside `OR` and `NOT`.
+    """
+    return Directory.id.in_(
+        select(Attribute.directory_id).where(
+            Attribute.type_id == get_type_id_query(attr), *conditions))
+
+
+def _present_cond(attr: str) -> ColumnElement:
+    """Get condition for presence filter, for e.g. `(attibuteName=*)`."""
+    if attr in User.search_fields:
+        return _native_cond(User, getattr(User, attr).is_not(None))
+
+    if attr in Directory.search_fields:
+        return getattr(Directory, attr).is_not(None)
+
+    return _attribute_cond(attr)
+
+
+def _column_cond(term: FilterTerm, value: BindParameter) -> ColumnElement:
+    model = User if term.attr in User.search_fields else Directory
+    col = getattr(model, term.attr)
+
+    if term.op == SUBSTRING:
+        return _native_cond(model, and_(col.is_not(None), col.ilike(value)))
+
+    if term.attr != 'objectguid' and term.attr not in INTEGER_COLUMNS:
         col = func.lower(col)
-        value = right.value.lower()
-    return op_method(col, value)
+
+    return _native_cond(
+        model, and_(col.is_not(None), _OPERATORS[term.op](col, value)))
+
+
+def _get_group_id_subquery(path: BindParameter) -> ScalarSelect:
+    return select(Group.id).join(  # noqa: ECE001
+        Directory.group).join(Directory.path).where(
+            get_path_filter(path)).scalar_subquery()
 
 
 def _filter_memberof(
-    method: ColumnOperators, dn: str, base_dn: str,
+    method: ColumnOperators, path: BindParameter,
 ) -> UnaryExpression:
     """Retrieve query conditions with the memberOF attribute."""
     parent_group = aliased(Group)
-    group_path = get_search_path(dn, base_dn)
-    path_filter = get_path_filter(group_path)
-
-    group_id_subquery = select(Group.id).join(  # noqa: ECE001
-        Directory.group).join(Directory.path).where(
-            path_filter).scalar_subquery()
+    group_id_subquery = _get_group_id_subquery(path)
 
     users_with_group = (
         select(User.directory_id)
@@ -76,163 +228,276 @@ def _filter_memberof(
     return method(users_with_group) | method(child_groups)  # type: ignore
 
 
-def _ldap_filter_memberof(
-    item: ASN1Row, right: ASN1Row, base_dn: str,
-) -> UnaryExpression:
-    """Retrieve query conditions with the memberOF attribute."""
-    if item.tag_id.value == 3:
-        method = Directory.id.in_
-    elif item.tag_id.value == 8:
-        method = Directory.id.not_in
-    else:
-        raise ValueError('Incorrect operation method')
+def _filter_in_chain(attr: str, path: BindParameter) -> ColumnElement:
+    """Retrieve LDAP_MATCHING_RULE_IN_CHAIN conditions.
 
-    return _filter_memberof(method, right.value, base_dn)
+    `memberOf` selects direct and nested members of a group,
+    `member` selects groups, which contain an entry directly or nested.
+    Both are resolved with the single `NestedMemberships` lookup.
+    """
+    if attr == 'memberof':
+        return Directory.id.in_(
+            select(NestedMembership.directory_id)
+            .where(NestedMembership.group_id == _get_group_id_subquery(path)))
 
+    directory_id = select(Path.endpoint_id).where(
+        get_path_filter(path)).scalar_subquery()
 
-def _cast_item(
-    item: ASN1Row, query: Select, base_dn: str,
-) -> BoundQ:
-    # present, for e.g. `attibuteName=*`, `(attibuteName)`
-    if item.tag_id.value == 7:
-        attr = item.value.lower().replace('objectcategory', 'objectclass')
+    return Directory.id.in_(
+        select(Group.directory_id)
+        .join(NestedMembership, NestedMembership.group_id == Group.id)
+        .where(NestedMembership.directory_id == directory_id))
+
+
+def _compile_term(term: FilterTerm, params: FilterParams) -> ColumnElement:
+    if term.kind == 'present' or term.param is None:
+        return _present_cond(term.attr)
 
-        if attr in User.search_fields:
-            return not_(eq(getattr(User, attr), None)), query
+    if term.kind == 'column':
+        # untyped parameter adopts type of compared column, for e.g. UUID
+        return _column_cond(
+            term, bindparam(term.param, params[term.param], type_=NullType()))
 
-        if attr in Directory.search_fields:
-            return not_(eq(getattr(Directory, attr), None)), query
+    value: BindParameter = bindparam(term.param, params[term.param])
 
-        return func.lower(Attribute.name) == item.value.lower(), query
+    if term.kind == 'attribute':
+        if term.op == SUBSTRING:
+            return _attribute_cond(term.attr, Attribute.value.ilike(value))
+        return _attribute_cond(
+            term.attr, func.lower(Attribute.value) == value)
+
+    if term.kind == 'objectclass':  # GIN index containment
+        return Directory.object_classes.contains(array([cast(value, String)]))
+
+    if term.kind == 'bvalue':  # binary values are compared as is
+        return _attribute_cond(term.attr, Attribute.bvalue == value)
+
+    if term.kind == 'memberof':
+        method = Directory.id.in_ if term.op == '=' else Directory.id.not_in
+        return _filter_memberof(method, value)
+
+    return _filter_in_chain(term.attr, value)
+
+
+def compile_filter(node: FilterNode, params: FilterParams) -> ColumnElement:
+    """Compile filter tree to SQLAlchemy condition.
+
+    Every term is compiled to a two-valued condition on `Directory`
+    row: native columns or `IN` semijoins, without additional joins.
+    Assertion values are bound parameters, named as in `params`.
+
+    :param FilterNode node: filter tree
+    :param FilterParams params: bound parameters values
+    :return ColumnElement: condition
+    """
+    if node == FILTER_TRUE:
+        return true()
+
+    if node == FILTER_FALSE:
+        return false()
+
+    if isinstance(node, FilterGroup):
+        return _GROUP_OPERATORS[node.op](*(
+            compile_filter(item, params) for item in node.items))
+
+    return _compile_term(node, params)
+
+
+def _get_in_chain_term(
+    attr: str, rule: str, dn: str, params: FilterParams, base_dn: str,
+) -> FilterTerm:
+    if rule != LDAP_MATCHING_RULE_IN_CHAIN:
+        raise ValueError('Unsupported matching rule')
+
+    if attr not in ('memberof', 'member'):
+        raise ValueError('Inappropriate matching rule attribute')
+
+    return FilterTerm(
+        'in_chain', attr,
+        param=_add_param(params, get_search_path(dn, base_dn)))
+
+
+def _get_memberof_term(
+    op: str | None, dn: str, params: FilterParams, base_dn: str,
+) -> FilterTerm:
+    if op not in ('=', '~='):
+        raise ValueError('Incorrect operation method')
+
+    return FilterTerm(
+        'memberof', 'memberof', op,
+        _add_param(params, get_search_path(dn, base_dn)))
+
+
+def _parse_extensible(
+    item: ASN1Row, params: FilterParams, base_dn: str,
+) -> FilterTerm:
+    """Parse extensible match filter.
+
+    ```
+    MatchingRuleAssertion ::= SEQUENCE {
+        matchingRule    [1] MatchingRuleId OPTIONAL,
+        type            [2] AttributeDescription OPTIONAL,
+        matchValue      [3] AssertionValue,
+        dnAttributes    [4] BOOLEAN DEFAULT FALSE }
+    ```
+    """
+    fields = {  # context tags are decoded as universal types, for e.g.
+        # type [2] as INTEGER with bytes value
+        field.tag_id.value: field.value.decode()
+        if isinstance(field.value, bytes) else field.value
+        for field in item.value
+    }
+
+    return _get_in_chain_term(
+        str(fields.get(2, '')).lower(), str(fields.get(1, '')),
+        fields[3], params, base_dn)
+
+
+def _parse_item(
+    item: ASN1Row, params: FilterParams, base_dn: str,
+) -> FilterTerm:
+    # extensible match, for e.g. `memberOf:1.2.840.113556.1.4.1941:=dn`
+    if item.tag_id.value == 9:
+        return _parse_extensible(item, params, base_dn)
+
+    # present, for e.g. `attibuteName=*`, `(attibuteName)`
+    if item.tag_id.value == 7:
+        attr = item.value.lower().replace('objectcategory', 'objectclass')
+        return FilterTerm('present', attr)
 
     left, right = item.value
     attr = left.value.lower().replace('objectcategory', 'objectclass')
 
     is_substring = item.tag_id.value == 4
 
-    if attr in User.search_fields:  # noqa: R505
-        return _from_filter(User, item, attr, right), query
-    elif attr in Directory.search_fields:
-        return _from_filter(Directory, item, attr, right), query
-    elif attr == 'memberof':
-        return _ldap_filter_memberof(item, right, base_dn), query
-    else:
-        attribute_q = aliased(Attribute)
-        query = query.join(
-            attribute_q, and_(
-                attribute_q.directory_id == Directory.id,
-                func.lower(attribute_q.name) == attr),
-            isouter=True,
-        )
-
+    if attr in User.search_fields or attr in Directory.search_fields:
         if is_substring:
-            cond = attribute_q.value.ilike(_get_substring(right))
+            return FilterTerm(
+                'column', attr, SUBSTRING,
+                _add_param(params, _get_substring(right)))
+
+        op = {3: '=', 5: '>=', 6: '<=', 8: '~='}[item.tag_id.value]
+        value: str | int
+        if attr == 'objectguid':
+            value = str(uuid.UUID(bytes_le=right.value))
+        elif attr in INTEGER_COLUMNS:
+            value = int(right.value)
         else:
-            if isinstance(right.value, str):
-                cond = func.lower(attribute_q.value) == right.value.lower()
-            else:
-                cond = func.lower(attribute_q.bvalue) == right.value
-
-        return cond, query
+            value = right.value.lower()
+        return FilterTerm('column', attr, op, _add_param(params, value))
 
+    if attr == 'memberof':
+        return _get_memberof_term(
+            {3: '=', 8: '~='}.get(item.tag_id.value),
+            right.value, params, base_dn)
 
-def cast_filter2sql(
-    expr: ASN1Row, query: Select, base_dn: str,
-) -> BoundQ:
-    """Recursively cast Filter to SQLAlchemy conditions."""
-    if expr.tag_id.value in range(3):
-        conditions = []
-        for item in expr.value:
-            if item.tag_id.value in range(3):  # &|!
-                cond, query = cast_filter2sql(item, query, base_dn)
-                conditions.append(cond)
-                continue
+    if is_substring:
+        return FilterTerm(
+            'attribute', attr, SUBSTRING,
+            _add_param(params, _get_substring(right)))
 
-            cond, query = _cast_item(item, query, base_dn)
-            conditions.append(cond)
+    if attr == 'objectclass' and item.tag_id.value == 3 and isinstance(
+            right.value, str):
+        return FilterTerm(
+            'objectclass', attr, param=_add_param(
+                params, right.value.lower()))
 
-        return [and_, or_, not_][expr.tag_id.value](*conditions), query
+    if isinstance(right.value, str):
+        return FilterTerm(
+            'attribute', attr, param=_add_param(params, right.value.lower()))
 
-    return _cast_item(expr, query, base_dn)
+    return FilterTerm('bvalue', attr, param=_add_param(params, right.value))
 
 
-def _from_str_filter(
-        model: type, is_substring: bool, item: Filter) -> UnaryExpression:
-    col = getattr(model, item.attr)
+def parse_filter(
+    expr: ASN1Row, base_dn: str, params: FilterParams | None = None,
+) -> tuple[FilterNode, FilterParams]:
+    """Parse asn1 filter to filter tree and bound parameters.
 
-    if is_substring:
-        return col.ilike(item.val.replace('*', '%'))
-    op_method = {'=': eq, '>=': ge, '<=': le, '~=': ne}[item.comp]
-    col = col if item.attr == 'objectguid' else func.lower(col)
-    return op_method(col, item.val)
+    :param ASN1Row expr: filter
+    :param str base_dn: domain dn
+    :param FilterParams | None params: parameters of enclosing filter
+    :return tuple[FilterNode, FilterParams]: tree and parameters
+    """
+    params = {} if params is None else params
 
+    if expr.tag_id.value in range(3):  # &|!
+        items = tuple(
+            parse_filter(item, base_dn, params)[0] for item in expr.value)
+        return FilterGroup('&|!'[expr.tag_id.value], items), params
 
-def _api_filter_memberof(
-    item: Filter, base_dn: str,
-) -> UnaryExpression:
-    """Retrieve query conditions with the memberOF attribute."""
-    if item.comp == '=':
-        method = Directory.id.in_
-    elif item.comp == '~=':
-        method = Directory.id.not_in
-    else:
-        raise ValueError('Incorrect operation method')
+    return _parse_item(expr, params, base_dn), params
 
-    return _filter_memberof(method, item.val, base_dn)
 
+def _parse_str_item(
+    item: Filter, params: FilterParams, base_dn: str,
+) -> FilterTerm:
+    if ':' in item.attr:
+        attr, _, rule = item.attr.rstrip(':').partition(':')
 
-def _cast_filt_item(item: Filter, query: Select, base_dn: str) -> BoundQ:
-    if item.val == '*':
-        if item.attr in User.search_fields:
-            return not_(eq(getattr(User, item.attr), None)), query
+        if item.comp != '=':
+            raise ValueError('Unsupported matching rule')
 
-        if item.attr in Directory.search_fields:
-            return not_(eq(getattr(Directory, item.attr), None)), query
+        return _get_in_chain_term(attr, rule, item.val, params, base_dn)
 
-        return func.lower(Attribute.name) == item.attr, query
+    if item.val == '*':
+        return FilterTerm('present', item.attr)
 
-    is_substring = item.val.startswith('*') or item.val.endswith('*')
+    is_substring = '*' in item.val
 
-    if item.attr in User.search_fields:  # noqa: R505
-        return _from_str_filter(User, is_substring, item), query
-    elif item.attr in Directory.search_fields:
-        return _from_str_filter(Directory, is_substring, item), query
+    if item.attr in User.search_fields or item.attr in Directory.search_fields:
+        kind = 'column'
     elif item.attr == 'memberof':
-        return _api_filter_memberof(item, base_dn), query
+        return _get_memberof_term(item.comp, item.val, params, base_dn)
     else:
-        attribute_q = aliased(Attribute)
-        query = query.join(
-            attribute_q, and_(
-                attribute_q.directory_id == Directory.id,
-                func.lower(attribute_q.name) == item.attr),
-            isouter=True,
-        )
+        kind = 'attribute'
 
-        if is_substring:
-            cond = attribute_q.value.ilike(item.val.replace('*', '%'))
-        else:
-            cond = func.lower(attribute_q.value) == item.val
+    if is_substring:
+        return FilterTerm(
+            kind, item.attr, SUBSTRING,
+            _add_param(params, _get_str_substring(item.val)))
+
+    if kind == 'attribute':
+        if item.attr == 'objectclass' and item.comp == '=':
+            kind = 'objectclass'
+        return FilterTerm(kind, item.attr, param=_add_param(params, item.val))
 
-        return cond, query
+    if item.attr in INTEGER_COLUMNS:
+        return FilterTerm(
+            kind, item.attr, item.comp, _add_param(params, int(item.val)))
+
+    return FilterTerm(
+        kind, item.attr, item.comp, _add_param(params, item.val))
+
+
+def parse_str_filter(
+    expr: Filter, base_dn: str, params: FilterParams | None = None,
+) -> tuple[FilterNode, FilterParams]:
+    """Parse ldap filter string object to filter tree and parameters.
+
+    :param Filter expr: parsed lowercase filter
+    :param str base_dn: domain dn
+    :param FilterParams | None params: parameters of enclosing filter
+    :return tuple[FilterNode, FilterParams]: tree and parameters
+    """
+    params = {} if params is None else params
+
+    if expr.type == "group":
+        items = tuple(
+            parse_str_filter(item, base_dn, params)[0]
+            for item in expr.filters)
+        return FilterGroup(expr.comp, items), params
+
+    return _parse_str_item(expr, params, base_dn), params
+
+
+def cast_filter2sql(
+    expr: ASN1Row, query: Select, base_dn: str,
+) -> BoundQ:
+    """Cast asn1 Filter to SQLAlchemy conditions."""
+    return compile_filter(*parse_filter(expr, base_dn)), query
 
 
 def cast_str_filter2sql(expr: Filter, query: Select, base_dn: str) -> BoundQ:
     """Cast ldap filter to sa query."""
-    if expr.type == "group":
-        conditions = []
-        for item in expr.filters:
-            if expr.type == "group":
-                cond, query = cast_str_filter2sql(item, query, base_dn)
-                conditions.append(cond)
-                continue
-
-            cond, query = _cast_filt_item(item, query, base_dn)
-            conditions.append(cond)
-
-        return {  # type: ignore
-            '&': and_,
-            '|': or_,
-            '!': not_,
-        }[expr.comp](*conditions), query
-
-    return _cast_filt_item(expr, query, base_dn)
+    return compile_filter(*parse_str_filter(expr, base_dn)), query
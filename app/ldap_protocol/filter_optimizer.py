@@ -0,0 +1,184 @@
+"""Logical optimizer of parsed LDAP filter tree.
+
+Optimizer rewrites filter tree before SQL generation:
+
+- presence of attributes, which every entry has, is folded to true
+- nested sets of the same type and single item sets are flattened
+- double negation is removed, duplicated items are dropped
+- items of sets are ordered by selectivity, native columns first
+- contradictions (`(&(cn=a)(!(cn=a)))`, `(&(cn=a)(cn=b))`)
+    are folded to absolute false filter, which is not sent to db
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+from typing import Hashable
+
+from models.ldap3 import Directory, User
+
+from .filter_interpreter import (
+    FILTER_FALSE,
+    FILTER_TRUE,
+    SUBSTRING,
+    FilterGroup,
+    FilterNode,
+    FilterParams,
+    FilterTerm,
+)
+
+ALWAYS_PRESENT = frozenset({'objectclass', 'cn', 'name', 'objectguid'})
+SINGLE_VALUED = frozenset(Directory.search_fields) | frozenset(
+    User.search_fields)
+VALUE_KINDS = frozenset({'attribute', 'bvalue', 'objectclass'})
+
+
+def _freeze(value: object) -> Hashable:
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _get_key(node: FilterNode, params: FilterParams) -> Hashable:
+    """Get key of node with values instead of parameters names."""
+    if isinstance(node, FilterGroup):
+        return node.op, tuple(_get_key(item, params) for item in node.items)
+
+    return (
+        node.kind, node.attr, node.op,
+        _freeze(params.get(node.param)) if node.param else None)
+
+
+def _get_rank(node: FilterNode) -> int:
+    """Get evaluation order of set item, most selective first."""
+    if isinstance(node, FilterGroup):
+        return 6
+
+    if node.kind == 'column' and node.op == '=':
+        return 0 if node.attr in Directory.search_fields else 1
+
+    if node.kind in ('memberof', 'in_chain'):
+        return 2
+
+    if node.kind in VALUE_KINDS and node.op != SUBSTRING:
+        return 3
+
+    if node.kind == 'present':
+        return 5
+
+    return 4
+
+
+def _is_contradiction(items: list[FilterNode], params: FilterParams) -> bool:
+    """Check if `&` set items can't be true for any entry."""
+    values: dict[str, Hashable] = {}
+    keys = set()
+
+    for item in items:
+        if isinstance(item, FilterTerm):
+            keys.add(_get_key(item, params))
+
+            if item.kind == 'column' and item.op == '=' and (
+                    item.attr in SINGLE_VALUED):
+                value = _freeze(params[item.param])  # type: ignore
+                if values.setdefault(item.attr, value) != value:
+                    return True
+
+    for item in items:
+        if not (isinstance(item, FilterGroup) and item.op == '!'):
+            continue
+
+        negated = item.items[0]
+
+        if _get_key(negated, params) in keys:
+            return True
+
+        if isinstance(negated, FilterTerm) and negated.kind == 'present' and (
+            any(
+                isinstance(term, FilterTerm) and term.attr == negated.attr
+                and (term.kind == 'column' or term.kind in VALUE_KINDS)
+                for term in items)):
+            return True
+
+    return False
+
+
+def _is_tautology(items: list[FilterNode], params: FilterParams) -> bool:
+    """Check if `|` set items contain both item and its negation."""
+    keys = {_get_key(item, params) for item in items}
+
+    return any(
+        isinstance(item, FilterGroup) and item.op == '!'
+        and _get_key(item.items[0], params) in keys
+        for item in items)
+
+
+def _optimize_not(item: FilterNode) -> FilterNode:
+    if item == FILTER_TRUE:
+        return FILTER_FALSE
+
+    if item == FILTER_FALSE:
+        return FILTER_TRUE
+
+    if isinstance(item, FilterGroup) and item.op == '!':
+        return item.items[0]
+
+    return FilterGroup('!', (item,))
+
+
+def optimize_filter(node: FilterNode, params: FilterParams) -> FilterNode:
+    """Optimize filter tree.
+
+    :param FilterNode node: parsed filter tree
+    :param FilterParams params: filter parameters
+    :return FilterNode: equivalent filter tree,
+        `FILTER_FALSE` if filter matches no entries
+    """
+    if isinstance(node, FilterTerm):
+        if node.kind == 'present' and node.attr in ALWAYS_PRESENT:
+            return FILTER_TRUE
+        return node
+
+    items = [optimize_filter(item, params) for item in node.items]
+
+    if node.op == '!':
+        return _optimize_not(items[0])
+
+    if node.op == '&':
+        absorbing, neutral = FILTER_FALSE, FILTER_TRUE
+    else:
+        absorbing, neutral = FILTER_TRUE, FILTER_FALSE
+
+    flat: dict[Hashable, FilterNode] = {}
+
+    for item in items:
+        if item == absorbing:
+            return absorbing
+
+        if item == neutral:
+            continue
+
+        if isinstance(item, FilterGroup) and item.op == node.op:
+            children = item.items
+        else:
+            children = (item,)
+
+        for child in children:
+            flat.setdefault(_get_key(child, params), child)
+
+    result = list(flat.values())
+
+    if node.op == '&' and _is_contradiction(result, params):
+        return FILTER_FALSE
+
+    if node.op == '|' and _is_tautology(result, params):
+        return FILTER_TRUE
+
+    if not result:
+        return neutral
+
+    if len(result) == 1:
+        return result[0]
+
+    result.sort(key=_get_rank)
+    return FilterGroup(node.op, tuple(result))
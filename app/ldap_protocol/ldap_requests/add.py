@@ -13,23 +13,29 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from ldap_protocol.asn1parser import ASN1Row
+from ldap_protocol.attribute_types import create_attributes
 from ldap_protocol.dialogue import LDAPCodes, Session
 from ldap_protocol.ldap_responses import (
     INVALID_ACCESS_RESPONSE,
     AddResponse,
     PartialAttribute,
 )
+from ldap_protocol.notifications import notify_change
 from ldap_protocol.password_policy import PasswordPolicySchema
 from ldap_protocol.utils import (
+    bump_change_counter,
     create_integer_hash,
     create_object_sid,
     get_base_dn,
+    get_directory,
     get_groups,
     get_path_filter,
     get_search_path,
+    refresh_nested_memberships,
+    reserve_usn,
     validate_entry,
 )
-from models.ldap3 import Attribute, Directory, Group, User
+from models.ldap3 import Directory, Group, Path, User
 from security import get_password_hash
 
 from .base import BaseRequest
@@ -98,6 +104,7 @@ class AddRequest(BaseRequest):
         has_no_parent = len(parent_dn) == 0
 
         new_dn, name = self.entry.split(',')[0].split('=')
+        parent: Directory | None = None
 
         if has_no_parent:
             new_dir = Directory(
@@ -107,11 +114,9 @@ class AddRequest(BaseRequest):
             path = new_dir.create_path(dn=new_dn)
 
         else:
-            query = select(Directory)\
-                .join(Directory.path)\
-                .options(selectinload(Directory.paths))\
-                .filter(get_path_filter(parent_dn))
-            parent = await session.scalar(query)
+            parent = await get_directory(
+                session, parent_dn,
+                selectinload(Directory.path).selectinload(Path.directories))
 
             if not parent:
                 yield AddResponse(result_code=LDAPCodes.NO_SUCH_OBJECT)
@@ -127,7 +132,7 @@ class AddRequest(BaseRequest):
         group = None
         user = None
         items_to_add = []
-        attributes = []
+        attribute_values: list[tuple[str, str | bytes]] = []
         parent_groups: list[Group] = []
         user_attributes = {}
         group_attributes: list[str] = []
@@ -147,14 +152,7 @@ class AddRequest(BaseRequest):
                     group_attributes.append(value)
 
                 else:
-                    attributes.append(
-                        Attribute(
-                            name=attr.type,
-                            value=value if isinstance(value, str) else None,
-                            bvalue=value if isinstance(value, bytes) else None,
-                            directory=new_dir,
-                        ),
-                    )
+                    attribute_values.append((attr.type, value))
 
         parent_groups = await get_groups(group_attributes, session)
 
@@ -191,20 +189,11 @@ class AddRequest(BaseRequest):
             items_to_add.append(user)
             user.groups.extend(parent_groups)
 
-            attributes.append(Attribute(
-                name='uidNumber',
-                value=str(create_integer_hash(user.sam_accout_name)),
-                directory=new_dir))
-
-            attributes.append(Attribute(
-                name='homeDirectory',
-                value=f'/home/{user.sam_accout_name}',
-                directory=new_dir))
-
-            attributes.append(Attribute(
-                name='loginShell',
-                value='/bin/bash',
-                directory=new_dir))
+            attribute_values.extend([
+                ('uidNumber', str(create_integer_hash(user.sam_accout_name))),
+                ('homeDirectory', f'/home/{user.sam_accout_name}'),
+                ('loginShell', '/bin/bash'),
+            ])
 
         elif is_group:
             group = Group(directory=new_dir)
@@ -212,29 +201,39 @@ class AddRequest(BaseRequest):
             group.parent_groups.extend(parent_groups)
 
         if is_user or is_group:
-            attributes.append(Attribute(
-                name='gidNumber',  # reverse dir name if it matches samAN
-                value=str(create_integer_hash(new_dir.name[::-1])),
-                directory=new_dir))
+            attribute_values.append((  # reverse dir name if it matches samAN
+                'gidNumber', str(create_integer_hash(new_dir.name[::-1]))))
+
+        attributes = await create_attributes(
+            session, new_dir, attribute_values)
 
         async with session.begin_nested():
             try:
+                await reserve_usn(session)
                 new_dir.depth = len(path.path)
                 items_to_add.extend([new_dir, path] + attributes)
 
                 session.add_all(items_to_add)
 
-                if has_no_parent:
+                if parent is None:
                     new_dir.paths.append(path)
                 else:
                     path.directories.extend(
-                        [p.endpoint for p in parent.paths + [path]])
+                        parent.path.directories + [new_dir])
                 await session.flush()
                 new_dir.object_sid = await create_object_sid(
                     session, new_dir.id)
+
+                if is_user or is_group:
+                    await refresh_nested_memberships(
+                        session, (group.id for group in parent_groups))
+
+                await notify_change(session, new_dir.id)
                 await session.commit()
             except IntegrityError:
                 await session.rollback()
                 yield AddResponse(result_code=LDAPCodes.ENTRY_ALREADY_EXISTS)
-            else:
-                yield AddResponse(result_code=LDAPCodes.SUCCESS)
+                return
+
+        await bump_change_counter(session)
+        yield AddResponse(result_code=LDAPCodes.SUCCESS)
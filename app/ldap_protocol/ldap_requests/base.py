@@ -8,10 +8,11 @@ from abc import ABC, abstractmethod
 from typing import TYPE_CHECKING, AsyncGenerator, Protocol
 
 from loguru import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ldap_protocol.asn1parser import ASN1Row
+from ldap_protocol.controls import Control
 from ldap_protocol.dialogue import Session, User
 from ldap_protocol.ldap_responses import BaseResponse
 from ldap_protocol.utils import get_class_name
@@ -34,6 +35,11 @@ if TYPE_CHECKING:
             self, user: User,
             session: AsyncSession,
         ) -> list[BaseResponse] | BaseResponse: ...
+
+        def _stream_api(
+            self, ldap_session: Session,
+            session: AsyncSession,
+        ) -> AsyncGenerator[BaseResponse, None]: ...
 else:
     class _APIProtocol: ...  # noqa
 
@@ -41,17 +47,38 @@ else:
 class BaseRequest(ABC, BaseModel, _APIProtocol):
     """Base request builder."""
 
+    _controls: dict[str, Control] = PrivateAttr(default_factory=dict)
+
     @property
     @abstractmethod
     def PROTOCOL_OP(self) -> int:  # noqa: N802, D102
         """Protocol OP response code."""
 
+    @property
+    def read_only(self) -> bool:
+        """Request doesn't write, so session needn't read own writes."""
+        return False
+
+    @property
+    def use_replica(self) -> bool:
+        """Reads of request may be routed to replica."""
+        return self.read_only
+
     @classmethod
     @abstractmethod
     def from_data(cls, data: dict[str, list[ASN1Row]]) -> 'BaseRequest':
         """Create structure from ASN1Row dataclass list."""
         raise NotImplementedError(f'Tried to access {cls.PROTOCOL_OP}')
 
+    def set_controls(self, controls: list[Control]) -> None:
+        """Set message controls, available to handler by oid."""
+        self._controls = {
+            control.control_type: control for control in controls}
+
+    def get_control(self, oid: str) -> Control | None:
+        """Get message control by oid."""
+        return self._controls.get(oid)
+
     @abstractmethod
     async def handle(self, ldap_session: Session, session: AsyncSession) -> \
             AsyncGenerator[BaseResponse, None]:
@@ -68,6 +95,20 @@ class BaseRequest(ABC, BaseModel, _APIProtocol):
         :param AsyncSession session: db session
         :return list[BaseResponse]: list of handled responses
         """
+        return [
+            response async for response in self._stream_api(
+                ldap_session, session)]
+
+    async def _stream_api(
+        self, ldap_session: Session,
+        session: AsyncSession,
+    ) -> AsyncGenerator[BaseResponse, None]:
+        """Handle request with api user, yield responses as handled.
+
+        :param Session ldap_session: ldap session with api user
+        :param AsyncSession session: db session
+        :yield BaseResponse: handled response
+        """
         un = getattr(ldap_session.user, 'user_principal_name', 'ANONYMOUS')
 
         if ldap_session.settings.DEBUG:
@@ -75,17 +116,13 @@ class BaseRequest(ABC, BaseModel, _APIProtocol):
         else:
             log_api.info(f"{get_class_name(self)}[{un}]")
 
-        responses = [
-            response async for response in self.handle(ldap_session, session)]
-
-        if ldap_session.settings.DEBUG:
-            for response in responses:
+        async for response in self.handle(ldap_session, session):
+            if ldap_session.settings.DEBUG:
                 log_api.info(response.model_dump_json(indent=4))
-        else:
-            for response in responses:
+            else:
                 log_api.info(f"{get_class_name(response)}[{un}]")
 
-        return responses
+            yield response
 
     async def handle_api(
         self, ldap_session: Session,
@@ -104,3 +141,10 @@ class APIMultipleResponseMixin(_APIProtocol):
     ) -> list[BaseResponse]:
         """Get all responses."""
         return await self._handle_api(user, session)
+
+    def stream_api(
+        self, ldap_session: Session,
+        session: AsyncSession,
+    ) -> AsyncGenerator[BaseResponse, None]:
+        """Get responses one by one, as handler yields them."""
+        return self._stream_api(ldap_session, session)
@@ -13,6 +13,7 @@ from sqlalchemy import exists, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ldap_protocol.asn1parser import ASN1Row
+from ldap_protocol.attribute_types import attribute_types
 from ldap_protocol.dialogue import LDAPCodes, Session
 from ldap_protocol.ldap_responses import BaseResponse, BindResponse
 from ldap_protocol.utils import (
@@ -166,6 +167,11 @@ class BindRequest(BaseRequest):
     authentication_choice: SimpleAuthentication | SaslPLAINAuthentication =\
         Field(..., alias='AuthenticationChoice')
 
+    @property
+    def read_only(self) -> bool:
+        """User lookup may use replica, lastLogon is written to primary."""
+        return True
+
     @classmethod
     def from_data(cls, data: ASN1Row) -> 'BindRequest':
         """Get bind from data dict."""
@@ -217,36 +223,57 @@ class BindRequest(BaseRequest):
 
     async def handle(self, ldap_session: Session, session: AsyncSession) -> \
             AsyncGenerator[BindResponse, None]:
-        """Handle bind request, check user and password."""
+        """Handle bind request, swap session user by result.
+
+        Failed or anonymous bind leaves session anonymous, RFC 4511 4.2.1,
+        operations in progress keep user, bound at their start.
+        """
+        response, user = await self.authenticate(ldap_session, session)
+
+        if user is None:
+            await ldap_session.delete_user()
+        else:
+            await set_last_logon_user(
+                user, session, ldap_session.settings.TIMEZONE)
+            await ldap_session.set_user(user)
+
+        yield response
+
+    async def authenticate(
+        self, ldap_session: Session, session: AsyncSession,
+    ) -> tuple[BindResponse, User | None]:
+        """Check user and password.
+
+        :param Session ldap_session: ldap session
+        :param AsyncSession session: db
+        :return tuple[BindResponse, User | None]: response and user to bind
+        """
         if not self.name and self.authentication_choice.is_anonymous():
-            yield BindResponse(result_code=LDAPCodes.SUCCESS)
-            return
+            return BindResponse(result_code=LDAPCodes.SUCCESS), None
 
         user = await self.authentication_choice.get_user(session, self.name)
 
         if not user or not self.authentication_choice.is_valid(user):
-            yield self.BAD_RESPONSE
-            return
+            return self.BAD_RESPONSE, None
 
         if not await self.is_user_group_valid(user, ldap_session, session):
-            yield self.BAD_RESPONSE
-            return
+            return self.BAD_RESPONSE, None
 
+        type_id = await attribute_types.get_id(session, 'pwdLastSet')
         required_pwd_change = await session.scalar(select(exists().where(
             Attribute.directory_id == user.directory_id,
-            Attribute.name == 'pwdLastSet',
+            Attribute.type_id == type_id,
             Attribute.value == '0',
         )))  # type: ignore
 
         if required_pwd_change:
-            yield BindResponse(
+            return BindResponse(
                 result_code=LDAPCodes.INVALID_CREDENTIALS,
                 matchedDn='',
                 errorMessage=(
                     "80090308: LdapErr: DSID-0C09030B, "
                     "comment: AcceptSecurityContext error, "
-                    "data 773, v893"))
-            return
+                    "data 773, v893")), None
 
         if policy := getattr(ldap_session, 'policy', None):
             if policy.mfa_status in (MFAFlags.ENABLED, MFAFlags.WHITELIST):
@@ -266,14 +293,9 @@ class BindRequest(BaseRequest):
                         session)
 
                     if mfa_status is False:
-                        yield self.BAD_RESPONSE
-                        return
-
-        await ldap_session.set_user(user)
-        await set_last_logon_user(
-            user, session, ldap_session.settings.TIMEZONE)
+                        return self.BAD_RESPONSE, None
 
-        yield BindResponse(result_code=LDAPCodes.SUCCESS, matchedDn='')
+        return BindResponse(result_code=LDAPCodes.SUCCESS, matchedDn=''), user
 
 
 class UnbindRequest(BaseRequest):
@@ -16,12 +16,14 @@ from ldap_protocol.ldap_responses import (
     DeleteResponse,
 )
 from ldap_protocol.utils import (
+    bump_change_counter,
     get_base_dn,
-    get_path_filter,
+    get_directory,
     get_search_path,
+    refresh_nested_memberships,
     validate_entry,
 )
-from models.ldap3 import Directory
+from models.ldap3 import DirectoryPath, NestedMembership, Path
 
 from .base import BaseRequest
 
@@ -53,16 +55,24 @@ class DeleteRequest(BaseRequest):
 
         search_path = get_search_path(self.entry, await get_base_dn(session))
 
-        query = select(Directory)\
-            .join(Directory.path)\
-            .filter(get_path_filter(search_path))
-
-        obj = await session.scalar(query)
+        obj = await get_directory(session, search_path)
         if not obj:
             yield DeleteResponse(result_code=LDAPCodes.NO_SUCH_OBJECT)
             return
 
+        subtree = select(Path.endpoint_id)\
+            .join(DirectoryPath, DirectoryPath.path_id == Path.id)\
+            .where(DirectoryPath.dir_id == obj.id)
+
+        groups = list(await session.scalars(
+            select(NestedMembership.group_id)
+            .where(NestedMembership.directory_id.in_(subtree))
+            .distinct()))
+
         await session.delete(obj)
+        await session.flush()
+        await refresh_nested_memberships(session, groups)
         await session.commit()
+        await bump_change_counter(session)
 
         yield DeleteResponse(result_code=LDAPCodes.SUCCESS)
@@ -19,11 +19,12 @@ from ldap_protocol.ldap_responses import (
     BaseExtendedResponseValue,
     ExtendedResponse,
 )
+from ldap_protocol.notifications import notify_change
 from ldap_protocol.password_policy import (
     PasswordPolicySchema,
     post_save_password_actions,
 )
-from ldap_protocol.utils import get_user
+from ldap_protocol.utils import bump_change_counter, get_user, reserve_usn
 from models import Directory, User
 from security import get_password_hash, verify_password
 
@@ -38,6 +39,8 @@ class BaseExtendedValue(ABC, BaseModel):
     def REQUEST_ID(self) -> LDAPOID:  # noqa: N802, D102
         """Protocol id code."""
 
+    READ_ONLY: ClassVar[bool] = False
+
     @classmethod
     @abstractmethod
     def from_data(cls, data: ASN1Row) -> 'BaseExtendedValue':
@@ -85,6 +88,7 @@ class WhoAmIRequestValue(BaseExtendedValue):
     """
 
     REQUEST_ID: ClassVar[LDAPOID] = "1.3.6.1.4.1.4203.1.11.3"
+    READ_ONLY: ClassVar[bool] = True
     base: int = 123
 
     @classmethod
@@ -95,9 +99,8 @@ class WhoAmIRequestValue(BaseExtendedValue):
     async def handle(
             self, ldap_session: Session, _: AsyncSession) -> "WhoAmIResponse":
         """Return user from session."""
-        un = (
-            f"u:{ldap_session.user.user_principal_name}"
-            if ldap_session.user else '')
+        user = await ldap_session.get_user()
+        un = f"u:{user.user_principal_name}" if user else ''
 
         return WhoAmIResponse(authz_id=un)
 
@@ -172,13 +175,14 @@ class PasswdModifyRequestValue(BaseExtendedValue):
 
         if self.user_identity is not None:
             user = await get_user(session, self.user_identity)
-            if not user:
-                raise PermissionError('Cannot acquire user by DN')
         else:
-            if not ldap_session.user:
+            if not (bound_user := await ldap_session.get_user()):
                 raise PermissionError('Anonymous user')
 
-            user = await session.get(User, ldap_session.user.id)
+            user = await session.get(User, bound_user.id)
+
+        if not user:
+            raise PermissionError('Cannot acquire user by DN')
 
         validator = await PasswordPolicySchema\
             .get_policy_settings(session)
@@ -189,10 +193,14 @@ class PasswdModifyRequestValue(BaseExtendedValue):
                            verify_password(self.old_password, user.password)):
             user.password = get_password_hash(self.new_password)
             await post_save_password_actions(user, session)
+            await reserve_usn(session)
             await session.execute(
                 update(Directory).where(Directory.id == user.directory_id),
             )
+            session.expire(user.directory, ['updated_at', 'usn_changed'])
+            await notify_change(session, user.directory_id)
             await session.commit()
+            await bump_change_counter(session)
             return PasswdModifyResponse()
         raise PermissionError('No user provided')
 
@@ -235,6 +243,11 @@ class ExtendedRequest(BaseRequest):
     request_name: LDAPOID
     request_value: SerializeAsAny[BaseExtendedValue]
 
+    @property
+    def read_only(self) -> bool:
+        """Extended operation may use replica, if it doesn't write."""
+        return self.request_value.READ_ONLY
+
     async def handle(self, ldap_session: Session, session: AsyncSession) -> \
             AsyncGenerator[ExtendedResponse, None]:
         """Call proxy handler."""
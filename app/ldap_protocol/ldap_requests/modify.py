@@ -6,25 +6,31 @@ License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 from typing import AsyncGenerator, ClassVar
 
 from pydantic import BaseModel
-from sqlalchemy import and_, delete, or_, update
+from sqlalchemy import and_, delete, func, or_, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from ldap_protocol.asn1parser import ASN1Row
+from ldap_protocol.attribute_types import attribute_types, create_attributes
 from ldap_protocol.dialogue import LDAPCodes, Operation, Session
 from ldap_protocol.ldap_responses import ModifyResponse, PartialAttribute
+from ldap_protocol.notifications import notify_change, notify_changes
 from ldap_protocol.password_policy import (
     PasswordPolicySchema,
     post_save_password_actions,
 )
 from ldap_protocol.utils import (
+    bump_change_counter,
     ft_to_dt,
     get_base_dn,
+    get_directory,
+    get_directory_ids,
     get_groups,
-    get_path_filter,
     get_search_path,
+    refresh_nested_memberships,
+    reserve_usn,
     validate_entry,
 )
 from models.ldap3 import Attribute, Directory, Group, User
@@ -101,17 +107,9 @@ class ModifyRequest(BaseRequest):
         membership2 = selectinload(Directory.group)\
             .selectinload(Group.parent_groups)
 
-        query = select(   # noqa: ECE001
-            Directory)\
-            .join(Directory.path)\
-            .join(Directory.attributes)\
-            .join(User, isouter=True)\
-            .options(
-                selectinload(Directory.paths),
-                membership1, membership2)\
-            .filter(get_path_filter(search_path))
-
-        directory = await session.scalar(query)
+        directory = await get_directory(
+            session, search_path,
+            selectinload(Directory.paths), membership1, membership2)
 
         if len(search_path) == 0 or not directory:
             yield ModifyResponse(result_code=LDAPCodes.NO_SUCH_OBJECT)
@@ -135,10 +133,15 @@ class ModifyRequest(BaseRequest):
                         await self._add(
                             change, directory, session, ldap_session)
 
+                await reserve_usn(session)
                 await session.execute(
                     update(Directory).where(Directory.id == directory.id),
                 )
+                # server side values, reloaded by the next query
+                session.expire(directory, ['updated_at', 'usn_changed'])
+                await notify_change(session, directory.id)
                 await session.commit()
+                await bump_change_counter(session)
             except IntegrityError:
                 await session.rollback()
                 yield ModifyResponse(
@@ -151,6 +154,14 @@ class ModifyRequest(BaseRequest):
 
         yield ModifyResponse(result_code=LDAPCodes.SUCCESS)
 
+    @staticmethod
+    async def _notify_groups(
+            session: AsyncSession, groups: list[Group]) -> None:
+        """Notify groups, which `member` is changed by memberOf."""
+        if groups:
+            await notify_changes(session, select(Group.directory_id).where(
+                Group.id.in_([group.id for group in groups])))
+
     async def _delete(
         self,
         change: Changes,
@@ -164,25 +175,47 @@ class ModifyRequest(BaseRequest):
         if name == 'memberof':
             if name_only or not change.modification.vals:
                 if directory.group:
+                    groups = list(directory.group.parent_groups)
                     directory.group.parent_groups.clear()
 
                 elif directory.user:
+                    groups = list(directory.user.groups)
                     directory.user.groups.clear()
 
-            else:
-                groups = await get_groups(
-                    change.modification.vals, session)
+                else:
+                    groups = []
+
+            else:  # only ids are resolved, groups are in loaded collection
+                ids = set((await get_directory_ids(
+                    session, change.modification.vals)).values())
+
+                if directory.group:
+                    parent_groups = directory.group.parent_groups
+                elif directory.user:
+                    parent_groups = directory.user.groups
+                else:
+                    parent_groups = []
+
+                groups = [
+                    group for group in parent_groups
+                    if group.directory_id in ids]
+
                 for group in groups:
-                    if directory.group:
-                        directory.group.parent_groups.remove(group)
+                    parent_groups.remove(group)
+
+            await session.flush()
+            await refresh_nested_memberships(
+                session, (group.id for group in groups))
+            await self._notify_groups(session, groups)
+            return
 
-                    elif directory.user:
-                        directory.user.groups.remove(group)
+        type_id = await attribute_types.get_id(session, name)
 
+        if type_id is None:  # attribute was never set, nothing to delete
             return
 
         if name_only or not change.modification.vals:
-            attrs.append(Attribute.name == change.modification.type)
+            attrs.append(Attribute.type_id == type_id)
         else:
             for value in change.modification.vals:
                 if name not in (Directory.search_fields | User.search_fields):
@@ -193,9 +226,7 @@ class ModifyRequest(BaseRequest):
                     else:
                         continue
 
-                    attrs.append(and_(
-                        Attribute.name == change.modification.type,
-                        condition))
+                    attrs.append(and_(Attribute.type_id == type_id, condition))
 
         if attrs:
             del_query = delete(Attribute).filter(
@@ -203,13 +234,20 @@ class ModifyRequest(BaseRequest):
 
             await session.execute(del_query)
 
+        if name == 'objectclass':
+            directory.object_classes = list(await session.scalars(
+                select(func.lower(Attribute.value)).distinct().where(
+                    Attribute.directory_id == directory.id,
+                    Attribute.type_id == type_id,
+                    Attribute.value.is_not(None))))
+
     async def _add(
         self, change: Changes,
         directory: Directory,
         session: AsyncSession,
         ldap_session: Session,
     ) -> None:
-        attrs = []
+        attribute_values = []
         name = change.get_name()
 
         if name == 'memberof':
@@ -220,11 +258,16 @@ class ModifyRequest(BaseRequest):
             elif directory.user:
                 directory.user.groups.extend(groups)
 
+            await session.flush()
+            await refresh_nested_memberships(
+                session, (group.id for group in groups))
+            await self._notify_groups(session, groups)
             await session.commit()
             return
 
         for value in change.modification.vals:
             if name in Directory.search_fields:
+                await reserve_usn(session)
                 await session.execute(
                     update(Directory)
                     .filter(Directory.id == directory.id)
@@ -266,11 +309,7 @@ class ModifyRequest(BaseRequest):
                 await post_save_password_actions(directory.user, session)
 
             else:
-                attrs.append(Attribute(
-                    name=change.modification.type,
-                    value=value if isinstance(value, str) else None,
-                    bvalue=value if isinstance(value, bytes) else None,
-                    directory=directory,
-                ))
-
-        session.add_all(attrs)
+                attribute_values.append((change.modification.type, value))
+
+        session.add_all(await create_attributes(
+            session, directory, attribute_values))
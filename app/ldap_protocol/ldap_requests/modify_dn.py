@@ -6,10 +6,10 @@ License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 
 from typing import AsyncGenerator, ClassVar
 
-from sqlalchemy import func, text, update
+from sqlalchemy import delete, func, insert, or_, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, selectinload
 
 from ldap_protocol.asn1parser import ASN1Row
 from ldap_protocol.dialogue import LDAPCodes, Session
@@ -17,13 +17,23 @@ from ldap_protocol.ldap_responses import (
     INVALID_ACCESS_RESPONSE,
     ModifyDNResponse,
 )
+from ldap_protocol.notifications import notify_change, notify_changes
 from ldap_protocol.utils import (
+    bump_change_counter,
     get_base_dn,
+    get_directory,
     get_path_filter,
     get_search_path,
+    reserve_usn,
     validate_entry,
 )
-from models.ldap3 import Directory, DirectoryReferenceMixin, Path
+from models.ldap3 import (
+    Directory,
+    DirectoryPath,
+    DirectoryReferenceMixin,
+    NestedMembership,
+    Path,
+)
 
 from .base import BaseRequest
 
@@ -101,13 +111,8 @@ class ModifyDNRequest(BaseRequest):
         base_dn = await get_base_dn(session)
         obj = get_search_path(self.entry, base_dn)
 
-        query = select(Directory)\
-            .join(Directory.path)\
-            .options(selectinload(Directory.paths))\
-            .options(selectinload(Directory.parent))\
-            .filter(get_path_filter(obj))  # noqa
-
-        directory: Directory | None = await session.scalar(query)
+        directory = await get_directory(
+            session, obj, selectinload(Directory.parent))
 
         if not directory:
             yield ModifyDNResponse(result_code=LDAPCodes.NO_SUCH_OBJECT)
@@ -119,32 +124,35 @@ class ModifyDNRequest(BaseRequest):
             new_directory = Directory(
                 name=name,
                 object_class=directory.object_class,
+                object_classes=list(directory.object_classes),
                 depth=directory.depth,
                 parent_id=directory.parent_id,
                 created_at=directory.created_at,
                 objectguid=directory.objectguid,
+                usn_created=directory.usn_created,
                 object_sid=directory.object_sid,
             )
             new_path = new_directory.create_path(directory.parent, dn)
+            parent_path_id = directory.parent.path.id\
+                if directory.parent else None
 
         elif self.new_superior.lower() == base_dn.lower():
             new_directory = Directory(
                 object_class=directory.object_class,
+                object_classes=list(directory.object_classes),
                 name=name,
                 depth=1,
                 objectguid=directory.objectguid,
+                usn_created=directory.usn_created,
                 object_sid=directory.object_sid,
             )
             new_path = new_directory.create_path(dn=dn)
+            parent_path_id = None
 
         else:
-            new_sup = get_search_path(self.new_superior, base_dn)
-            new_sup_query = select(Directory)\
-                .join(Directory.path)\
-                .options(selectinload(Directory.path))\
-                .filter(get_path_filter(new_sup))
-
-            new_base_directory = await session.scalar(new_sup_query)
+            new_base_directory = await get_directory(
+                session, get_search_path(self.new_superior, base_dn),
+                selectinload(Directory.path))
 
             if not new_base_directory:
                 yield ModifyDNResponse(result_code=LDAPCodes.NO_SUCH_OBJECT)
@@ -152,19 +160,24 @@ class ModifyDNRequest(BaseRequest):
 
             new_directory = Directory(
                 object_class=directory.object_class,
+                object_classes=list(directory.object_classes),
                 name=name,
                 parent=new_base_directory,
                 depth=len(new_base_directory.path.path)+1,
                 objectguid=directory.objectguid,
+                usn_created=directory.usn_created,
                 object_sid=directory.object_sid,
             )
             new_path = new_directory.create_path(new_base_directory, dn=dn)
+            parent_path_id = new_base_directory.path.id
 
         async with session.begin_nested():
+            await reserve_usn(session)
             session.add_all([new_directory, new_path])
             await session.commit()
 
         async with session.begin_nested():
+            await reserve_usn(session)
             await session.execute(
                 update(Directory)
                 .where(Directory.parent == directory)
@@ -179,7 +192,61 @@ class ModifyDNRequest(BaseRequest):
                     .where(model.directory_id == directory.id)
                     .values(directory_id=new_directory.id))
 
+            await session.execute(
+                update(NestedMembership)
+                .where(NestedMembership.directory_id == directory.id)
+                .values(directory_id=new_directory.id))
+
+            await session.execute(
+                update(DirectoryPath)
+                .where(DirectoryPath.dir_id == directory.id)
+                .values(dir_id=new_directory.id),
+                execution_options={"synchronize_session": False},
+            )
+
+            # replace ancestors of moved subtree, relations inside are kept
+            dir_paths = aliased(DirectoryPath)
+            subtree_paths = select(dir_paths.path_id).where(
+                dir_paths.dir_id == new_directory.id,
+                dir_paths.path_id != directory.path.id)
+            old_ancestors = select(dir_paths.dir_id).where(
+                dir_paths.path_id == directory.path.id,
+                dir_paths.dir_id != new_directory.id)
+
+            await session.execute(
+                delete(DirectoryPath).where(
+                    DirectoryPath.dir_id.in_(old_ancestors),
+                    DirectoryPath.path_id.in_(subtree_paths)),
+                execution_options={"synchronize_session": False},
+            )
+            await session.execute(
+                insert(DirectoryPath).values(
+                    dir_id=new_directory.id, path_id=new_path.id))
+
+            if parent_path_id is not None:
+                parent_paths = aliased(DirectoryPath)
+                await session.execute(
+                    insert(DirectoryPath).from_select(
+                        ['dir_id', 'path_id'],
+                        select(parent_paths.dir_id, Path.id)
+                        .join(Path, or_(
+                            Path.id == new_path.id,
+                            Path.id.in_(subtree_paths)))
+                        .where(parent_paths.path_id == parent_path_id)))
+
+        subtree = select(Path.endpoint_id).where(
+            get_path_filter(
+                directory.path.path, column=Path.path[1:directory.depth]),
+            Path.endpoint_id != directory.id)
+
         async with session.begin_nested():
+            await reserve_usn(session)
+            await session.execute(  # stamp USN of renamed subtree
+                update(Directory).where(Directory.id.in_(subtree)),
+                execution_options={"synchronize_session": False},
+            )
+            await notify_changes(session, subtree)
+
             #  TODO: replace text with slice
             await session.execute(
                 update(Path)
@@ -202,6 +269,8 @@ class ModifyDNRequest(BaseRequest):
 
         await session.refresh(directory)
         await session.delete(directory)
+        await notify_change(session, new_directory.id)
         await session.commit()
+        await bump_change_counter(session)
 
         yield ModifyDNResponse(result_code=LDAPCodes.SUCCESS)
@@ -4,25 +4,52 @@ Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
+import base64
+import json
 import sys
 import uuid
 from collections import defaultdict
+from dataclasses import dataclass
 from functools import cached_property
 from math import ceil
-from typing import AsyncGenerator, ClassVar
+from typing import AsyncGenerator, ClassVar, Hashable
 
 from loguru import logger
-from pydantic import Field
-from sqlalchemy import func
+from pydantic import Field, PrivateAttr
+from sqlalchemy import String, bindparam, func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload, selectinload, subqueryload
-from sqlalchemy.sql.expression import Select
+from sqlalchemy.orm import (
+    aliased,
+    joinedload,
+    load_only,
+    selectinload,
+    subqueryload,
+)
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.expression import ColumnElement, Select
 
 from config import VENDOR_NAME, VENDOR_VERSION, Settings
 from ldap_protocol.asn1parser import ASN1Row
+from ldap_protocol.controls import (
+    LDAP_CONTROL_VLVREQUEST,
+    LDAP_SERVER_DIRSYNC_OID,
+    LDAP_SERVER_NOTIFICATION_OID,
+    LDAP_SERVER_SORT_OID,
+    Control,
+    DirSyncRequestValue,
+    SortRequestValue,
+    VLVRequestValue,
+)
 from ldap_protocol.dialogue import LDAPCodes, Session
-from ldap_protocol.filter_interpreter import BoundQ, cast_filter2sql
+from ldap_protocol.filter_interpreter import (
+    FILTER_FALSE,
+    FilterNode,
+    FilterParams,
+    compile_filter,
+    parse_filter,
+)
+from ldap_protocol.filter_optimizer import optimize_filter
 from ldap_protocol.ldap_responses import (
     INVALID_ACCESS_RESPONSE,
     PartialAttribute,
@@ -30,27 +57,101 @@ from ldap_protocol.ldap_responses import (
     SearchResultEntry,
     SearchResultReference,
 )
+from ldap_protocol.notifications import change_notifier
 from ldap_protocol.objects import DerefAliases, Scope
+from ldap_protocol.plan_cache import PlanCache
+from ldap_protocol.search_cache import SearchCache
+from ldap_protocol.search_spool import SearchSpool
 from ldap_protocol.utils import (
     dt_to_ft,
     get_attribute_types,
     get_base_dn,
+    get_change_counter,
+    get_committed_usn,
+    get_directory_id_query,
     get_domain_guid,
     get_domain_sid,
     get_generalized_now,
     get_object_classes,
-    get_path_filter,
+    get_path_dn,
     get_search_path,
+    get_subtree_query,
     get_windows_timestamp,
     string_to_sid,
+    validate_dn_cache,
+)
+from models.ldap3 import (
+    Attribute,
+    CatalogueSetting,
+    Directory,
+    Group,
+    Path,
+    User,
 )
-from models.ldap3 import CatalogueSetting, Directory, Group, Path, User
 
 from .base import BaseRequest
 
 ATTRIBUTE_TYPES = get_attribute_types()
 OBJECT_CLASSES = get_object_classes()
 
+_sort_user = aliased(User)  # not correlated with filter subqueries
+
+# sort keys, served by btree indexes of `b3e1d5a7c9f2` and `e5b8d3c1f4a7`
+# migrations, strings are ordered case-insensitively
+SORT_KEYS: dict[str, ColumnElement] = {
+    'cn': func.lower(Directory.name, type_=String),
+    'name': func.lower(Directory.name, type_=String),
+    'objectsid': func.lower(Directory.object_sid, type_=String),
+    'usnchanged': Directory.usn_changed,
+    'samaccountname': func.lower(_sort_user.sam_accout_name, type_=String),
+    'uid': func.lower(_sort_user.sam_accout_name, type_=String),
+    'userprincipalname': func.lower(
+        _sort_user.user_principal_name, type_=String),
+    'mail': func.lower(_sort_user.mail, type_=String),
+}
+
+
+@dataclass(frozen=True)
+class SearchPlan:
+    """Built search statements, executed with bound parameters."""
+
+    query: Select
+    count_query: Select | None = None
+    position_query: Select | None = None  # list view assertion target
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """Keyset position of the next page, opaque for clients.
+
+    Count of the first page is reused, so next pages are not counted.
+    """
+
+    after_id: int
+    count: int
+    returned: int
+
+    def encode(self) -> str:  # noqa: D102
+        return base64.urlsafe_b64encode(json.dumps(
+            [self.after_id, self.count, self.returned]).encode()).decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> 'PageCursor':
+        """Decode cursor.
+
+        :param str cursor: encoded cursor
+        :raises ValueError: on invalid cursor
+        :return PageCursor: cursor
+        """
+        after_id, count, returned = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()))
+        return cls(int(after_id), int(count), int(returned))
+
+
+search_plans: PlanCache[SearchPlan] = PlanCache()
+search_cache = SearchCache()
+search_spool = SearchSpool()
+
 
 class SearchRequest(BaseRequest):
     """Search request schema.
@@ -91,6 +192,10 @@ class SearchRequest(BaseRequest):
     attributes: list[str]
 
     page_number: int | None = Field(None, ge=1, examples=[1])  # only json API
+    cursor: str | None = Field(  # only json API
+        None, description='`next_cursor` of previous page, instead of number')
+
+    _last_directory_id: int | None = PrivateAttr(None)
 
     class Config:
         """Allow class to use property."""
@@ -132,10 +237,11 @@ class SearchRequest(BaseRequest):
 
     async def get_root_dse(
             self, session: AsyncSession,
-            settings: Settings) -> defaultdict[str, list[str]]:
+            settings: Settings, base_dn: str) -> defaultdict[str, list[str]]:
         """Get RootDSE.
 
         :param list[str] attributes: list of requested attrs
+        :param str base_dn: domain dn
         :return defaultdict[str, list[str]]: queried attrs
         """
         attributes = self.requested_attrs
@@ -149,7 +255,6 @@ class SearchRequest(BaseRequest):
 
         data.pop('defaultNamingContext', None)
 
-        base_dn = await get_base_dn(session)
         domain = await get_base_dn(session, True)
         schema = 'CN=Schema'
 
@@ -175,13 +280,18 @@ class SearchRequest(BaseRequest):
         data['schemaNamingContext'].append(schema)
         # data['configurationNamingContext'].append(schema)  # noqa
         data['supportedSASLMechanisms'] = ['ANONYMOUS', 'PLAIN']
-        data['highestCommittedUSN'].append('126991')
+        data['highestCommittedUSN'].append(
+            str(await get_committed_usn(session)))
         data['supportedExtension'] = [
             "1.3.6.1.4.1.4203.1.11.3",  # whoami
             "1.3.6.1.4.1.4203.1.11.1",  # password modify
         ]
         data['supportedControl'] = [
             "2.16.840.1.113730.3.4.4",  # password expire policy
+            LDAP_SERVER_DIRSYNC_OID,
+            LDAP_SERVER_NOTIFICATION_OID,
+            LDAP_SERVER_SORT_OID,
+            LDAP_CONTROL_VLVREQUEST,
         ]
         data['domainFunctionality'].append('0')
         data['supportedLDAPPolicies'] = [
@@ -211,19 +321,106 @@ class SearchRequest(BaseRequest):
 
     @staticmethod
     def _get_full_dn(path: Path, dn: str) -> str:
-        return ','.join(reversed(path.path)) + ',' + dn
+        return get_path_dn(path, dn)
 
-    def cast_filter(
-        self, filter_: ASN1Row, query: Select, base_dn: str,
-    ) -> BoundQ:
-        """Convert asn1 row filter_ to sqlalchemy obj.
+    def parse_filter(self, base_dn: str) -> tuple[FilterNode, FilterParams]:
+        """Parse asn1 row filter to filter tree and bound parameters.
 
-        :param ASN1Row filter_: requested filter_
-        :param sqlalchemy query: sqlalchemy query obj
-        :param AsyncSession session: sa session
-        :return tuple: condition and query objects
+        :param str base_dn: domain dn
+        :return tuple[FilterNode, FilterParams]: tree and parameters
         """
-        return cast_filter2sql(filter_, query, base_dn)
+        return parse_filter(self.filter, base_dn)
+
+    def _get_search_path(self, base_dn: str) -> list[str]:
+        return [
+            path for path in get_search_path(self.base_object, base_dn)
+            if path]
+
+    def get_plan(
+        self, node: FilterNode, params: FilterParams, base_dn: str,
+    ) -> SearchPlan:
+        """Get cached search plan for filter shape, scope and attributes.
+
+        Key contains only values, that change the statement,
+        the rest are passed as bound parameters on execution.
+
+        :param FilterNode node: filter tree
+        :param FilterParams params: filter parameters
+        :param str base_dn: domain dn
+        :return SearchPlan: statements
+        """
+        key = (
+            node,
+            self.scope,
+            bool(self.base_object),
+            self.base_object.lower() == base_dn.lower(),
+            self.member_of,
+            self.member_of_transitive,
+            self.no_attributes,
+            self.skip_values,
+            self.page_number is not None,
+            self.cursor is not None,
+            self.dirsync is not None,
+            self.notification,
+            self.sort_keys,
+            None if self.vlv is None else self.vlv.assertion_value is None,
+        )
+        return search_plans.get(
+            key, lambda: self.build_plan(node, params, base_dn))
+
+    def build_plan(
+        self, node: FilterNode, params: FilterParams, base_dn: str,
+    ) -> SearchPlan:
+        """Build search statements."""
+        query = self.build_query(base_dn).filter(
+            compile_filter(node, params))
+
+        if self.dirsync is not None:
+            query = query.filter(
+                Directory.usn_changed > bindparam('usn_changed'))
+
+        if self.notification:
+            query = query.filter(Directory.id == bindparam('directory_id'))
+
+        if self.sort_keys:
+            if any(name in User.search_fields for name, _ in self.sort_keys):
+                query = query.outerjoin(
+                    _sort_user, _sort_user.directory_id == Directory.id)
+
+            query = query.order_by(*(
+                SORT_KEYS[name].desc() if reverse else SORT_KEYS[name]
+                for name, reverse in self.sort_keys))
+
+        elif not self.paged and self.dirsync is None:
+            return SearchPlan(query)
+
+        query = query.order_by(Directory.id)  # stable pages and sync order
+
+        if not self.paged and self.vlv is None:
+            return SearchPlan(query)
+
+        if self.cursor is not None:
+            query = query.filter(Directory.id > bindparam('after_id'))
+
+        position_query = None
+        if self.vlv is not None and self.vlv.assertion_value is not None:
+            name, reverse = self.sort_keys[0]
+            key = SORT_KEYS[name]
+            value: BindParameter = bindparam('vlv_value', type_=key.type)
+            # entries without key are last in ascending order, as in RFC 2891
+            position_query = select(func.count()).select_from(
+                query.order_by(None).filter(
+                    or_(key > value, key.is_(None)) if reverse
+                    else key < value).subquery())
+
+        return SearchPlan(
+            query=query
+            .offset(bindparam('offset'))
+            .limit(bindparam('limit')),
+            count_query=select(func.count())
+            .select_from(query.order_by(None).subquery()),
+            position_query=position_query,
+        )
 
     async def handle(
         self, ldap_session: Session, session: AsyncSession,
@@ -235,64 +432,234 @@ class SearchRequest(BaseRequest):
         Provides following responses:
         Entry -> Reference (optional) -> Done
         """
-        async with ldap_session.lock() as user:
-            async for response in self.get_result(
-                    bool(user), session, ldap_session):
-                yield response
+        # snapshot, binds on connection don't wait for search
+        user = await ldap_session.get_user()
+
+        if self.notification:  # long running
+            responses = self.get_notifications(user, session, ldap_session)
+        elif (user and not self.root_dse and  # RootDSE reads current USN
+                ldap_session.settings.SEARCH_CACHE_TTL_SECONDS):
+            responses = self.get_cached_result(user, session, ldap_session)
+        else:
+            responses = self.get_result(bool(user), session, ldap_session)
+
+        async for response in responses:
+            yield response
+
+    def get_cache_key(self, user: User) -> Hashable:
+        """Get key of request with bound user identity."""
+        return (
+            type(self),
+            user.id,
+            self.base_object.lower(),
+            self.scope,
+            self.deref_aliases,
+            self.size_limit,
+            self.types_only,
+            str(self.filter),
+            tuple(self.requested_attrs),
+            self.page_number,
+            self.cursor,
+            tuple(
+                (control.control_type, control.control_value)
+                for control in self._controls.values()),
+        )
+
+    async def get_cached_result(
+        self, user: User,
+        session: AsyncSession,
+        ldap_session: Session,
+    ) -> AsyncGenerator[SearchResultDone | SearchResultEntry, None]:
+        """Get result from cache or search and cache pre-encoded result.
+
+        Cached result is dropped on ttl expiration or when directory
+        change counter differs from one, read before search.
+
+        :param User user: bound user
+        :param AsyncSession session: sa session
+        :yield SearchResult: search result
+        """
+        settings = ldap_session.settings
+        key = self.get_cache_key(user)
+        counter = await get_change_counter(session)
+
+        if (cached := search_cache.get(key, counter)) is not None:
+            for entry in cached.entries:
+                yield entry
+            yield cached.done
+            return
+
+        entries: list[SearchResultEntry] | None = []
+        size = 0
+
+        async for response in self.get_result(True, session, ldap_session):
+            if isinstance(response, SearchResultEntry) and entries is not None:
+                size += len(response.pre_encode())
+                if size > settings.SEARCH_CACHE_MAX_BYTES:
+                    entries = None  # too large result is not cached
+                else:
+                    entries.append(response)
+
+            elif isinstance(response, SearchResultDone) and (
+                    entries is not None and
+                    response.result_code == LDAPCodes.SUCCESS):
+                search_cache.put(
+                    key, counter, entries, response,
+                    ttl=settings.SEARCH_CACHE_TTL_SECONDS,
+                    max_size=settings.SEARCH_CACHE_MAX_BYTES)
+
+            yield response
 
     async def get_result(
-            self, user_logged: bool,
-            session: AsyncSession,
-            ldap_session: Session) -> AsyncGenerator[SearchResultDone, None]:
+        self, user_logged: bool,
+        session: AsyncSession,
+        ldap_session: Session,
+    ) -> AsyncGenerator[SearchResultDone | SearchResultEntry, None]:
         """Create response.
 
         :param bool user_logged: is user in session
         :param AsyncSession session: sa session
         :yield SearchResult: search result
         """
-        is_root_dse = self.scope == Scope.BASE_OBJECT and not self.base_object
         is_schema = self.base_object.lower() == 'cn=schema'
 
-        if not (is_root_dse or is_schema) and not user_logged:
+        if not (self.root_dse or is_schema) and not user_logged:
             yield SearchResultDone(**INVALID_ACCESS_RESPONSE)
             return
 
-        if self.scope in {Scope.BASE_OBJECT, Scope.WHOLE_SUBTREE}:
-            if (metadata := await self.get_base_data(session, ldap_session)):
-                yield metadata
-
         base_dn = await get_base_dn(session)
-        query = self.build_query(base_dn)
 
         try:
-            cond, query = self.cast_filter(self.filter, query, base_dn)
-            query = query.filter(cond)
+            node, params = self.parse_filter(base_dn)
+            node = optimize_filter(node, params)
+            plan = self.get_plan(node, params, base_dn)
+            self.page_cursor  # noqa: B018  # validate before search
         except Exception as err:
             logger.error(f'Filter syntax error {err}')
             yield SearchResultDone(result_code=LDAPCodes.PROTOCOL_ERROR)
             return
 
-        query, pages_total, count = await self.paginate_query(query, session)
+        controls: list[Control] = []
 
-        async for response in self.tree_view(query, session):
-            yield response
+        if (code := self.check_view_controls(controls)) != LDAPCodes.SUCCESS:
+            yield SearchResultDone(result_code=code, controls=controls)
+            return
+
+        if self.dirsync is not None:
+            # read before search, cookie is below uncommitted changes
+            controls.append(self.dirsync.get_response(
+                await get_committed_usn(session)))
+            params['usn_changed'] = self.dirsync.usn
+
+        elif self.scope in {Scope.BASE_OBJECT, Scope.WHOLE_SUBTREE}:
+            if (metadata := await self.get_base_data(
+                    session, ldap_session, base_dn)):
+                yield metadata
+
+        if node == FILTER_FALSE:  # contradiction, no entries match
+            yield SearchResultDone(
+                result_code=LDAPCodes.SUCCESS, controls=controls)
+            return
+
+        params['base_path'] = self._get_search_path(base_dn)
+
+        await validate_dn_cache(session)
+        pages_total, count = await self.paginate_query(plan, session, params)
+
+        if self.vlv is not None:
+            code = await self.set_list_view(plan, session, params, controls)
+            if code != LDAPCodes.SUCCESS:
+                yield SearchResultDone(result_code=code, controls=controls)
+                return
+
+        spooled = await search_spool.fill(
+            self.tree_view(plan.query, session, base_dn, params),
+            ldap_session.settings.SEARCH_SPOOL_MAX_BYTES,
+            ldap_session.settings.SEARCH_SPOOL_TOTAL_MAX_BYTES)
+        returned = len(spooled)
+
+        await session.commit()  # release connection, while client reads
+        try:
+            for response in spooled:
+                yield response
+        finally:
+            spooled.discard()
 
         yield SearchResultDone(
             result_code=LDAPCodes.SUCCESS,
             total_pages=pages_total,
             total_objects=count,
+            next_cursor=self.get_next_cursor(params, count, returned),
+            controls=controls,
         )
 
+    async def get_notifications(
+        self, user: User | None,
+        session: AsyncSession,
+        ldap_session: Session,
+    ) -> AsyncGenerator[SearchResultDone | SearchResultEntry, None]:
+        """Yield changed entries, matching search, until session is closed.
+
+        Search is evaluated for every changed directory id with the cached
+        plan, connection is returned to pool while waiting for changes.
+
+        :param User | None user: bound user
+        :param AsyncSession session: sa session
+        :yield SearchResult: search result
+        """
+        if not user:
+            yield SearchResultDone(**INVALID_ACCESS_RESPONSE)
+            return
+
+        base_dn = await get_base_dn(session)
+
+        try:
+            node, params = self.parse_filter(base_dn)
+            node = optimize_filter(node, params)
+            plan = self.get_plan(node, params, base_dn)
+        except Exception as err:
+            logger.error(f'Filter syntax error {err}')
+            yield SearchResultDone(result_code=LDAPCodes.PROTOCOL_ERROR)
+            return
+
+        params['base_path'] = self._get_search_path(base_dn)
+
+        try:
+            async with change_notifier.subscribe(
+                    ldap_session.settings, ldap_session.closed) as changes:
+                await session.commit()  # release connection while waiting
+
+                while (directory_id := await changes.get()) is not None:
+                    params['directory_id'] = directory_id
+                    await validate_dn_cache(session)
+
+                    async for response in self.tree_view(
+                            plan.query, session, base_dn, params):
+                        yield response
+
+                    await session.commit()
+
+        except OverflowError as err:
+            yield SearchResultDone(
+                result_code=LDAPCodes.ADMIN_LIMIT_EXCEEDED,
+                errorMessage=str(err))
+            return
+
+        if changes.error is not None:  # subscriber must search again
+            yield SearchResultDone(
+                result_code=LDAPCodes.ADMIN_LIMIT_EXCEEDED,
+                errorMessage=changes.error)
+
     async def get_base_data(
             self, session: AsyncSession,
-            ldap_session: Session) -> SearchResultEntry | None:
+            ldap_session: Session,
+            dn: str) -> SearchResultEntry | None:
         """Get base server data.
 
         :param AsyncSession session: sqlalchemy session
+        :param str dn: domain dn
         :return SearchResultEntry | None: optional result
         """
-        dn = await get_base_dn(session)
-
         if self.base_object:
             if self.base_object.lower() == dn.lower():  # noqa  # domain info
                 attrs = defaultdict(list)
@@ -316,7 +683,8 @@ class SearchRequest(BaseRequest):
                 return self._get_subschema(dn)
 
         else:  # RootDSE
-            attrs = await self.get_root_dse(session, ldap_session.settings)
+            attrs = await self.get_root_dse(
+                session, ldap_session.settings, dn)
             return SearchResultEntry(
                 object_name='',
                 partial_attributes=[
@@ -330,46 +698,166 @@ class SearchRequest(BaseRequest):
     def member_of(self) -> bool:  # noqa
         return 'memberof' in self.requested_attrs or self.all_attrs
 
+    @cached_property
+    def member_of_transitive(self) -> bool:
+        """Constructed attribute, returned only if requested explicitly."""
+        return 'msds-memberoftransitive' in self.requested_attrs
+
     @cached_property
     def all_attrs(self) -> bool:  # noqa
         return '*' in self.requested_attrs or not self.requested_attrs
 
+    @cached_property
+    def no_attributes(self) -> bool:
+        """Only `1.1` is requested, entries are returned without attributes."""
+        return bool(self.requested_attrs) and \
+            set(self.requested_attrs) == {'1.1'}
+
+    @cached_property
+    def skip_values(self) -> bool:
+        """Only attribute types are returned, values are not loaded."""
+        return self.types_only
+
+    @cached_property
+    def root_dse(self) -> bool:
+        """Base object is empty, RootDSE is requested."""
+        return self.scope == Scope.BASE_OBJECT and not self.base_object
+
+    @cached_property
+    def notification(self) -> bool:
+        """Change notification control is set."""
+        return self.get_control(LDAP_SERVER_NOTIFICATION_OID) is not None
+
+    @cached_property
+    def dirsync(self) -> DirSyncRequestValue | None:
+        """Get DirSync control value, entries changed after cookie USN."""
+        if control := self.get_control(LDAP_SERVER_DIRSYNC_OID):
+            return DirSyncRequestValue.from_control(control)
+        return None
+
+    @property
+    def read_only(self) -> bool:  # noqa: D102
+        return True
+
+    @property
+    def use_replica(self) -> bool:
+        """Search may use replica, unless it tracks changes by USN.
+
+        Committed USN of DirSync cookies, notifications and RootDSE
+        is read from primary locks and sequence.
+        """
+        return not (self.dirsync or self.notification or self.root_dse)
+
+    @cached_property
+    def paged(self) -> bool:
+        """Page of json API is requested, by number or by cursor."""
+        return self.page_number is not None or self.cursor is not None
+
+    @cached_property
+    def page_cursor(self) -> PageCursor | None:
+        """Get decoded cursor of requested page."""
+        if self.cursor is not None:
+            return PageCursor.decode(self.cursor)
+        return None
+
+    @cached_property
+    def sort(self) -> SortRequestValue | None:
+        """Get server side sort control value."""
+        if control := self.get_control(LDAP_SERVER_SORT_OID):
+            return SortRequestValue.from_control(control)
+        return None
+
+    @cached_property
+    def sort_error(self) -> tuple[LDAPCodes, str] | None:
+        """Get sort result code and key, which has no index to sort by."""
+        for key in self.sort.keys if self.sort else []:
+            if key.ordering_rule is not None:
+                return LDAPCodes.INAPPROPRIATE_MATCHING, key.attribute_type
+            if key.attribute_type.lower() not in SORT_KEYS:
+                return LDAPCodes.UNWILLING_TO_PERFORM, key.attribute_type
+        return None
+
+    @cached_property
+    def sort_keys(self) -> tuple[tuple[str, bool], ...]:
+        """Get applied sort keys, lowercase names and reverse flags."""
+        if self.sort is None or self.sort_error is not None:
+            return ()
+        return tuple(
+            (key.attribute_type.lower(), key.reverse_order)
+            for key in self.sort.keys)
+
+    @cached_property
+    def vlv(self) -> VLVRequestValue | None:
+        """Get virtual list view control value."""
+        if control := self.get_control(LDAP_CONTROL_VLVREQUEST):
+            return VLVRequestValue.from_control(control)
+        return None
+
+    def check_view_controls(self, controls: list[Control]) -> LDAPCodes:
+        """Check sort and list view controls, add sort response.
+
+        Search is not sorted, if key of non critical sort control
+        has no index, list view always requires applied sort.
+
+        :param list[Control] controls: response controls
+        :return LDAPCodes: result code, search fails unless success
+        """
+        code = LDAPCodes.SUCCESS
+
+        if self.sort is not None:
+            code, attribute_type = self.sort_error or (code, None)
+            controls.append(SortRequestValue.get_response(
+                code, attribute_type))
+
+            if code != LDAPCodes.SUCCESS and self.get_control(
+                    LDAP_SERVER_SORT_OID).criticality:  # type: ignore
+                code = LDAPCodes.UNAVAILABLE_CRITICAL_EXTENSION
+
+            elif self.vlv is None:
+                return LDAPCodes.SUCCESS
+
+        elif self.vlv is not None:
+            code = LDAPCodes.SORT_CONTROL_MISSING
+
+        if code != LDAPCodes.SUCCESS and self.vlv is not None:
+            controls.append(self.vlv.get_response(0, 0, code))
+
+        return code
+
     def build_query(self, base_dn: str) -> Select:
         """Build tree query."""
-        query = select(  # noqa: ECE001
-            Directory)\
-            .join(User, isouter=True)\
-            .join(Directory.attributes, isouter=True)\
-            .join(Directory.path)\
-            .options(
+        if self.no_attributes:  # only DN is returned
+            query = select(Directory).options(
+                load_only(Directory.id), joinedload(Directory.path))
+        else:
+            attributes = subqueryload(Directory.attributes)
+            if self.skip_values:
+                attributes = attributes.load_only(Attribute.type_id)
+
+            query = select(Directory).options(
                 selectinload(Directory.path),
-                subqueryload(Directory.attributes),
+                attributes,
                 joinedload(Directory.user),
-                joinedload(Directory.group))\
-            .distinct(Directory.id)
+                joinedload(Directory.group))
 
         root_is_base = self.base_object.lower() == base_dn.lower()
-        base_obj = get_search_path(self.base_object, base_dn)
-
-        search_path = [path for path in base_obj if path]
+        base_path: BindParameter = bindparam(
+            'base_path', self._get_search_path(base_dn))
 
         if self.scope == Scope.BASE_OBJECT and self.base_object:
-            query = query.filter(get_path_filter(search_path))
+            query = query.filter(
+                Directory.id == get_directory_id_query(base_path))
 
         elif self.scope == Scope.SINGLEL_EVEL:
             if root_is_base:
-                query = query.filter(func.cardinality(Path.path) == 1)
+                query = query.filter(Directory.parent_id.is_(None))
             else:
                 query = query.filter(
-                    func.cardinality(Path.path) == len(search_path) + 1,
-                    get_path_filter(
-                        column=Path.path[0:len(search_path)],
-                        path=search_path))
+                    Directory.parent_id == get_directory_id_query(base_path))
 
         elif self.scope == Scope.WHOLE_SUBTREE and not root_is_base:
-            query = query.filter(get_path_filter(
-                column=Path.path[1:len(search_path)],
-                path=search_path))
+            query = query.filter(
+                Directory.id.in_(get_subtree_query(base_path)))
 
         if self.member_of:
             s1 = selectinload(Directory.group).selectinload(
@@ -386,42 +874,140 @@ class SearchRequest(BaseRequest):
 
             query = query.options(s1, s2, s3)
 
+        if self.member_of_transitive:
+            query = query.options(
+                selectinload(Directory.nested_groups).selectinload(
+                    Group.directory).selectinload(Directory.path))
+
         return query  # noqa
 
     async def paginate_query(
-        self, query: Select, session: AsyncSession,
-    ) -> tuple[Select, int, int]:
-        """Paginate query.
+        self, plan: SearchPlan, session: AsyncSession, params: FilterParams,
+    ) -> tuple[int, int]:
+        """Count objects and set page bounds to parameters.
 
-        :param _type_ query: _description_
-        :param _type_ session: _description_
-        :return tuple[select, int, int]: query, pages_total, count
+        :param SearchPlan plan: search statements
+        :param AsyncSession session: sa session
+        :param FilterParams params: bound parameters
+        :return tuple[int, int]: pages_total, count
         """
-        if self.page_number is None:
-            return query, 0, 0
+        if not self.paged:
+            return 0, 0
+
+        if self.page_cursor is not None:  # keyset, flat latency of any page
+            count = self.page_cursor.count
+            params['after_id'] = self.page_cursor.after_id
+            params['offset'] = 0
+        else:
+            count = await session.scalar(
+                plan.count_query, params)  # type: ignore
+            params['offset'] = ((self.page_number or 1) - 1) * \
+                self.size_limit
+
+        params['limit'] = self.size_limit
+
+        return int(ceil(count / float(self.size_limit))), count
+
+    def get_next_cursor(
+        self, params: FilterParams, count: int, returned: int,
+    ) -> str | None:
+        """Get cursor of the next page, if there are entries after page.
+
+        :param FilterParams params: bound parameters of page
+        :param int count: entries count of all pages
+        :param int returned: entries count of page
+        :return str | None: encoded cursor
+        """
+        if not self.paged or not returned:
+            return None
 
-        count = await session.scalar(
-            select(func.count()).select_from(query))
-        start = (self.page_number - 1) * self.size_limit
-        end = start + self.size_limit
-        query = query.offset(start).limit(end)
+        if self.page_cursor is not None:
+            returned += self.page_cursor.returned
+        else:
+            returned += params['offset']
+
+        if returned >= count:
+            return None
+
+        return PageCursor(
+            self._last_directory_id, count, returned).encode()  # type: ignore
 
-        return query, int(ceil(count / float(self.size_limit))), count
+    async def set_list_view(
+        self, plan: SearchPlan, session: AsyncSession,
+        params: FilterParams, controls: list[Control],
+    ) -> LDAPCodes:
+        """Find list view target and set window bounds to parameters.
+
+        Offset is scaled, if client content count estimate differs.
+
+        :param SearchPlan plan: search statements
+        :param AsyncSession session: sa session
+        :param FilterParams params: bound parameters
+        :param list[Control] controls: response controls
+        :return LDAPCodes: result code, search fails unless success
+        """
+        vlv: VLVRequestValue = self.vlv  # type: ignore
+        count = await session.scalar(
+            plan.count_query, params)  # type: ignore
+
+        if vlv.assertion_value is not None:
+            name, _ = self.sort_keys[0]
+            try:
+                params['vlv_value'] = vlv.assertion_value.lower() \
+                    if isinstance(SORT_KEYS[name].type, String) \
+                    else int(vlv.assertion_value)
+            except ValueError:
+                controls.append(vlv.get_response(
+                    0, count, LDAPCodes.INVALID_ATTRIBUTE_SYNTAX))
+                return LDAPCodes.INVALID_ATTRIBUTE_SYNTAX
+
+            target = await session.scalar(
+                plan.position_query, params) + 1  # type: ignore
+
+        elif vlv.offset < 1:
+            controls.append(vlv.get_response(
+                0, count, LDAPCodes.OFFSET_RANGE_ERROR))
+            return LDAPCodes.OFFSET_RANGE_ERROR
+
+        else:
+            target = vlv.offset
+            if vlv.content_count and vlv.content_count != count:
+                target = round(vlv.offset * count / vlv.content_count)
+            target = min(max(target, 1), count)
+
+        start = max(target - vlv.before_count, 1)
+        params['offset'] = start - 1
+        params['limit'] = max(target + vlv.after_count - start + 1, 0)
+
+        controls.append(vlv.get_response(target, count, LDAPCodes.SUCCESS))
+        return LDAPCodes.SUCCESS
 
     async def tree_view(
             self, query: Select,
-            session: AsyncSession) -> AsyncGenerator[SearchResultEntry, None]:
+            session: AsyncSession,
+            dn: str,
+            params: FilterParams) -> AsyncGenerator[SearchResultEntry, None]:
         """Yield all resulted directories."""
-        directories = await session.stream_scalars(query)
-        dn = await get_base_dn(session)
+        directories = await session.stream_scalars(query, params)
         # logger.debug(query.compile(compile_kwargs={"literal_binds": True}))  # noqa
 
+        if self.no_attributes:
+            async for directory in directories:
+                self._last_directory_id = directory.id
+                yield SearchResultEntry(
+                    object_name=self._get_full_dn(directory.path, dn),
+                    partial_attributes=[])
+            return
+
         async for directory in directories:
+            self._last_directory_id = directory.id
             attrs = defaultdict(list)
             groups = []
 
             for attr in directory.attributes:
-                if isinstance(attr.value, str):
+                if self.skip_values:  # values are not loaded
+                    value = ''
+                elif isinstance(attr.value, str):
                     value = attr.value.replace('\\x00', '\x00')
                 else:
                     value = attr.bvalue
@@ -451,22 +1037,25 @@ class SearchRequest(BaseRequest):
                     attrs['authTimestamp'].append(directory.user.last_logon)
 
             if self.member_of:
-                if 'group' in attrs['objectClass'] and (
-                        directory.group):
+                if directory.group and 'group' in directory.object_classes:
                     groups += directory.group.parent_groups
 
                     for user in directory.group.users:
                         attrs['member'].append(
                             self._get_full_dn(user.directory.path, dn))
 
-                if 'user' in attrs['objectClass'] and (
-                        directory.user):
+                if directory.user and 'user' in directory.object_classes:
                     groups += directory.user.groups
 
             for group in groups:
                 attrs['memberOf'].append(
                     self._get_full_dn(group.directory.path, dn))
 
+            if self.member_of_transitive:
+                for group in directory.nested_groups:
+                    attrs['msDS-memberOfTransitive'].append(
+                        self._get_full_dn(group.directory.path, dn))
+
             if directory.user:
                 if self.all_attrs:
                     user_fields = directory.user.search_fields.keys()
@@ -517,6 +1106,7 @@ class SearchRequest(BaseRequest):
             yield SearchResultEntry(
                 object_name=distinguished_name,
                 partial_attributes=[
-                    PartialAttribute(type=key, vals=value)
+                    PartialAttribute(
+                        type=key, vals=[] if self.skip_values else value)
                     for key, value in attrs.items()],
             )
@@ -9,9 +9,17 @@ from typing import Annotated, ClassVar
 
 import annotated_types
 from asn1 import Encoder, Numbers
-from pydantic import AnyUrl, BaseModel, Field, SerializeAsAny, field_validator
+from pydantic import (
+    AnyUrl,
+    BaseModel,
+    Field,
+    PrivateAttr,
+    SerializeAsAny,
+    field_validator,
+)
 
 from ldap_protocol.asn1parser import LDAPOID
+from ldap_protocol.controls import Control
 
 from .dialogue import LDAPCodes
 
@@ -116,8 +124,27 @@ class SearchResultEntry(BaseResponse):
     object_name: str
     partial_attributes: list[PartialAttribute]
 
+    _encoded: bytes | None = PrivateAttr(None)
+
+    def pre_encode(self) -> bytes:
+        """Encode entry once, encoded value is reused by `to_asn1`.
+
+        :return bytes: encoded entry content
+        """
+        if self._encoded is None:
+            enc = Encoder()
+            enc.start()
+            self.to_asn1(enc)
+            self._encoded = enc.output()
+
+        return self._encoded
+
     def to_asn1(self, enc: Encoder) -> None:
         """Serialize search response structure to asn1 buffer."""
+        if self._encoded is not None:
+            enc._emit(self._encoded)  # noqa: SLF001
+            return
+
         enc.write(self.object_name, Numbers.OctetString)
         enc.enter(Numbers.Sequence)
 
@@ -141,11 +168,15 @@ class SearchResultDone(LDAPResult, BaseResponse):
     # API fields
     total_pages: int = 0
     total_objects: int = 0
+    next_cursor: str | None = None
+    # response controls, LDAP only
+    controls: list[Control] = Field([], exclude=True)
 
     def _get_asn1_fields(self) -> dict:  # noqa
         fields = super()._get_asn1_fields()
         fields.pop('total_pages')
         fields.pop('total_objects')
+        fields.pop('next_cursor')
         return fields
 
 
@@ -13,20 +13,13 @@ from pydantic import BaseModel, Field, SerializeAsAny
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .asn1parser import asn1todict
+from .controls import Control
 from .dialogue import LDAPCodes, Session
 from .ldap_requests import BaseRequest, protocol_id_map
 from .ldap_responses import BaseResponse, LDAPResult
 from .utils import get_class_name
 
 
-class Control(BaseModel):
-    """Controls class."""
-
-    control_type: str
-    criticality: bool = False
-    control_value: str = ''
-
-
 class LDAPMessage(ABC, BaseModel):
     """Base message structure. Pydantic for types validation."""
 
@@ -62,7 +55,7 @@ class LDAPResponseMessage(LDAPMessage):
                 enc.enter(Numbers.Sequence)
                 enc.write(control.control_type, Numbers.OctetString)
                 enc.write(control.criticality, Numbers.Boolean)
-                enc.write(control.control_value, Numbers.OctetString)
+                enc.write(control.value_bytes, Numbers.OctetString)
                 enc.leave()
             enc.leave()
 
@@ -93,11 +86,7 @@ class LDAPRequestMessage(LDAPMessage):
 
         try:
             for ctrl in seq_fields[2].value:
-                controls.append(Control(
-                    control_type=ctrl.value[0].value,
-                    criticality=ctrl.value[1].value,
-                    control_value=ctrl.value[2].value,
-                ))
+                controls.append(Control.from_row(ctrl))
         except (IndexError, ValueError, AttributeError):
             pass
 
@@ -106,6 +95,7 @@ class LDAPRequestMessage(LDAPMessage):
 
         context = protocol_id_map[
             protocol.tag_id.value].from_data(protocol.value)
+        context.set_controls(controls)
         return cls(
             messageID=message_id.value,
             protocolOP=protocol.tag_id.value,
@@ -153,10 +143,12 @@ class LDAPRequestMessage(LDAPMessage):
 
         :yield LDAPResponseMessage: create response for context.
         """
+        self.context.set_controls(self.controls)
+
         async for response in self.context.handle(ldap_session, session):
             yield LDAPResponseMessage(
                 messageID=self.message_id,
                 protocolOP=response.PROTOCOL_OP,
                 context=response,
-                controls=self.controls,
+                controls=getattr(response, 'controls', None) or self.controls,
             )
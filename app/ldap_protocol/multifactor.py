@@ -4,7 +4,6 @@ Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
-import asyncio
 import uuid
 from collections import namedtuple
 from json import JSONDecodeError
@@ -13,11 +12,10 @@ from typing import Annotated, AsyncIterator, Optional
 import httpx
 from fastapi import Depends
 from loguru import logger
-from sqlalchemy import select
 
 from config import Settings, get_settings
+from ldap_protocol.catalogue import catalogue
 from models.database import AsyncSession, get_session
-from models.ldap3 import CatalogueSetting
 
 Creds = namedtuple('Creds', ['key', 'secret'])
 
@@ -43,15 +41,13 @@ async def _get_creds(
 
     :return tuple[str, str]: api key and secret
     """
-    q1 = select(CatalogueSetting).filter_by(name=key_name)
-    q2 = select(CatalogueSetting).filter_by(name=secret_name)
-
-    key, secret = await asyncio.gather(session.scalar(q1), session.scalar(q2))
+    settings = (await catalogue.get(session)).settings
+    key, secret = settings.get(key_name), settings.get(secret_name)
 
     if not key or not secret:
         return None
 
-    return Creds(key.value, secret.value)
+    return Creds(key, secret)
 
 
 async def get_auth(
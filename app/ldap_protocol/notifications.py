@@ -0,0 +1,187 @@
+"""Directory change notifications.
+
+Write requests emit `NOTIFY` with changed directory id inside
+the write transaction, so notification is delivered only after commit.
+Every app replica listens the channel with a single dedicated connection
+and fans out ids to subscribed searches of its sessions.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import asyncpg
+from loguru import logger
+from sqlalchemy import String, cast, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import Select
+
+from config import Settings
+
+CHANNEL = 'directory_changes'
+
+
+async def notify_change(session: AsyncSession, directory_id: int) -> None:
+    """Emit change notification, delivered on transaction commit.
+
+    :param AsyncSession session: db
+    :param int directory_id: changed directory
+    """
+    await session.execute(
+        select(func.pg_notify(CHANNEL, str(directory_id))))
+
+
+async def notify_changes(session: AsyncSession, ids: Select) -> None:
+    """Emit change notifications for each selected directory.
+
+    :param AsyncSession session: db
+    :param Select ids: query of changed directories ids
+    """
+    ids_q = ids.subquery()
+    directory_id = next(iter(ids_q.c))
+
+    await session.execute(
+        select(func.pg_notify(CHANNEL, cast(directory_id, String)))
+        .select_from(ids_q))
+
+
+class Subscription:
+    """Bounded queue of changed directories ids."""
+
+    def __init__(self, maxsize: int, closed: asyncio.Event) -> None:
+        """Set queue.
+
+        :param int maxsize: max count of not handled changes
+        :param asyncio.Event closed: subscriber session close event
+        """
+        self.error: str | None = None
+        self._closed = closed
+        self._queue: asyncio.Queue[int | None] = asyncio.Queue(maxsize)
+
+    def put(self, directory_id: int) -> None:
+        """Add change, drop subscription if subscriber is too slow."""
+        if self.error is not None:
+            return
+
+        try:
+            self._queue.put_nowait(directory_id)
+        except asyncio.QueueFull:
+            self.drop('Change notifications queue overflow')
+
+    def drop(self, error: str) -> None:
+        """Discard pending changes and stop subscription."""
+        self.error = error
+
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+        self._queue.put_nowait(None)
+
+    async def get(self) -> int | None:
+        """Wait for change.
+
+        :return int | None: directory id,
+            None if subscription is dropped or session is closed
+        """
+        get = asyncio.ensure_future(self._queue.get())
+        closed = asyncio.ensure_future(self._closed.wait())
+
+        await asyncio.wait((get, closed), return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+
+        if not get.done():
+            get.cancel()
+            return None
+
+        return get.result()
+
+
+class ChangeNotifier:
+    """Per-process listener of directory changes with bounded subscribers.
+
+    Listening connection is opened with the first subscription
+    and closed with the last one.
+    """
+
+    def __init__(self) -> None:
+        """Set subscriptions."""
+        self._subscriptions: set[Subscription] = set()
+        self._connection: asyncpg.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._subscriptions)
+
+    @asynccontextmanager
+    async def subscribe(
+        self, settings: Settings, closed: asyncio.Event,
+    ) -> AsyncIterator[Subscription]:
+        """Subscribe to changes.
+
+        :param Settings settings: settings
+        :param asyncio.Event closed: subscriber session close event
+        :raises OverflowError: if subscribers limit is reached
+        :yield Subscription: subscription
+        """
+        if len(self) >= settings.NOTIFICATION_MAX_SUBSCRIBERS:
+            raise OverflowError('Too many change notification subscribers')
+
+        subscription = Subscription(settings.NOTIFICATION_QUEUE_SIZE, closed)
+        self._subscriptions.add(subscription)
+
+        try:
+            await self._listen(settings)
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+            await self._unlisten()
+
+    def publish(self, directory_id: int) -> None:
+        """Fan out change to subscriptions."""
+        for subscription in self._subscriptions:
+            subscription.put(directory_id)
+
+    async def _listen(self, settings: Settings) -> None:
+        async with self._lock:
+            if self._connection is not None:
+                return
+
+            url = make_url(str(settings.POSTGRES_URI))
+            self._connection = await asyncpg.connect(
+                url.set(drivername='postgresql').render_as_string(False))
+
+            self._connection.add_termination_listener(self._on_terminate)
+            await self._connection.add_listener(CHANNEL, self._on_notify)
+            logger.info('Listening directory changes')
+
+    async def _unlisten(self) -> None:
+        async with self._lock:
+            if self._subscriptions or self._connection is None:
+                return
+
+            connection, self._connection = self._connection, None
+            if not connection.is_closed():
+                await connection.close()
+
+    def _on_notify(
+        self, _: asyncpg.Connection, __: int, ___: str, payload: str,
+    ) -> None:
+        self.publish(int(payload))
+
+    def _on_terminate(self, connection: asyncpg.Connection) -> None:
+        """Drop subscriptions, changes can't be tracked without listener."""
+        if connection is not self._connection:  # closed by `_unlisten`
+            return
+
+        logger.warning('Directory changes listener connection is lost')
+        self._connection = None
+
+        for subscription in self._subscriptions:
+            subscription.drop('Change notifications are unavailable')
+
+
+change_notifier = ChangeNotifier()
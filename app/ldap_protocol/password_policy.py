@@ -17,6 +17,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from models import Attribute, PasswordPolicy, User
 from security import verify_password
 
+from .attribute_types import attribute_types
+from .catalogue import bump_catalogue_counter, catalogue
 from .utils import dt_to_ft, ft_to_dt
 
 with open('extra/common_pwds.txt') as f:
@@ -31,12 +33,13 @@ async def post_save_password_actions(
     :param AsyncSession session: db
     """
     new_dt = str(dt_to_ft(datetime.now(tz=ZoneInfo('UTC'))))
+    type_id = await attribute_types.get_id(session, 'pwdLastSet')
     await session.execute(  # update bind reject attribute
         update(Attribute)
         .values({'value': new_dt})
         .where(
             Attribute.directory_id == user.directory_id,
-            Attribute.name == 'pwdLastSet',
+            Attribute.type_id == type_id,
             Attribute.value == '0'))
     user.password_history.append(user.password)
     await session.flush()
@@ -83,10 +86,10 @@ class PasswordPolicySchema(BaseModel):
         :param AsyncSession session: db
         :return PasswordPolicySchema: policy
         """
-        policy = await session.scalar(select(PasswordPolicy))
-        if not policy:
+        policy = (await catalogue.get(session)).password_policy
+        if policy is None:
             return cls()
-        return cls.model_validate(policy, from_attributes=True)
+        return cls.model_validate(policy)
 
     async def update_policy_settings(self, session: AsyncSession) -> None:
         """Update policy.
@@ -98,6 +101,7 @@ class PasswordPolicySchema(BaseModel):
             .values(self.model_dump(mode='json'))
         ))
         await session.commit()
+        await bump_catalogue_counter(session)
 
     @classmethod
     async def delete_policy_settings(
@@ -129,9 +133,10 @@ class PasswordPolicySchema(BaseModel):
         history: Iterable = []
 
         if user is not None:
+            type_id = await attribute_types.get_id(session, 'pwdLastSet')
             last_pwd_set = await session.scalar(select(Attribute).where(
                 Attribute.directory_id == user.directory_id,
-                Attribute.name == 'pwdLastSet',
+                Attribute.type_id == type_id,
             ))  # type: ignore
             history = islice(
                 reversed(user.password_history),
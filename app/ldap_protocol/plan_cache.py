@@ -0,0 +1,65 @@
+"""Compiled statements cache.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+from loguru import logger
+
+T = TypeVar('T')
+
+
+class PlanCache(Generic[T]):
+    """Per-process LRU cache of built statements with hit/miss counters.
+
+    Cached statement objects are executed with new bound parameters,
+    so SQLAlchemy compiled cache lookup is done with memoized statement
+    cache key and asyncpg reuses prepared statement of the connection.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        """Set cache size.
+
+        :param int maxsize: max count of cached plans
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans: OrderedDict[Hashable, T] = OrderedDict()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._plans)
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """Get cached plan or build and cache a new one.
+
+        :param Hashable key: normalized statement shape
+        :param Callable[[], T] factory: plan builder
+        :return T: plan
+        """
+        if (plan := self._plans.get(key)) is not None:
+            self.hits += 1
+            self._plans.move_to_end(key)
+            return plan
+
+        self.misses += 1
+        plan = self._plans[key] = factory()
+        logger.debug(f'Plan cache miss: {self.stats}')
+
+        if len(self._plans) > self.maxsize:
+            self._plans.popitem(last=False)
+
+        return plan
+
+    def clear(self) -> None:
+        """Drop cached plans and reset counters."""
+        self._plans.clear()
+        self.hits = self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Get cache counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
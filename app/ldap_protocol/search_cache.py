@@ -0,0 +1,117 @@
+"""Search results cache.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+
+from loguru import logger
+
+from .ldap_responses import SearchResultDone, SearchResultEntry
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """Pre-encoded search entries with result metadata."""
+
+    counter: int
+    expires_at: float
+    entries: tuple[SearchResultEntry, ...]
+    done: SearchResultDone
+    size: int
+
+
+class SearchCache:
+    """Per-process LRU cache of search results, bounded by encoded size.
+
+    Result is valid until ttl expires or directory change counter,
+    shared by app replicas, is incremented by any write operation.
+    """
+
+    def __init__(self) -> None:
+        """Set counters."""
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._results: OrderedDict[Hashable, CachedResult] = OrderedDict()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._results)
+
+    def get(self, key: Hashable, counter: int) -> CachedResult | None:
+        """Get valid cached result.
+
+        :param Hashable key: request key with bound user
+        :param int counter: current directory change counter
+        :return CachedResult | None: result or None if missing or stale
+        """
+        result = self._results.get(key)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        if result.counter != counter or result.expires_at < time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._results.move_to_end(key)
+        return result
+
+    def put(
+        self, key: Hashable, counter: int,
+        entries: list[SearchResultEntry], done: SearchResultDone,
+        ttl: int, max_size: int,
+    ) -> None:
+        """Pre-encode entries and cache result.
+
+        :param Hashable key: request key with bound user
+        :param int counter: directory change counter, read before search
+        :param list[SearchResultEntry] entries: found entries
+        :param SearchResultDone done: result metadata
+        :param int ttl: seconds to live
+        :param int max_size: max size of all cached entries in bytes
+        """
+        size = sum(len(entry.pre_encode()) for entry in entries)
+        if size > max_size:
+            return
+
+        self._pop(key)
+        self._results[key] = CachedResult(
+            counter=counter,
+            expires_at=time.monotonic() + ttl,
+            entries=tuple(entries),
+            done=done,
+            size=size,
+        )
+        self.size += size
+
+        while self.size > max_size:
+            self._pop(next(iter(self._results)))
+
+        logger.debug(f'Search cache put: {self.stats}')
+
+    def _pop(self, key: Hashable) -> None:
+        if (result := self._results.pop(key, None)) is not None:
+            self.size -= result.size
+
+    def clear(self) -> None:
+        """Drop cached results and reset counters."""
+        self._results.clear()
+        self.hits = self.misses = self.size = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Get cache counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+            'bytes': self.size,
+        }
@@ -0,0 +1,151 @@
+"""Search results spool.
+
+Entries are read into a bounded buffer before they are sent, so the
+pooled connection is released, while a slow client reads the result.
+Result, that exceeds the buffer of search or all searches of process,
+is spilled to a temporary file.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import pickle
+from tempfile import TemporaryFile
+from typing import IO, AsyncIterator, Iterator
+
+from loguru import logger
+
+from .ldap_responses import SearchResultEntry
+
+
+class SpooledResult:
+    """Entries of one search, buffered in memory or in temporary file."""
+
+    def __init__(self, spool: 'SearchSpool') -> None:
+        """Set empty buffer."""
+        self._spool = spool
+        self._entries: list[SearchResultEntry] = []
+        self._file: IO[bytes] | None = None
+        self.size = 0  # bytes of entries in memory
+        self.count = 0
+
+    @property
+    def spilled(self) -> bool:  # noqa: D102
+        return self._file is not None
+
+    def __len__(self) -> int:  # noqa: D105
+        return self.count
+
+    def append(self, entry: SearchResultEntry, size: int) -> None:
+        """Add entry to memory or to file, if buffer was spilled."""
+        self.count += 1
+
+        if self._file is not None:
+            pickle.dump(entry, self._file, pickle.HIGHEST_PROTOCOL)
+            return
+
+        self._entries.append(entry)
+        self.size += size
+        self._spool.reserve(size)
+
+    def spill(self) -> None:
+        """Move buffered entries to temporary file, release their size."""
+        self._file = TemporaryFile()
+
+        for entry in self._entries:
+            pickle.dump(entry, self._file, pickle.HIGHEST_PROTOCOL)
+
+        self._entries.clear()
+        self._release()
+
+    def __iter__(self) -> Iterator[SearchResultEntry]:
+        """Read entries, spilled file is read back one entry at a time."""
+        if self._file is None:
+            yield from self._entries
+            return
+
+        self._file.seek(0)
+        for _ in range(self.count):
+            yield pickle.load(self._file)  # noqa: S301  # own temp file
+
+    def _release(self) -> None:
+        self._spool.release(self.size)
+        self.size = 0
+
+    def discard(self) -> None:
+        """Release memory and remove temporary file."""
+        self._release()
+        self._entries.clear()
+
+        if self._file is not None:
+            self._file.close()
+
+
+class SearchSpool:
+    """Per-process spool counters."""
+
+    def __init__(self) -> None:
+        """Set counters."""
+        self.spooled = 0
+        self.overflows = 0
+        self.size = 0  # bytes of entries, buffered by running searches
+        self.peak_size = 0
+
+    async def fill(
+        self, entries: AsyncIterator[SearchResultEntry],
+        max_bytes: int, max_total_bytes: int,
+    ) -> SpooledResult:
+        """Read all entries, spill them to file if buffer is full.
+
+        Result must be given back with `SpooledResult.discard`.
+
+        :param AsyncIterator[SearchResultEntry] entries: db entries
+        :param int max_bytes: max encoded size of entries of search
+        :param int max_total_bytes: max encoded size of entries,
+            buffered by all searches of process
+        :return SpooledResult: entries
+        """
+        result = SpooledResult(self)
+
+        try:
+            async for entry in entries:
+                size = len(entry.pre_encode())
+
+                if not result.spilled and (
+                        result.size + size > max_bytes or
+                        self.size + size > max_total_bytes):
+                    self.overflows += 1
+                    logger.debug(f'Search spool overflow: {self.stats}')
+                    result.spill()
+
+                result.append(entry, size)
+        except BaseException:
+            result.discard()
+            raise
+
+        if not result.spilled:
+            self.spooled += 1
+        return result
+
+    def reserve(self, size: int) -> None:
+        """Add buffered entry size to spool."""
+        self.size += size
+        self.peak_size = max(self.peak_size, self.size)
+
+    def release(self, size: int) -> None:
+        """Drop sent or spilled entries size from spool."""
+        self.size -= size
+
+    def clear(self) -> None:
+        """Reset counters."""
+        self.spooled = self.overflows = self.size = self.peak_size = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Get spool counters."""
+        return {
+            'spooled': self.spooled,
+            'overflows': self.overflows,
+            'size': self.size,
+            'peak_size': self.peak_size,
+        }
@@ -129,50 +129,67 @@ https://github.com/jleclanche/winfiletime/blob/master/winfiletime/filetime.py
 Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
+import asyncio
 import hashlib
+import math
 import random
 import re
 import struct
+import time
 from calendar import timegm
+from collections import OrderedDict
+from contextvars import ContextVar
 from datetime import datetime
 from operator import attrgetter
+from typing import Iterable
 from zoneinfo import ZoneInfo
 
-from asyncstdlib.functools import cache
-from sqlalchemy import Column, func, select, update
+from sqlalchemy import (
+    case,
+    column,
+    delete,
+    func,
+    insert,
+    select,
+    table,
+    text,
+    union,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.orm.interfaces import ORMOption
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.expression import ColumnElement, Select
+from sqlalchemy.sql.selectable import ScalarSelect
 
+from ldap_protocol.catalogue import catalogue
 from models.ldap3 import (
-    CatalogueSetting,
     Directory,
+    DirectoryPath,
     Group,
+    GroupMembership,
+    NestedMembership,
     NetworkPolicy,
     Path,
     User,
+    UserMembership,
+    directory_changes,
 )
 
 email_re = re.compile(
     r"([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+")
 
 
-@cache
 async def get_base_dn(session: AsyncSession, normal: bool = False) -> str:
     """Get base dn for e.g. DC=multifactor,DC=dev.
 
+    :param AsyncSession session: db
+    :param bool normal: get domain name, e.g. multifactor.dev
     :return str: name for the base distinguished name.
     """
-    cat_result = await session.execute(
-        select(CatalogueSetting)
-        .filter(CatalogueSetting.name == 'defaultNamingContext'),
-    )
-    if normal:
-        return cat_result.scalar_one().value
-
-    return ','.join((
-        f'dc={value}' for value in
-        cat_result.scalar_one().value.split('.')))
+    snapshot = await catalogue.get(session)
+    return snapshot.domain if normal else snapshot.base_dn
 
 
 def get_attribute_types() -> list[str]:
@@ -222,28 +239,44 @@ async def get_user(session: AsyncSession, name: str) -> User | None:
     :return User | None: user from db
     """
     if '=' not in name:
+        name = name.lower()
         if email_re.fullmatch(name):
-            cond = User.user_principal_name.ilike(name) | User.mail.ilike(name)
+            cond = (
+                (func.lower(User.user_principal_name) == name) |
+                (func.lower(User.mail) == name))
         else:
-            cond = User.sam_accout_name.ilike(name)
+            cond = func.lower(User.sam_accout_name) == name
 
         return await session.scalar(select(User).where(cond))
 
-    path = await session.scalar(
-        select(Path).where(get_path_filter(_get_path(name))))
-
-    domain = await session.scalar(
-        select(CatalogueSetting)
-        .where(
-            CatalogueSetting.name == 'defaultNamingContext',
-            CatalogueSetting.value == _get_domain(name),
-        ))
+    domain = (await catalogue.get(session)).settings.get(
+        'defaultNamingContext')
 
-    if not domain or not path:
+    if domain != _get_domain(name):
         return None
 
-    return await session.scalar(
-        select(User).where(User.directory == path.endpoint))
+    path = _get_path(name)
+    await tree_index.refresh(session)
+
+    if (directory_id := tree_index.get_id(path)) is not None:
+        user = await session.scalar(
+            select(User).where(User.directory_id == directory_id))
+
+        if user is not None and _has_path(user.directory, path):
+            return user
+
+        tree_index.discard(directory_id)
+
+    user = await session.scalar(
+        select(User)
+        .join(User.directory)
+        .join(Directory.path)
+        .where(get_path_filter(path)))
+
+    if user is not None:  # not refreshed yet
+        tree_index.add(user.directory_id, path)
+
+    return user
 
 
 def validate_entry(entry: str) -> bool:
@@ -260,39 +293,90 @@ def validate_entry(entry: str) -> bool:
         for part in entry.split(','))
 
 
-async def get_groups(
-    dn_list: list[str],
-    session: AsyncSession,
-) -> list[Group]:
-    """Get dirs with groups by dn list."""
-    base_dn = await get_base_dn(session)
+def normalize_dn(dn: str) -> str:
+    """Get lowercase DN without spaces around separators.
 
-    paths = []
+    :param str dn: any DN
+    :return str: normalized DN
+    """
+    return ','.join(
+        '='.join(part.strip() for part in rdn.split('=', 1))
+        for rdn in dn.lower().split(','))
 
-    for dn in dn_list:
-        if dn.lower() == base_dn.lower():  # dn_is_base
-            continue
 
-        base_obj = get_search_path(dn, base_dn)
+def get_dn_paths(
+        dn_list: Iterable[str], base_dn: str) -> dict[tuple[str, ...], str]:
+    """Get lowercase paths of DNs under base dn, duplicates are dropped.
 
-        paths.append([path for path in base_obj if path])
+    :param Iterable[str] dn_list: DNs
+    :param str base_dn: domain dn
+    :return dict[tuple[str, ...], str]: normalized DNs by path
+    """
+    base_dn = normalize_dn(base_dn)
+    paths = {}
 
-    query = select(   # noqa: ECE001
-        Directory)\
-        .join(Directory.path)\
-        .filter(Path.path.in_(paths))\
-        .options(
-            selectinload(Directory.path),
-            selectinload(Directory.group).selectinload(
-                Group.parent_groups).selectinload(
-                    Group.directory).selectinload(Directory.path))
+    for dn in map(normalize_dn, dn_list):
+        if dn.endswith(',' + base_dn):
+            paths[tuple(get_search_path(dn, base_dn))] = dn
 
-    result = await session.stream_scalars(query)
+    return paths
 
-    return [
-        directory.group
-        async for directory in result
-        if directory.group is not None]
+
+def get_paths_filter(paths: Iterable[Iterable[str]]) -> ColumnElement:
+    """Get filter condition for any of paths, uses `lw_path` index.
+
+    :param Iterable[Iterable[str]] paths: lowercase paths
+    :return ColumnElement: filter (where) element
+    """
+    return func.array_lowercase(Path.path, type_=Path.path.type)\
+        .in_([list(path) for path in paths])
+
+
+async def get_directory_ids(
+        session: AsyncSession, dn_list: Iterable[str]) -> dict[str, int]:
+    """Resolve DNs to directory ids with one query.
+
+    :param AsyncSession session: db
+    :param Iterable[str] dn_list: DNs
+    :return dict[str, int]: ids by normalized DN, missing DNs are skipped
+    """
+    paths = get_dn_paths(dn_list, await get_base_dn(session))
+
+    if not paths:
+        return {}
+
+    result = await session.execute(
+        select(Path.endpoint_id, Path.path).where(get_paths_filter(paths)))
+
+    ids = {}
+    for directory_id, path in result:
+        tree_index.add(directory_id, path)
+        ids[paths[tuple(item.lower() for item in path)]] = directory_id
+
+    return ids
+
+
+async def get_groups(
+    dn_list: Iterable[str],
+    session: AsyncSession,
+) -> list[Group]:
+    """Get groups with directories by DNs with one query.
+
+    :param Iterable[str] dn_list: DNs
+    :param AsyncSession session: db
+    :return list[Group]: groups, missing DNs and non group entries
+        are skipped
+    """
+    paths = get_dn_paths(dn_list, await get_base_dn(session))
+
+    if not paths:
+        return []
+
+    return list(await session.scalars(
+        select(Group)
+        .join(Group.directory)
+        .join(Directory.path)
+        .where(get_paths_filter(paths))))
 
 
 async def get_group(dn: str, session: AsyncSession) -> Directory:
@@ -309,22 +393,358 @@ async def get_group(dn: str, session: AsyncSession) -> Directory:
     if dn_is_base:
         raise ValueError('Cannot set memberOf with base dn')
 
-    path = get_search_path(dn, base_dn)
+    directory = await get_directory(
+        session, get_search_path(dn, base_dn),
+        selectinload(Directory.group), selectinload(Directory.path))
+
+    if not directory:
+        raise ValueError("Group not found")
+
+    return directory
+
+
+async def refresh_nested_memberships(
+        session: AsyncSession, group_ids: Iterable[int]) -> None:
+    """Rebuild transitive membership closure of groups.
+
+    Closure depends on nested members, so rows of all groups,
+    containing any of `group_ids` (directly or transitively),
+    are recomputed too. Recursive CTEs use `UNION`, which discards
+    already reached rows, so membership cycles are terminated.
+
+    :param AsyncSession session: db
+    :param Iterable[int] group_ids: groups with changed members
+    """
+    group_ids = set(group_ids)
+    if not group_ids:
+        return
+
+    parents = select(Group.id.label('group_id'))\
+        .where(Group.id.in_(group_ids))\
+        .cte('parents', recursive=True)
+    parents = parents.union(
+        select(GroupMembership.group_id)
+        .join(parents, GroupMembership.group_child_id == parents.c.group_id))
+
+    affected = list(await session.scalars(select(parents.c.group_id)))
+
+    await session.execute(
+        delete(NestedMembership)
+        .where(NestedMembership.group_id.in_(affected)))
+
+    groups = select(  # every group with itself as a root
+        Group.id.label('root_id'),
+        Group.id.label('group_id'),
+    ).where(Group.id.in_(affected)).cte('nested', recursive=True)
+    groups = groups.union(
+        select(groups.c.root_id, GroupMembership.group_child_id)
+        .join(groups, GroupMembership.group_id == groups.c.group_id))
+
+    nested_groups = select(groups.c.root_id, Group.directory_id)\
+        .join(Group, Group.id == groups.c.group_id)\
+        .where(groups.c.root_id != groups.c.group_id)
+
+    nested_users = select(groups.c.root_id, User.directory_id)\
+        .join(UserMembership, UserMembership.group_id == groups.c.group_id)\
+        .join(User, User.id == UserMembership.user_id)
+
+    await session.execute(
+        insert(NestedMembership).from_select(
+            [NestedMembership.group_id, NestedMembership.directory_id],
+            union(nested_groups, nested_users)))
+
+
+async def get_change_counter(session: AsyncSession) -> int:
+    """Get directory change counter, shared across app replicas.
+
+    :param AsyncSession session: db
+    :return int: last counter value
+    """
+    return await session.scalar(
+        select(column('last_value'))
+        .select_from(table(directory_changes.name)))
+
+
+# last taken USN, fresh sequence returns `last_value` by the first `nextval`
+_last_usn: ColumnElement = case(
+    (column('is_called'), column('last_value')),
+    else_=column('last_value') - 1)
+
+
+async def reserve_usn(session: AsyncSession) -> None:
+    """Mark USNs, taken by current transaction, as uncommitted.
+
+    Must be called in write transaction before any USN is taken.
+    Shared advisory lock, keyed by current counter value, is held
+    until transaction end, all USNs of transaction are greater than key.
+
+    :param AsyncSession session: db
+    """
+    await session.execute(
+        select(func.pg_advisory_xact_lock_shared(_last_usn))
+        .select_from(table(directory_changes.name)))
+
+
+_MIN_RESERVED_USN = text(
+    "SELECT min((classid::bigint << 32) | objid::bigint) FROM pg_locks "
+    "WHERE locktype = 'advisory' AND objsubid = 1 AND database = ("
+    "SELECT oid FROM pg_database WHERE datname = current_database())")
+
+
+async def get_committed_usn(session: AsyncSession) -> int:
+    """Get highest USN, all changes up to which are committed.
+
+    Counter is read before reservations, so a writer, which reservation
+    is not seen yet, takes USN greater than the counter.
+
+    :param AsyncSession session: db
+    :return int: USN
+    """
+    counter = await session.scalar(
+        select(_last_usn).select_from(table(directory_changes.name)))
+    reserved = await session.scalar(_MIN_RESERVED_USN)
+    return counter if reserved is None else min(counter, reserved)
+
+
+async def bump_change_counter(session: AsyncSession) -> None:
+    """Increment directory change counter.
+
+    Must be called after commit, sequence increment is not transactional,
+    so readers never cache data of a previous state with a new counter.
+
+    :param AsyncSession session: db
+    """
+    await session.execute(select(directory_changes.next_value()))
+
+
+# max seconds to resolve DNs, renamed by another replica, by the old index
+TREE_REFRESH_INTERVAL = 1.0
+
+
+class TreeIndex:
+    """Per-process index of directory ids by lowercase path.
+
+    Index is loaded by the first refresh, the next ones read only
+    entries, which USN is above the committed USN of the previous one.
+    Refresh is done at most once in refresh interval. Deleted and
+    renamed entries are not tracked until then, so ids are checked
+    by path of the loaded entry, see `get_directory`.
+    """
+
+    def __init__(self, refresh_interval: float) -> None:
+        """Set empty index.
+
+        :param float refresh_interval: seconds between refreshes
+        """
+        self._refresh_interval = refresh_interval
+        self._ids: dict[tuple[str, ...], int] = {}
+        self._paths: dict[int, tuple[str, ...]] = {}
+        self._usn = 0
+        self._checked_at = -math.inf
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._paths)
+
+    def clear(self) -> None:
+        """Drop index, it is loaded again by the next refresh."""
+        self._ids.clear()
+        self._paths.clear()
+        self._usn = 0
+        self._checked_at = -math.inf
+
+    def get_id(self, path: list[str]) -> int | None:
+        """Get directory id.
+
+        :param list[str] path: lowercase path
+        :return int | None: id or None, if path is not indexed
+        """
+        return self._ids.get(tuple(path))
+
+    def add(self, directory_id: int, path: Iterable[str]) -> None:
+        """Set directory path, replaces the previous one.
+
+        :param int directory_id: id
+        :param Iterable[str] path: path
+        """
+        self.discard(directory_id)
+        key = tuple(item.lower() for item in path)
+        self._ids[key] = directory_id
+        self._paths[directory_id] = key
+
+    def discard(self, directory_id: int) -> None:
+        """Drop directory, which indexed path is stale."""
+        path = self._paths.pop(directory_id, None)
+
+        if path is not None and self._ids.get(path) == directory_id:
+            del self._ids[path]
+
+    async def refresh(self, session: AsyncSession) -> None:
+        """Read entries, changed after the previous refresh.
+
+        :param AsyncSession session: db
+        """
+        if time.monotonic() - self._checked_at < self._refresh_interval:
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < self._refresh_interval:
+                return
+
+            usn = await get_committed_usn(session)
+
+            if usn != self._usn:
+                changed = await session.execute(
+                    select(Directory.id, Path.path)
+                    .join(Path, Path.endpoint_id == Directory.id)
+                    .where(Directory.usn_changed > self._usn))
+
+                for directory_id, path in changed:
+                    self.add(directory_id, path)
+
+                self._usn = usn
+
+            self._checked_at = now
+
+
+tree_index = TreeIndex(TREE_REFRESH_INTERVAL)
+
+
+def _has_path(directory: Directory | None, path: list[str]) -> bool:
+    """Check path of loaded directory, joined with it."""
+    return directory is not None and directory.path is not None and \
+        [item.lower() for item in directory.path.path] == path
+
+
+async def get_directory(
+    session: AsyncSession, path: list[str], *options: ORMOption,
+) -> Directory | None:
+    """Get directory by path, id is resolved by tree index.
+
+    Indexed id is loaded by primary key, stale index entry doesn't
+    match the path and is dropped, then directory is looked up by path.
+
+    :param AsyncSession session: db
+    :param list[str] path: lowercase path
+    :param ORMOption options: loader options
+    :return Directory | None: directory
+    """
+    await tree_index.refresh(session)
+
+    if (directory_id := tree_index.get_id(path)) is not None:
+        directory = await session.scalar(
+            select(Directory)
+            .where(Directory.id == directory_id)
+            .options(*options))
+
+        if _has_path(directory, path):
+            return directory
+
+        tree_index.discard(directory_id)
 
     directory = await session.scalar(
         select(Directory)
-        .join(Directory.path).filter(Path.path == path)
-        .options(selectinload(Directory.group), selectinload(Directory.path)))
+        .join(Directory.path)
+        .where(get_path_filter(path))
+        .options(*options))
 
-    if not directory:
-        raise ValueError("Group not found")
+    if directory is not None:  # not refreshed yet
+        tree_index.add(directory.id, path)
 
     return directory
 
 
+DN_CACHE_SIZE = 65536
+
+
+class DNCache:
+    """Per-process LRU cache of DNs, keyed by endpoint directory id.
+
+    DNs are valid for a value of directory change counter, shared by
+    all app replicas, so cache is dropped once any replica renames
+    or deletes entries. Reader stores DNs only if counter, read
+    before its query, is still the current one.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        """Set empty cache.
+
+        :param int maxsize: max count of DNs
+        """
+        self.maxsize = maxsize
+        self.counter: int | None = None
+        self._dns: OrderedDict[tuple[int, str], str] = OrderedDict()
+        self._reader_counter: ContextVar[int | None] = ContextVar(
+            'dn_cache_counter', default=None)
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._dns)
+
+    def validate(self, counter: int) -> None:
+        """Drop cache if directory was changed, bind counter to reader.
+
+        :param int counter: change counter, read before query
+        """
+        if self.counter is None or counter > self.counter:
+            self._dns.clear()
+            self.counter = counter
+
+        self._reader_counter.set(counter)
+
+    def get(self, key: tuple[int, str]) -> str | None:
+        """Get DN, if reader is validated."""
+        if self._reader_counter.get() is None:
+            return None
+
+        if (dn := self._dns.get(key)) is not None:
+            self._dns.move_to_end(key)
+        return dn
+
+    def put(self, key: tuple[int, str], dn: str) -> None:
+        """Store DN, read with the current counter."""
+        if self._reader_counter.get() != self.counter:
+            return
+
+        self._dns[key] = dn
+
+        if len(self._dns) > self.maxsize:
+            self._dns.popitem(last=False)
+
+
+dn_cache = DNCache(DN_CACHE_SIZE)
+
+
+async def validate_dn_cache(session: AsyncSession) -> None:
+    """Validate DN cache before query, which DNs are got with `get_path_dn`.
+
+    :param AsyncSession session: db
+    """
+    dn_cache.validate(await get_change_counter(session))
+
+
 def get_path_dn(path: Path, base_dn: str) -> str:
-    """Get DN from path."""
-    return ','.join(reversed(path.path)) + ',' + base_dn
+    """Get DN from path.
+
+    DNs are cached, so member DNs of large groups are not rebuilt
+    on every read. Cache is used only after `validate_dn_cache`
+    call in current context.
+
+    :param Path path: directory path
+    :param str base_dn: domain dn
+    :return str: distinguished name
+    """
+    key = (path.endpoint_id, base_dn)
+
+    if (dn := dn_cache.get(key)) is not None:
+        return dn
+
+    dn = ','.join(reversed(path.path)) + ',' + base_dn
+
+    if path.endpoint_id is not None:  # flushed
+        dn_cache.put(key, dn)
+
+    return dn
 
 
 async def is_user_group_valid(
@@ -425,32 +845,51 @@ def get_search_path(dn: str, base_dn: str) -> list[str]:
 
 
 def get_path_filter(
-        path: list[str], *, column: Column = Path.path) -> ColumnElement:
+    path: list[str] | BindParameter, *,
+    column: ColumnElement = Path.path,
+) -> ColumnElement:
     """Get filter condition for path equality.
 
-    :param list[str] path: dn
-    :param Column field: path column, defaults to Path.path
+    :param list[str] | BindParameter path: dn or bound parameter
+    :param ColumnElement column: path column or its slice,
+        defaults to Path.path
     :return ColumnElement: filter (where) element
     """
     return func.array_lowercase(column) == path
 
 
-@cache
+def get_directory_id_query(
+        path: list[str] | BindParameter) -> ScalarSelect:
+    """Get directory id subquery by path, uses `lw_path` index.
+
+    :param list[str] | BindParameter path: dn or bound parameter
+    :return ScalarSelect: directory id
+    """
+    path_q = aliased(Path)
+    return select(path_q.endpoint_id).where(
+        get_path_filter(path, column=path_q.path)).scalar_subquery()
+
+
+def get_subtree_query(path: list[str] | BindParameter) -> Select:
+    """Get ids of directory and its descendants by ancestors table.
+
+    :param list[str] | BindParameter path: dn or bound parameter
+    :return Select: directories ids
+    """
+    path_q = aliased(Path)
+    return select(path_q.endpoint_id)\
+        .join(DirectoryPath, DirectoryPath.path_id == path_q.id)\
+        .where(DirectoryPath.dir_id == get_directory_id_query(path))
+
+
 async def get_domain_sid(session: AsyncSession) -> str:
     """Get domain sid."""
-    sid = await session.scalar(select(CatalogueSetting).filter(
-        CatalogueSetting.name == 'domain_object_sid'))
+    return (await catalogue.get(session)).settings['domain_object_sid']
 
-    return sid.value
 
-
-@cache
 async def get_domain_guid(session: AsyncSession) -> str:
     """Get domain objectGUID."""
-    guid = await session.scalar(select(CatalogueSetting).filter(
-        CatalogueSetting.name == 'domain_object_guid'))
-
-    return guid.value
+    return (await catalogue.get(session)).settings['domain_object_guid']
 
 
 def string_to_sid(sid_string: str) -> bytes:
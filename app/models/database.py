@@ -1,55 +1,342 @@
 """Database primitives.
 
+Reads may be routed to replicas: session of a read only request binds
+selects to a replica, which lag is in bounds, and switches to primary
+on the first write, so a request always reads its own writes.
+Engines are shared by all handlers of a process.
+
 Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
-from typing import AsyncContextManager, AsyncGenerator, Callable
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncGenerator, Callable
 
+from loguru import logger
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
     create_async_engine,
 )
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql import Select
 
 from config import Settings
 
 Base = declarative_base()
 
+# replay lag in seconds, zero if replica has replayed all received wal,
+# NULL if wal receiver is not streaming, received wal may be behind primary;
+# status is hidden without pg_read_all_stats, then receiver must be running
+REPLICA_LAG_QUERY = text(
+    'SELECT CASE '
+    'WHEN NOT pg_is_in_recovery() THEN 0 '
+    'WHEN NOT EXISTS (SELECT FROM pg_stat_wal_receiver '
+    "WHERE coalesce(status, 'streaming') = 'streaming') THEN NULL "
+    'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END')
+
+_REPLICA = 'replica'
+
 
 async def get_session() -> None:
     """Stub factory."""
     raise NotImplementedError
 
 
-def get_engine(settings: Settings) -> AsyncEngine:  # noqa
-    return create_async_engine(str(settings.POSTGRES_URI), pool_size=10)
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """Queue pool, which counts checkouts and time to get a connection."""
+
+    def __init__(self, *args: Any, **kw: Any) -> None:
+        """Set counters, pool is recreated with zero counters on dispose."""
+        super().__init__(*args, **kw)
+        self.waiting = 0  # checkouts in progress
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def connect(self) -> Any:
+        """Get connection, awaits free one if pool is exhausted."""
+        self.waiting += 1
+        start = time.perf_counter()
+
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            logger.warning(f'Connection pool timeout: {self.stats}')
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            self.waiting -= 1
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    @property
+    def stats(self) -> dict[str, float]:
+        """Get pool counters."""
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'waiting': self.waiting,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_seconds': self.wait_seconds,
+            'max_wait_seconds': self.max_wait_seconds,
+        }
+
+
+def get_engine(settings: Settings, uri: str | None = None) -> AsyncEngine:
+    """Create engine, asyncpg prepared statements are cached per connection.
+
+    Caches are disabled with pgbouncer, as server connection
+    may change between transactions.
+
+    :param Settings settings: settings
+    :param str | None uri: DSN, primary by default
+    :return AsyncEngine: engine
+    """
+    cache_size = 0 if settings.POSTGRES_PGBOUNCER else \
+        settings.POSTGRES_STATEMENT_CACHE_SIZE
+
+    return create_async_engine(
+        uri or str(settings.POSTGRES_URI),
+        poolclass=MonitoredPool,
+        pool_size=settings.POSTGRES_POOL_SIZE,
+        max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+        pool_timeout=settings.POSTGRES_POOL_TIMEOUT,
+        pool_recycle=settings.POSTGRES_POOL_RECYCLE,
+        pool_pre_ping=settings.POSTGRES_POOL_PRE_PING,
+        connect_args={
+            'prepared_statement_cache_size': cache_size,
+            'statement_cache_size': cache_size,
+        },
+    )
 
 
 def create_get_async_session(
     settings: Settings,
 ) -> Callable[[], AsyncGenerator[AsyncSession, None]]:
     """Acquire session creator func."""
-    engine = get_engine(settings)
+    database = get_database(settings)
 
     async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
         """Acquire session."""
-        async_session = sessionmaker(
-            engine,
+        async with database.session() as session:
+            yield session
+
+    return get_async_session
+
+
+class RoutingSession(Session):
+    """Session, which reads from replica until the first write.
+
+    Replica engine is set to `info`, writes, flushes and any
+    statement, that is not a select, are bound to primary,
+    so are all statements after them.
+    """
+
+    def get_bind(  # type: ignore
+            self, mapper: Any = None, clause: Any = None, **kw: Any) -> Any:
+        """Get replica for reads, primary otherwise."""
+        replica = self.info.get(_REPLICA)
+
+        if replica is not None:
+            if isinstance(clause, Select):
+                return replica
+            self.info[_REPLICA] = None
+
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _bind_flush_to_primary(session: Session, *_: Any) -> None:
+    """Flush is a write, selects of flush and after it read primary."""
+    session.info[_REPLICA] = None
+
+
+class Replica:
+    """Replica engine with cached lag."""
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        """Set replica as not checked.
+
+        :param AsyncEngine engine: replica engine
+        """
+        self.engine = engine
+        self.lag: float | None = None  # None if replica is unavailable
+        self.checked_at = -math.inf
+        self._lock = asyncio.Lock()
+
+    async def is_available(self, max_lag: float, interval: float) -> bool:
+        """Check replica lag, result is cached for `interval` seconds.
+
+        :param float max_lag: max seconds replica may lag behind primary
+        :param float interval: seconds between lag checks
+        :return bool: replica is reachable and lag is in bounds
+        """
+        if time.monotonic() - self.checked_at >= interval:
+            async with self._lock:
+                if time.monotonic() - self.checked_at >= interval:
+                    self.lag = await self._get_lag(interval)
+                    self.checked_at = time.monotonic()
+
+        return self.lag is not None and self.lag <= max_lag
+
+    async def _get_lag(self, timeout: float) -> float | None:
+        try:
+            async with asyncio.timeout(timeout):
+                async with self.engine.connect() as conn:
+                    lag = await conn.scalar(REPLICA_LAG_QUERY)
+        except (OSError, SQLAlchemyError, TimeoutError) as err:
+            logger.warning(f'Replica {self.engine.url!r} unavailable: {err}')
+            return None
+
+        if lag is None:
+            logger.warning(
+                f'Replica {self.engine.url!r} unavailable: not streaming')
+            return None
+
+        return float(lag)
+
+
+class DatabaseRouter:
+    """Primary engine and read replicas."""
+
+    def __init__(self, settings: Settings) -> None:
+        """Create engines, replicas are not connected until used.
+
+        :param Settings settings: settings
+        """
+        self.primary = get_engine(settings)
+        self.replicas = [
+            Replica(get_engine(settings, str(uri)))
+            for uri in settings.POSTGRES_REPLICA_URIS]
+        self.max_lag = settings.POSTGRES_REPLICA_MAX_LAG_SECONDS
+        self.check_interval = settings.POSTGRES_REPLICA_CHECK_SECONDS
+        self._sessionmaker = sessionmaker(
+            self.primary,
             expire_on_commit=False,
             class_=AsyncSession,
+            sync_session_class=RoutingSession,
         )
-        async with async_session() as session:
+        self._next = 0
+
+    @property
+    def sticky_seconds(self) -> float:
+        """Get seconds to read from primary after a write.
+
+        Replica, that was checked right before the write,
+        catches up at most after that time.
+        """
+        return self.max_lag + self.check_interval if self.replicas else 0
+
+    async def get_replica(self) -> Engine | None:
+        """Get next available replica, round robin.
+
+        :return Engine | None: replica or None to read from primary
+        """
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+
+            if await replica.is_available(self.max_lag, self.check_interval):
+                return replica.engine.sync_engine
+
+        return None
+
+    @asynccontextmanager
+    async def session(
+        self, read_only: bool = False,
+    ) -> AsyncGenerator[AsyncSession, None]:
+        """Acquire session.
+
+        :param bool read_only: reads may be routed to replica
+        """
+        replica = await self.get_replica() if read_only else None
+
+        async with self._sessionmaker(info={_REPLICA: replica}) as session:
             yield session
 
-    return get_async_session
+    @property
+    def engines(self) -> dict[str, AsyncEngine]:
+        """Get engines by name."""
+        return {
+            'primary': self.primary,
+            **{
+                f'replica{i}': replica.engine
+                for i, replica in enumerate(self.replicas)},
+        }
+
+    @property
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Get pool counters of engines."""
+        return {
+            name: engine.pool.stats  # type: ignore
+            for name, engine in self.engines.items()}
+
+    async def log_stats(self, interval: float) -> None:
+        """Log pool counters every `interval` seconds, zero disables.
+
+        :param float interval: seconds between log lines
+        """
+        while interval > 0:
+            await asyncio.sleep(interval)
+            logger.info(f'Connection pools: {self.stats}')
+
+    async def dispose(self) -> None:
+        """Close all connections."""
+        for engine in self.engines.values():
+            await engine.dispose()
+
+
+_databases: dict[tuple, DatabaseRouter] = {}
+
+
+def _get_database_key(settings: Settings) -> tuple:
+    """Get settings, engines and routing are created with."""
+    return (
+        str(settings.POSTGRES_URI),
+        tuple(str(uri) for uri in settings.POSTGRES_REPLICA_URIS),
+        settings.POSTGRES_STATEMENT_CACHE_SIZE,
+        settings.POSTGRES_POOL_SIZE,
+        settings.POSTGRES_MAX_OVERFLOW,
+        settings.POSTGRES_POOL_TIMEOUT,
+        settings.POSTGRES_POOL_RECYCLE,
+        settings.POSTGRES_POOL_PRE_PING,
+        settings.POSTGRES_PGBOUNCER,
+        settings.POSTGRES_REPLICA_MAX_LAG_SECONDS,
+        settings.POSTGRES_REPLICA_CHECK_SECONDS,
+    )
+
+
+def get_database(settings: Settings) -> DatabaseRouter:
+    """Get engines of process, shared by handlers with the same db settings.
+
+    :param Settings settings: settings
+    :return DatabaseRouter: primary and replica engines
+    """
+    key = _get_database_key(settings)
+
+    if key not in _databases:
+        _databases[key] = DatabaseRouter(settings)
+
+    return _databases[key]
 
 
 def create_session_factory(
     settings: Settings,
 ) -> Callable[..., AsyncContextManager[AsyncSession]]:
-    """Create session factory."""
-    from contextlib import asynccontextmanager
-    get_async_session = create_get_async_session(settings)
-    return asynccontextmanager(get_async_session)
+    """Create session factory, reads of read only sessions use replicas."""
+    return get_database(settings).session
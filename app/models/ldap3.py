@@ -6,20 +6,24 @@ License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 
 import enum
 import uuid
-from typing import Any, Literal, Optional
+from typing import Any, Iterable, Literal, Optional
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     CheckConstraint,
     Column,
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     LargeBinary,
+    Sequence,
     String,
     UniqueConstraint,
     func,
+    text,
 )
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.compiler import compiles
@@ -55,6 +59,21 @@ def compile_create_uc(
     return stmt
 
 
+# Directory change counter and USN source, incremented on each write,
+# shared by all app replicas.
+directory_changes: Sequence[BigInteger] = Sequence(
+    'DirectoryChanges',
+    metadata=Base.metadata,  # type: ignore[attr-defined, unused-ignore]
+)
+next_usn = text(f"nextval('\"{directory_changes.name}\"')")
+
+# Settings and password policy change counter, shared by all app replicas.
+catalogue_changes: Sequence[BigInteger] = Sequence(
+    'CatalogueChanges',
+    metadata=Base.metadata,  # type: ignore[attr-defined, unused-ignore]
+)
+
+
 class CatalogueSetting(Base):
     """Catalogue params unit."""
 
@@ -81,8 +100,28 @@ class UserMembership(Base):
     user_id = Column(Integer, ForeignKey("Users.id"), primary_key=True)
 
 
+class NestedMembership(Base):
+    """Transitive closure of group and user memberships.
+
+    Row (group_id, directory_id) exists if directory (user or group) is
+    a direct or nested member of a group.
+    """
+
+    __tablename__ = "NestedMemberships"
+    group_id = Column(
+        Integer, ForeignKey("Groups.id", ondelete="CASCADE"),
+        primary_key=True)
+    directory_id = Column(
+        'directoryId', Integer,
+        ForeignKey("Directory.id", ondelete="CASCADE"),
+        primary_key=True, index=True)
+
+
 class DirectoryPath(Base):
-    """Directory - path m2m relationship."""
+    """Directory - path m2m relationship.
+
+    Links each directory with paths of itself and all its descendants.
+    """
 
     __tablename__ = "DirectoryPaths"
     dir_id = Column(Integer, ForeignKey("Directory.id"), primary_key=True)
@@ -112,19 +151,27 @@ class Directory(Base):
 
     __tablename__ = "Directory"
 
-    id = Column(Integer, primary_key=True)  # noqa: A003
+    id: Mapped[int] = Column(Integer, primary_key=True)  # noqa: A003
 
     parent_id = Column(
         'parentId', Integer,
         ForeignKey('Directory.id'), index=True, nullable=True)
 
-    parent: list['Directory'] = relationship(
+    parent: Optional['Directory'] = relationship(
         lambda: Directory, remote_side=id,
         backref=backref('directories', cascade="all,delete"), uselist=False)
 
     object_class: str = Column('objectClass', String, nullable=False)
     objectclass: str = synonym('object_class')
 
+    # lowercase values of `objectClass` attribute, for filters containment
+    object_classes: Mapped[list[str]] = Column(
+        'objectClasses',
+        MutableList.as_mutable(postgresql.ARRAY(String)),
+        default=list,
+        server_default='{}',
+        nullable=False)
+
     name = Column(String, nullable=False)
     cn: str = synonym('name')
 
@@ -138,6 +185,16 @@ class Directory(Base):
         onupdate=func.now(), nullable=True)
     depth = Column(Integer)
 
+    usn_created = Column(
+        'uSNCreated', BigInteger,
+        server_default=next_usn, nullable=False)
+    usncreated: int = synonym('usn_created')
+    usn_changed = Column(
+        'uSNChanged', BigInteger,
+        server_default=next_usn, onupdate=next_usn,
+        nullable=False, index=True)
+    usnchanged: int = synonym('usn_changed')
+
     object_sid = Column('objectSid', String)
     objectsid: str = synonym('object_sid')
 
@@ -169,11 +226,22 @@ class Directory(Base):
     computer: 'Computer' = relationship(
         'Computer', uselist=False, cascade="all,delete")
 
+    nested_groups: list['Group'] = relationship(
+        'Group',
+        secondary=NestedMembership.__table__,
+        primaryjoin='Directory.id == NestedMembership.directory_id',
+        secondaryjoin='Group.id == NestedMembership.group_id',
+        viewonly=True,
+    )
+
     __table_args__ = (
         UniqueConstraint(
             'parentId', 'name',
             postgresql_nulls_not_distinct=True,
             name='name_parent_uc'),
+        Index(
+            'ix_Directory_objectClasses', 'objectClasses',
+            postgresql_using='gin'),
     )
 
     search_fields = {
@@ -181,6 +249,8 @@ class Directory(Base):
         'name': 'name',
         'objectguid': 'objectGUID',
         'objectsid': 'objectSid',
+        'usncreated': 'uSNCreated',
+        'usnchanged': 'uSNChanged',
     }
 
     ro_fields = {
@@ -190,8 +260,20 @@ class Directory(Base):
         "authTimestamp",
         "objectGUID",
         "objectSid",
+        "uSNCreated",
+        "uSNChanged",
     }
 
+    def add_object_classes(self, values: Iterable[str]) -> None:
+        """Add values of `objectClass` attribute to lowercase array."""
+        if not self.object_classes:
+            self.object_classes = []
+
+        for value in values:
+            value = value.lower()
+            if value not in self.object_classes:
+                self.object_classes.append(value)
+
     def get_dn_prefix(self) -> DistinguishedNamePrefix:
         """Get distinguished name prefix."""
         return {
@@ -209,8 +291,7 @@ class Directory(Base):
         dn: DistinguishedNamePrefix = 'cn',
     ) -> 'Path':
         """Create Path from a new directory."""
-        pre_path: list[str] =\
-            parent.path.path if parent else []  # type: ignore
+        pre_path: list[str] = parent.path.path if parent else []
         return Path(
             path=pre_path + [self.get_dn(dn)],
             endpoint=self)
@@ -287,7 +368,7 @@ class Group(DirectoryReferenceMixin, Base):
 
     __tablename__ = "Groups"
 
-    id = Column(Integer, primary_key=True)  # noqa: A003
+    id: Mapped[int] = Column(Integer, primary_key=True)  # noqa: A003
     search_fields: dict[str, str] = {}
 
     child_groups: list['Group'] = relationship(
@@ -332,6 +413,20 @@ class Computer(DirectoryReferenceMixin, Base):
     __tablename__ = "Computers"
 
 
+class AttributeType(Base):
+    """Attribute types dictionary.
+
+    Name is stored once per type, attribute values reference it by id.
+    Types are case-insensitive, `name` keeps the first used spelling.
+    """
+
+    __tablename__ = "AttributeTypes"
+
+    id = Column(Integer, primary_key=True)  # noqa: A003
+    name: Mapped[str] = Column(String, nullable=False)
+    lower_name = Column('lowerName', String, nullable=False, unique=True)
+
+
 class Attribute(DirectoryReferenceMixin, Base):
     """Attributes data."""
 
@@ -341,13 +436,22 @@ class Attribute(DirectoryReferenceMixin, Base):
             '(value IS NULL) <> (bvalue IS NULL)',
             name='constraint_value_xor_bvalue'),)
 
-    name = Column(String, nullable=False, index=True)
+    type_id = Column(
+        'typeId', Integer, ForeignKey('AttributeTypes.id'),
+        nullable=False, index=True)
     value = Column(String, nullable=True)
     bvalue = Column(LargeBinary, nullable=True)
 
+    attribute_type: AttributeType = relationship(
+        AttributeType, lazy='joined', innerjoin=True)
     directory: Directory = relationship(
         'Directory', back_populates='attributes', uselist=False)
 
+    @property
+    def name(self) -> str:
+        """Get attribute type name."""
+        return self.attribute_type.name
+
 
 class Path(Base):
     """Directory path data."""
@@ -355,9 +459,11 @@ class Path(Base):
     __tablename__ = "Paths"
 
     id = Column(Integer, primary_key=True)  # noqa: A003
-    path = Column(postgresql.ARRAY(String), nullable=False, index=True)
+    path: Mapped[list[str]] = Column(
+        postgresql.ARRAY(String), nullable=False, index=True)
 
-    endpoint_id = Column(Integer, ForeignKey('Directory.id'), nullable=False)
+    endpoint_id: Mapped[int] = Column(
+        Integer, ForeignKey('Directory.id'), nullable=False, index=True)
     endpoint: Directory = relationship(
         "Directory", back_populates="path", lazy="joined")
 
@@ -148,7 +148,8 @@ async def session(
     """Get session and aquire after completion."""
     async with test_session(session_factory, engine) as session:
         @asynccontextmanager
-        async def create_session() -> AsyncIterator[AsyncSession]:
+        async def create_session(
+                read_only: bool = False) -> AsyncIterator[AsyncSession]:
             yield session
 
         async def get_test_async_session() -> AsyncIterator[AsyncSession]:
@@ -16,8 +16,10 @@ from app.api.auth.oauth2 import authenticate_user, create_token
 from app.config import Settings
 
 if TYPE_CHECKING:
+    from app.ldap_protocol.catalogue import bump_catalogue_counter
     from app.ldap_protocol.multifactor import MultifactorAPI
 else:
+    from ldap_protocol.catalogue import bump_catalogue_counter
     from ldap_protocol.multifactor import MultifactorAPI  # sync object ids
 
 from app.models import CatalogueSetting
@@ -65,6 +67,7 @@ async def test_connect_mfa(
     )
     session.add(CatalogueSetting(name='mfa_key', value='123'))
     await session.commit()
+    await bump_catalogue_counter(session)
 
     redirect_url = "example.com"
 
@@ -3,12 +3,19 @@
 Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
+import json
 import uuid
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import Settings
 from app.ldap_protocol.dialogue import LDAPCodes, Operation
+from ldap_protocol.ldap_requests.search import search_cache, search_plans
+from ldap_protocol.utils import bump_change_counter
+from models.ldap3 import Path
 
 
 @pytest.mark.asyncio()
@@ -99,6 +106,39 @@ async def test_api_search(
     )
 
 
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_stream(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test streamed search lines match search response."""
+    request = {
+        "base_object": "dc=md,dc=test",
+        "scope": 2,
+        "deref_aliases": 0,
+        "size_limit": 1000,
+        "time_limit": 10,
+        "types_only": True,
+        "filter": "(objectClass=*)",
+        "attributes": ["cn", "objectGUID"],
+        "page_number": 1,
+    }
+    response = (await http_client.post(
+        "entry/search", json=request, headers=login_headers)).json()
+
+    raw_response = await http_client.post(
+        "entry/search/stream", json=request, headers=login_headers)
+    assert raw_response.headers['content-type'] == 'application/x-ndjson'
+
+    *entries, done = map(json.loads, raw_response.text.splitlines())
+
+    assert entries == response['search_result']
+    assert done == {
+        key: value for key, value in response.items()
+        if key != 'search_result'}
+    assert done['resultCode'] == LDAPCodes.SUCCESS
+
+
 @pytest.mark.asyncio()
 @pytest.mark.usefixtures('setup_session')
 @pytest.mark.usefixtures('session')
@@ -866,3 +906,543 @@ async def test_api_add_double_case_insensetive(
     )
 
     assert response.json().get('resultCode') == LDAPCodes.ENTRY_ALREADY_EXISTS
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_filter_memberof_in_chain(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test nested membership search with a membership cycle."""
+    admins = 'cn=domain admins,cn=groups,dc=md,dc=test'
+    developers = 'cn=developers,cn=groups,dc=md,dc=test'
+
+    for entry, group in ((developers, admins), (admins, developers)):
+        response = await http_client.patch(
+            "/entry/update",
+            json={
+                "object": entry,
+                "changes": [
+                    {
+                        "operation": Operation.ADD,
+                        "modification": {
+                            "type": "memberOf",
+                            "vals": [group],
+                        },
+                    },
+                ],
+            },
+            headers=login_headers,
+        )
+        assert response.json()['resultCode'] == LDAPCodes.SUCCESS
+
+    raw_response = await http_client.post(
+        "entry/search",
+        json={
+            "base_object": "dc=md,dc=test",
+            "scope": 2,
+            "deref_aliases": 0,
+            "size_limit": 1000,
+            "time_limit": 10,
+            "types_only": False,
+            "filter": f"(memberOf:1.2.840.113556.1.4.1941:={admins})",
+            "attributes": ['msDS-memberOfTransitive'],
+            "page_number": 1,
+        },
+        headers=login_headers,
+    )
+
+    response = raw_response.json()
+
+    assert response['resultCode'] == LDAPCodes.SUCCESS
+    assert {
+        entry['object_name'] for entry in response['search_result'][1:]
+    } == {
+        developers,
+        'cn=user0,ou=users,dc=md,dc=test',
+        'cn=user1,ou=moscow,ou=russia,ou=users,dc=md,dc=test',
+    }
+
+    for entry in response['search_result']:
+        if entry['object_name'].startswith('cn=user1'):
+            attrs = {
+                attr['type']: attr['vals']
+                for attr in entry['partial_attributes']}
+            assert set(attrs['msDS-memberOfTransitive']) == {
+                admins, developers}
+
+    response = await http_client.patch(
+        "/entry/update",
+        json={
+            "object": developers,
+            "changes": [
+                {
+                    "operation": Operation.DELETE,
+                    "modification": {
+                        "type": "memberOf",
+                        "vals": [
+                            admins.upper(),
+                            "cn=missing,cn=groups,dc=md,dc=test",
+                        ],
+                    },
+                },
+            ],
+        },
+        headers=login_headers,
+    )
+    assert response.json()['resultCode'] == LDAPCodes.SUCCESS
+
+    raw_response = await http_client.post(
+        "entry/search",
+        json={
+            "base_object": "dc=md,dc=test",
+            "scope": 2,
+            "deref_aliases": 0,
+            "size_limit": 1000,
+            "time_limit": 10,
+            "types_only": True,
+            "filter": (
+                "(member:1.2.840.113556.1.4.1941:="
+                "cn=user0,ou=users,dc=md,dc=test)"),
+            "attributes": [],
+            "page_number": 1,
+        },
+        headers=login_headers,
+    )
+
+    assert {
+        entry['object_name']
+        for entry in raw_response.json()['search_result'][1:]
+    } == {admins, developers}
+
+    raw_response = await http_client.post(
+        "entry/search",
+        json={
+            "base_object": "dc=md,dc=test",
+            "scope": 2,
+            "deref_aliases": 0,
+            "size_limit": 1000,
+            "time_limit": 10,
+            "types_only": True,
+            "filter": f"(memberOf:1.2.840.113556.1.4.1941:={admins})",
+            "attributes": [],
+            "page_number": 1,
+        },
+        headers=login_headers,
+    )
+
+    assert {
+        entry['object_name']
+        for entry in raw_response.json()['search_result'][1:]
+    } == {'cn=user0,ou=users,dc=md,dc=test'}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('adding_test_user')
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_update_dn_subtree_dn_cache(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test cached DNs of subordinates are updated after update DN."""
+    search = {
+        "base_object": "ou=users,dc=md,dc=test",
+        "scope": 2,
+        "deref_aliases": 0,
+        "size_limit": 1000,
+        "time_limit": 10,
+        "types_only": True,
+        "filter": "(objectClass=user)",
+        "attributes": [],
+    }
+
+    response = await http_client.post(
+        "entry/search", json=search, headers=login_headers)
+    dns = {obj['object_name'] for obj in response.json()['search_result']}
+
+    assert "cn=user1,ou=moscow,ou=russia,ou=users,dc=md,dc=test" in dns
+
+    response = await http_client.put(
+        "/entry/update/dn",
+        json={
+            "entry": "ou=russia,ou=users,dc=md,dc=test",
+            "newrdn": "ou=rus",
+            "deleteoldrdn": True,
+            "new_superior": None,
+        },
+        headers=login_headers,
+    )
+
+    assert response.json().get('resultCode') == LDAPCodes.SUCCESS
+
+    response = await http_client.post(
+        "entry/search", json=search, headers=login_headers)
+    dns = {obj['object_name'] for obj in response.json()['search_result']}
+
+    assert "cn=user1,ou=moscow,ou=rus,ou=users,dc=md,dc=test" in dns
+    assert "cn=user1,ou=moscow,ou=russia,ou=users,dc=md,dc=test" not in dns
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_api_dn_cache_external_rename(
+        http_client: AsyncClient,
+        login_headers: dict,
+        session: AsyncSession) -> None:
+    """Test cached DNs are dropped after rename by other app replica."""
+    async def search() -> set[str]:
+        response = await http_client.post(
+            "entry/search",
+            json={
+                "base_object": "ou=users,dc=md,dc=test",
+                "scope": 2,
+                "deref_aliases": 0,
+                "size_limit": 1000,
+                "time_limit": 10,
+                "types_only": True,
+                "filter": "(objectClass=user)",
+                "attributes": [],
+            },
+            headers=login_headers,
+        )
+        return {
+            obj['object_name']
+            for obj in response.json()['search_result']}
+
+    assert 'cn=user0,ou=users,dc=md,dc=test' in await search()
+
+    # other replica updates paths and shared counter only
+    await session.execute(
+        update(Path)
+        .where(Path.path.any('cn=user0'))
+        .values(path=func.array_replace(Path.path, 'cn=user0', 'cn=user00'))
+        .execution_options(synchronize_session=False))
+    await session.commit()
+    await bump_change_counter(session)
+    session.expire_all()
+
+    dns = await search()
+
+    assert 'cn=user00,ou=users,dc=md,dc=test' in dns
+    assert 'cn=user0,ou=users,dc=md,dc=test' not in dns
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_pages(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test pages by number and by cursor have page size."""
+    request = {
+        "base_object": "ou=users,dc=md,dc=test",
+        "scope": 2,
+        "deref_aliases": 0,
+        "size_limit": 1000,
+        "time_limit": 10,
+        "types_only": True,
+        "filter": "(objectClass=*)",
+        "attributes": [],
+        "page_number": 1,
+    }
+
+    async def search(**fields: str | int) -> dict:
+        response = await http_client.post(
+            "entry/search", json=request | fields, headers=login_headers)
+        return response.json()
+
+    data = await search()
+    names = [entry['object_name'] for entry in data['search_result']]
+    assert data['next_cursor'] is None
+    assert len(names) == data['total_objects'] == 5
+
+    data = await search(page_number=2, size_limit=2)
+    assert [entry['object_name'] for entry in data['search_result']] == \
+        names[2:4]
+
+    pages = []
+    data = await search(size_limit=2)
+    pages.append(data['search_result'])
+
+    while data['next_cursor']:
+        data = await search(
+            page_number=None, size_limit=2, cursor=data['next_cursor'])
+        assert data['resultCode'] == LDAPCodes.SUCCESS
+        assert data['total_objects'] == 5
+        assert data['total_pages'] == 3
+        pages.append(data['search_result'])
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [entry['object_name'] for page in pages for entry in page] == names
+
+    data = await search(page_number=None, cursor='invalid')
+    assert data['resultCode'] == LDAPCodes.PROTOCOL_ERROR
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_plan_cache(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test filters of the same shape reuse plan with new parameters."""
+    search_plans.clear()
+
+    for name in ('user0', 'user1', 'user0'):
+        response = await http_client.post(
+            "entry/search",
+            json={
+                "base_object": "ou=users,dc=md,dc=test",
+                "scope": 2,
+                "deref_aliases": 0,
+                "size_limit": 1000,
+                "time_limit": 10,
+                "types_only": True,
+                "filter": f"(&(objectClass=user)(sAMAccountName={name}))",
+                "attributes": [],
+                "page_number": 1,
+            },
+            headers=login_headers,
+        )
+        data = response.json()
+
+        assert data['resultCode'] == LDAPCodes.SUCCESS
+        assert data['total_objects'] == 1
+        assert data['search_result'][0]['object_name'].startswith(
+            f'cn={name},')
+
+    assert search_plans.stats == {'hits': 2, 'misses': 1, 'size': 1}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_filter_contradiction(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test contradicting filter returns no entries."""
+    response = await http_client.post(
+        "entry/search",
+        json={
+            "base_object": "ou=users,dc=md,dc=test",
+            "scope": 2,
+            "deref_aliases": 0,
+            "size_limit": 1000,
+            "time_limit": 10,
+            "types_only": True,
+            "filter": "(&(objectClass=*)(cn=user0)(!(cn=user0)))",
+            "attributes": [],
+        },
+        headers=login_headers,
+    )
+    data = response.json()
+
+    assert data['resultCode'] == LDAPCodes.SUCCESS
+    assert data['search_result'] == []
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_result_cache(
+        http_client: AsyncClient, login_headers: dict,
+        settings: Settings) -> None:
+    """Test search result cache is invalidated by directory change."""
+    entry_dn = 'cn=user0,ou=users,dc=md,dc=test'
+    settings.SEARCH_CACHE_TTL_SECONDS = 60
+    search_cache.clear()
+
+    async def get_description() -> list[str]:
+        response = await http_client.post(
+            "entry/search",
+            json={
+                "base_object": entry_dn,
+                "scope": 0,
+                "deref_aliases": 0,
+                "size_limit": 1000,
+                "time_limit": 10,
+                "types_only": True,
+                "filter": "(objectClass=*)",
+                "attributes": ['description'],
+            },
+            headers=login_headers,
+        )
+        data = response.json()
+        assert data['resultCode'] == LDAPCodes.SUCCESS
+        return [
+            val
+            for attr in data['search_result'][0]['partial_attributes']
+            if attr['type'] == 'description'
+            for val in attr['vals']]
+
+    try:
+        assert await get_description() == []
+        assert await get_description() == []
+        assert search_cache.hits == 1
+
+        response = await http_client.patch(
+            "/entry/update",
+            json={
+                "object": entry_dn,
+                "changes": [
+                    {
+                        "operation": Operation.REPLACE,
+                        "modification": {
+                            "type": "description",
+                            "vals": ["cached"],
+                        },
+                    },
+                ],
+            },
+            headers=login_headers,
+        )
+        assert response.json()['resultCode'] == LDAPCodes.SUCCESS
+
+        assert await get_description() == ['cached']
+        assert search_cache.hits == 1
+
+        response = await http_client.patch(
+            "auth/user/password",
+            json={"identity": "user0", "new_password": "Password123"},
+            headers=login_headers,
+        )
+        assert response.status_code == 200
+
+        assert await get_description() == ['cached']
+        assert search_cache.hits == 1
+
+        for _ in range(2):
+            response = await http_client.post(
+                "entry/search",
+                json={
+                    "base_object": "",
+                    "scope": 0,
+                    "deref_aliases": 0,
+                    "size_limit": 1000,
+                    "time_limit": 10,
+                    "types_only": True,
+                    "filter": "(objectClass=*)",
+                    "attributes": [],
+                },
+                headers=login_headers,
+            )
+            assert response.json()['resultCode'] == LDAPCodes.SUCCESS
+
+        assert search_cache.hits == 1
+    finally:
+        settings.SEARCH_CACHE_TTL_SECONDS = 0
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_search_usn_changed(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test writes stamp uSNChanged and it is filtered as integer."""
+    entry_dn = 'cn=user0,ou=users,dc=md,dc=test'
+
+    async def search(filter_: str) -> list[dict]:
+        response = await http_client.post(
+            "entry/search",
+            json={
+                "base_object": "ou=users,dc=md,dc=test",
+                "scope": 2,
+                "deref_aliases": 0,
+                "size_limit": 1000,
+                "time_limit": 10,
+                "types_only": True,
+                "filter": filter_,
+                "attributes": ['uSNCreated', 'uSNChanged'],
+            },
+            headers=login_headers,
+        )
+        data = response.json()
+        assert data['resultCode'] == LDAPCodes.SUCCESS
+        return data['search_result']
+
+    def get_usn(entry: dict) -> dict[str, int]:
+        return {
+            attr['type']: int(attr['vals'][0])
+            for attr in entry['partial_attributes']
+            if attr['type'].startswith('uSN')}
+
+    usn = get_usn((await search('(cn=user0)'))[0])
+
+    response = await http_client.patch(
+        "/entry/update",
+        json={
+            "object": entry_dn,
+            "changes": [
+                {
+                    "operation": Operation.REPLACE,
+                    "modification": {
+                        "type": "description",
+                        "vals": ["usn"],
+                    },
+                },
+            ],
+        },
+        headers=login_headers,
+    )
+    assert response.json()['resultCode'] == LDAPCodes.SUCCESS
+
+    new_usn = get_usn((await search('(cn=user0)'))[0])
+    assert new_usn['uSNCreated'] == usn['uSNCreated']
+    assert new_usn['uSNChanged'] > usn['uSNChanged']
+
+    changed = await search(f"(uSNChanged>={new_usn['uSNChanged']})")
+    assert [entry['object_name'] for entry in changed] == [entry_dn]
+
+    response = await http_client.patch(
+        "auth/user/password",
+        json={"identity": "user0", "new_password": "Password123"},
+        headers=login_headers,
+    )
+    assert response.status_code == 200
+
+    password_usn = get_usn((await search('(cn=user0)'))[0])
+    assert password_usn['uSNChanged'] > new_usn['uSNChanged']
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_api_modify_delete_unknown_type(
+        http_client: AsyncClient, login_headers: dict) -> None:
+    """Test delete of never set attribute type keeps entry attributes."""
+    entry_dn = 'cn=user0,ou=users,dc=md,dc=test'
+
+    async def get_attributes() -> list[dict]:
+        response = await http_client.post(
+            "entry/search",
+            json={
+                "base_object": entry_dn,
+                "scope": 0,
+                "deref_aliases": 0,
+                "size_limit": 1000,
+                "time_limit": 10,
+                "types_only": False,
+                "filter": "(objectClass=*)",
+                "attributes": ['*'],
+            },
+            headers=login_headers,
+        )
+        data = response.json()
+        assert data['resultCode'] == LDAPCodes.SUCCESS
+        return [
+            attr for attr in data['search_result'][0]['partial_attributes']
+            if attr['type'] not in ('uSNChanged', 'whenChanged')]
+
+    attributes = await get_attributes()
+
+    response = await http_client.patch(
+        "/entry/update",
+        json={
+            "object": entry_dn,
+            "changes": [
+                {
+                    "operation": Operation.DELETE,
+                    "modification": {"type": "neverSetType", "vals": []},
+                },
+            ],
+        },
+        headers=login_headers,
+    )
+    assert response.json()['resultCode'] == LDAPCodes.SUCCESS
+    assert await get_attributes() == attributes
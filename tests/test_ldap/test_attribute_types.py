@@ -0,0 +1,42 @@
+"""Test attribute types dictionary.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import pytest
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from ldap_protocol.attribute_types import attribute_types
+from models.ldap3 import AttributeType
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_attribute_types_map(
+        session: AsyncSession, engine: AsyncEngine) -> None:
+    """Test types are shared case-insensitively and cached if committed."""
+    attribute_types.clear()
+
+    assert await attribute_types.get_id(session, 'testAttribute') is None
+
+    ids = await attribute_types.get_ids(session, ['testAttribute'])
+    assert ids == await attribute_types.get_ids(session, ['TESTATTRIBUTE'])
+    assert not len(attribute_types)  # created by current transaction
+
+    async with engine.begin() as conn:  # committed by other transaction
+        type_id = await conn.scalar(
+            insert(AttributeType)
+            .values({'name': 'otherAttribute', 'lowerName': 'otherattribute'})
+            .returning(AttributeType.id))
+
+    try:
+        assert await attribute_types.get_id(
+            session, 'OtherAttribute') == type_id
+        assert len(attribute_types) == 1
+    finally:
+        attribute_types.clear()
+        async with engine.begin() as conn:
+            await conn.execute(
+                delete(AttributeType).filter_by(id=type_id))
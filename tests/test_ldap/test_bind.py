@@ -4,14 +4,17 @@ Copyright (c) 2024 MultiFactor
 License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
 """
 
+import asyncio
 from asyncio import BaseEventLoop
 from functools import partial
 from unittest.mock import AsyncMock
 
 import pytest
 from ldap3 import PLAIN, SASL, Connection
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from api.main.schema import SearchRequest
 from app.ldap_protocol.dialogue import Session
 from app.ldap_protocol.ldap_requests.bind import (
     BindRequest,
@@ -22,6 +25,7 @@ from app.ldap_protocol.ldap_requests.bind import (
 )
 from app.models.ldap3 import Directory, User
 from app.security import get_password_hash
+from ldap_protocol.ldap_responses import SearchResultDone, SearchResultEntry
 from tests.conftest import TestCreds
 
 
@@ -107,6 +111,42 @@ async def test_bind_invalid_password_or_user(
     assert ldap_session.user is None
 
 
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_bind_during_search(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test bind is not blocked by search, which keeps bound user."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    search = SearchRequest(
+        base_object='dc=md,dc=test',
+        scope=2,
+        deref_aliases=0,
+        size_limit=0,
+        time_limit=0,
+        types_only=True,
+        filter='(objectClass=*)',
+        attributes=[],
+    ).handle(ldap_session, session)
+    assert isinstance(await anext(search), SearchResultEntry)
+
+    bind = BindRequest(
+        version=0,
+        name='user0',
+        AuthenticationChoice=SimpleAuthentication(password='fail'),  # noqa
+    )
+    result = await asyncio.wait_for(
+        anext(bind.handle(ldap_session, session)), 1)
+    assert result.result_code == LDAPCodes.INVALID_CREDENTIALS
+    assert ldap_session.user is None  # failed bind leaves session anonymous
+
+    *entries, done = [response async for response in search]
+    assert isinstance(done, SearchResultDone)
+    assert done.result_code == LDAPCodes.SUCCESS
+    assert entries
+
+
 @pytest.mark.asyncio()
 async def test_anonymous_bind(
         session: AsyncSession, ldap_session: Session) -> None:
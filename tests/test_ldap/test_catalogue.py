@@ -0,0 +1,37 @@
+"""Test catalogue settings snapshot.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from ldap_protocol.catalogue import CatalogueCache, get_catalogue_counter
+from models.ldap3 import CatalogueSetting, catalogue_changes
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_catalogue_snapshot(
+        session: AsyncSession, engine: AsyncEngine) -> None:
+    """Test snapshot is reused until counter is changed by other replica."""
+    cache = CatalogueCache(refresh_interval=0)
+    snapshot = await cache.get(session)
+
+    assert snapshot.base_dn == 'dc=md,dc=test'
+    assert snapshot.domain == 'md.test'
+    assert await cache.get(session) is snapshot
+
+    await session.execute(
+        update(CatalogueSetting)
+        .where(CatalogueSetting.name == 'defaultNamingContext')
+        .values(value='md.example'))
+    assert await cache.get(session) is snapshot  # not bumped
+
+    async with engine.connect() as conn:  # other replica write
+        await conn.execute(select(catalogue_changes.next_value()))
+
+    assert await get_catalogue_counter(session) > snapshot.counter
+    assert (await cache.get(session)).base_dn == 'dc=md,dc=example'
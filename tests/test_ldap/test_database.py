@@ -0,0 +1,57 @@
+"""Test shared engines and connection pool counters.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.__main__ import PoolClientHandler
+from config import Settings
+from models.database import get_database, get_engine
+
+
+def test_shared_database(
+        settings: Settings, handler: PoolClientHandler) -> None:
+    """Test handlers of a process share engines."""
+    assert get_database(settings) is handler.database
+    assert PoolClientHandler(settings).database is handler.database
+    assert get_database(settings.get_copy_4_tls()) is handler.database
+
+    resized = settings.model_copy(update={'POSTGRES_POOL_SIZE': 1})
+    assert get_database(resized) is not handler.database
+
+
+@pytest.mark.asyncio()
+async def test_pool_stats(settings: Settings) -> None:
+    """Test pool counts checkouts, waiters and timeouts."""
+    engine = get_engine(settings.model_copy(update={
+        'POSTGRES_POOL_SIZE': 1,
+        'POSTGRES_MAX_OVERFLOW': 0,
+        'POSTGRES_POOL_TIMEOUT': 0.1,
+    }))
+    pool = engine.pool
+
+    try:
+        async with engine.connect():
+            assert pool.stats['checked_out'] == 1  # type: ignore
+
+            with pytest.raises(PoolTimeoutError):
+                await engine.connect()
+
+            waiter = asyncio.ensure_future(engine.connect())
+            await asyncio.sleep(0.05)
+            assert pool.stats['waiting'] == 1  # type: ignore
+
+        await (await waiter).close()
+
+        stats = pool.stats  # type: ignore
+        assert stats['waiting'] == stats['checked_out'] == 0
+        assert stats['checkouts'] == 3
+        assert stats['timeouts'] == 1
+        assert stats['max_wait_seconds'] >= 0.1
+    finally:
+        await engine.dispose()
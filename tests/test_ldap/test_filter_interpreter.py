@@ -0,0 +1,376 @@
+"""Test filter interpreter.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+import pytest
+from asn1 import Decoder
+from ldap3.operation.search import compile_filter as compile_ldap3_filter
+from ldap3.operation.search import parse_filter as parse_ldap3_filter
+from ldap_filter import Filter
+from pyasn1.codec.ber import encoder
+from sqlalchemy import and_, func, not_, or_, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import Select
+
+from api.main.schema import SearchRequest
+from ldap_protocol.asn1parser import asn1todict
+from ldap_protocol.attribute_types import attribute_types, get_type_id_query
+from ldap_protocol.dialogue import LDAPCodes, Operation, Session
+from ldap_protocol.filter_interpreter import (
+    FILTER_FALSE,
+    FILTER_TRUE,
+    BoundQ,
+    FilterGroup,
+    FilterTerm,
+    cast_str_filter2sql,
+    compile_filter,
+    parse_filter,
+    parse_str_filter,
+)
+from ldap_protocol.filter_optimizer import optimize_filter
+from ldap_protocol.ldap_requests import AddRequest, ModifyRequest
+from ldap_protocol.ldap_requests.modify import Changes
+from ldap_protocol.ldap_responses import PartialAttribute
+from ldap_protocol.utils import get_directory
+from models.ldap3 import Attribute, Directory, User
+
+BASE_DN = 'dc=md,dc=test'
+
+
+def _cast_outer_join(expr: Filter, query: Select) -> BoundQ:
+    """Cast filter with an outer join per term, previous implementation."""
+    if expr.type == 'group':
+        conditions = []
+        for item in expr.filters:
+            cond, query = _cast_outer_join(item, query)
+            conditions.append(cond)
+
+        return {
+            '&': and_, '|': or_, '!': not_,
+        }[expr.comp](*conditions), query
+
+    if expr.attr in User.search_fields:
+        col = getattr(User, expr.attr)
+        if expr.val == '*':
+            return col.is_not(None), query
+        return func.lower(col) == expr.val, query
+
+    attribute_q = aliased(Attribute)
+    query = query.join(
+        attribute_q, and_(
+            attribute_q.directory_id == Directory.id,
+            attribute_q.type_id == get_type_id_query(expr.attr)),
+        isouter=True,
+    )
+
+    if expr.val == '*':
+        return attribute_q.id.is_not(None), query
+
+    if expr.val.startswith('*') or expr.val.endswith('*'):
+        return attribute_q.value.ilike(expr.val.replace('*', '%')), query
+
+    return func.lower(attribute_q.value) == expr.val, query
+
+
+def _base_query() -> Select:
+    return select(Directory.id)\
+        .join(User, isouter=True)\
+        .distinct(Directory.id)
+
+
+async def _explain(session: AsyncSession, query: Select) -> dict:
+    """Get executed query plan."""
+    compiled = query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    plan = await session.scalar(
+        text(f'EXPLAIN (ANALYZE, FORMAT JSON) {compiled}'))
+    return plan[0]['Plan']
+
+
+async def _explain_rows(session: AsyncSession, query: Select) -> int:
+    """Get count of rows, fed into `DISTINCT`, from query plan."""
+    input_plan, = (  # skip init plans of subqueries
+        node for node in (await _explain(session, query))['Plans']
+        if node['Parent Relationship'] == 'Outer')
+    return input_plan['Actual Rows']
+
+
+async def _add_mailboxes(session: AsyncSession) -> None:
+    """Add multivalued attribute to every directory."""
+    type_ids = await attribute_types.get_ids(session, ['otherMailbox'])
+    session.add_all(
+        Attribute(
+            directory_id=directory_id,
+            type_id=type_ids['othermailbox'],
+            value=value)
+        for directory_id in await session.scalars(select(Directory.id))
+        for value in (f'mailbox{n}@mail.com' for n in range(50)))
+    await session.flush()
+
+
+def _get_queries(filter_: str) -> tuple[Select, Select]:
+    """Get semijoin and outer join queries for filter."""
+    expr = Filter.parse(filter_).simplify()
+
+    cond, query = cast_str_filter2sql(expr, _base_query(), BASE_DN)
+    semijoin = query.filter(cond)
+
+    cond, query = _cast_outer_join(expr, _base_query())
+    return semijoin, query.filter(cond)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.parametrize('filter_', [
+    '(&(objectclass=top)(posixemail=*))',
+    '(&(objectclass=person)(objectclass=top)(posixemail=*mail.com))',
+    '(&(objectclass=top)(instancetype=4)(samaccounttype=268435456))',
+    '(|(grouptype=-2147483646)(posixemail=user1*))',
+    '(&(objectclass=user)(mail=*)(objectclass=posixaccount))',
+    '(&(othermailbox=mailbox1*)(objectclass=person)(posixemail=*))',
+])
+async def test_semijoin_filter_matches_outer_join(
+        session: AsyncSession, filter_: str) -> None:
+    """Test semijoin filter result against outer join filter."""
+    await _add_mailboxes(session)
+    semijoin, outer_join = _get_queries(filter_)
+
+    result = set(await session.scalars(semijoin))
+
+    assert result
+    assert result == set(await session.scalars(outer_join))
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_semijoin_filter_fan_out(session: AsyncSession) -> None:
+    """Test semijoin filter has no fan-out of multivalued attributes."""
+    await _add_mailboxes(session)
+    filter_ = (
+        '(&(objectclass=top)(othermailbox=*@mail.com)(othermailbox=mail*))')
+    semijoin, outer_join = _get_queries(filter_)
+
+    request = SearchRequest(
+        base_object=BASE_DN,
+        scope=2,
+        deref_aliases=0,
+        size_limit=0,
+        time_limit=0,
+        types_only=False,
+        filter=filter_,
+        attributes=['*'],
+    )
+    search = request.build_query(BASE_DN).filter(
+        compile_filter(*parse_str_filter(Filter.parse(filter_), BASE_DN)))
+
+    count = len(set(await session.scalars(semijoin)))
+
+    assert await _explain_rows(session, semijoin) == count
+    assert (await _explain(session, search))['Actual Rows'] == count
+    assert await _explain_rows(session, outer_join) > count * 50
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_semijoin_filter_not(session: AsyncSession) -> None:
+    """Test negation is applied to all values of multivalued attribute."""
+    persons = set(await session.scalars(
+        select(Attribute.directory_id).where(Attribute.value == 'person')))
+
+    for filter_ in ('(!(objectclass=person))', '(!(mail=*))'):
+        cond, query = cast_str_filter2sql(
+            Filter.parse(filter_).simplify(), _base_query(), BASE_DN)
+        result = set(await session.scalars(query.filter(cond)))
+
+        assert result
+        assert not result & persons
+
+
+def _optimize(filter_: str) -> FilterGroup | FilterTerm:
+    return optimize_filter(*parse_str_filter(Filter.parse(filter_), BASE_DN))
+
+
+@pytest.mark.parametrize(('filter_', 'expected'), [
+    ('(objectclass=*)', FILTER_TRUE),
+    ('(!(objectclass=*))', FILTER_FALSE),
+    ('(&(objectclass=*)(cn=*))', FILTER_TRUE),
+    ('(|(posixemail=*)(objectclass=*))', FILTER_TRUE),
+    ('(&(cn=user0)(cn=user1))', FILTER_FALSE),
+    ('(&(mail=a@mail.com)(!(mail=a@mail.com)))', FILTER_FALSE),
+    ('(&(!(posixemail=*))(posixemail=a*))', FILTER_FALSE),
+    ('(|(posixemail=a)(!(posixemail=a)))', FILTER_TRUE),
+    ('(&(&(title=a)(title=a))(|(title=a)))', FilterTerm(
+        'attribute', 'title', param='filter_0')),
+])
+def test_optimize_filter(
+        filter_: str, expected: FilterGroup | FilterTerm) -> None:
+    """Test filter folding, flattening and contradictions."""
+    assert _optimize(filter_) == expected
+
+
+def test_optimize_filter_order() -> None:
+    """Test native column predicates are evaluated first."""
+    node = _optimize(
+        '(&(title=*eng*)(&(objectclass=user)(samaccountname=user0))'
+        '(cn=user0)(title=*eng*))')
+
+    assert node == FilterGroup('&', (
+        FilterTerm('column', 'cn', param='filter_3'),
+        FilterTerm('column', 'samaccountname', param='filter_2'),
+        FilterTerm('objectclass', 'objectclass', param='filter_1'),
+        FilterTerm('attribute', 'title', '*=', 'filter_0'),
+    ))
+
+
+def test_optimize_filter_double_negation() -> None:
+    """Test double negation is removed."""
+    term = FilterTerm('present', 'posixemail')
+    node = FilterGroup('&', (
+        FilterTerm('present', 'objectclass'),
+        FilterGroup('!', (FilterGroup('!', (term,)),)),
+    ))
+
+    assert optimize_filter(node, {}) == term
+
+
+def _parse_asn1_filter(filter_: str) -> dict:
+    """Encode filter as LDAP client does and parse it."""
+    expr = compile_ldap3_filter(parse_ldap3_filter(
+        filter_, None, 'utf-8', None, None, False).elements[0])
+
+    decoder = Decoder()
+    decoder.start(encoder.encode(expr))
+    return parse_filter(asn1todict(decoder)[0], BASE_DN)[1]
+
+
+@pytest.mark.parametrize(('filter_', 'pattern'), [
+    ('(description=user*)', 'user%'),
+    ('(description=*er0)', '%er0'),
+    ('(description=*ser*)', '%ser%'),
+    ('(description=u*e*r*0)', 'u%e%r%0'),
+    ('(description=*50%_off*)', '%50\\%\\_off%'),
+])
+def test_substring_filter_pattern(filter_: str, pattern: str) -> None:
+    """Test all substring components are kept and escaped."""
+    _, params = parse_str_filter(Filter.parse(filter_), BASE_DN)
+
+    assert params == {'filter_0': pattern}
+    assert _parse_asn1_filter(filter_) == {'filter_0': pattern}
+
+
+async def _get_filter_plan(session: AsyncSession, filter_: str) -> str:
+    """Explain filter query with sequential scans disabled."""
+    node, params = parse_str_filter(Filter.parse(filter_), BASE_DN)
+    query = select(Directory.id).where(compile_filter(node, params))
+    compiled = query.compile(dialect=postgresql.dialect(paramstyle='named'))
+
+    await session.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = await session.scalars(
+        text(f'EXPLAIN {compiled}'), compiled.params)
+
+    return '\n'.join(plan)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.parametrize(('filter_', 'index'), [
+    ('(description=*admin*)', 'ix_Attributes_value_trgm'),
+    ('(displayname=*ser*0)', 'ix_Users_displayName_trgm'),
+    ('(cn=*ser*)', 'ix_Directory_name_trgm'),
+])
+async def test_substring_filter_trigram_index(
+        session: AsyncSession, filter_: str, index: str) -> None:
+    """Test substring filters are served by trigram indexes."""
+    if not await session.scalar(text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")):
+        pytest.skip('pg_trgm is not available')
+
+    assert index in await _get_filter_plan(session, filter_)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.parametrize(('filter_', 'index'), [
+    ('(cn=USER0)', 'ix_Directory_name_lower'),
+    ('(samaccountname=User0)', 'ix_Users_sAMAccountName_lower'),
+    ('(mail=USER0@mail.com)', 'ix_Users_mail_lower'),
+    ('(description=Test)', 'ix_Attributes_value_lower'),
+])
+async def test_equality_filter_lowercase_index(
+        session: AsyncSession, filter_: str, index: str) -> None:
+    """Test equality filters are served by lowercase expression indexes."""
+    assert index in await _get_filter_plan(session, filter_.lower())
+
+
+def test_objectclass_filter_term() -> None:
+    """Test objectClass and objectCategory equality is array containment."""
+    node, params = SearchRequest.model_construct(
+        filter='(&(objectClass=User)(objectCategory=person))',
+    ).parse_filter(BASE_DN)
+
+    assert node == FilterGroup('&', (
+        FilterTerm('objectclass', 'objectclass', param='filter_0'),
+        FilterTerm('objectclass', 'objectclass', param='filter_1'),
+    ))
+    assert params == {'filter_0': 'user', 'filter_1': 'person'}
+    assert _parse_asn1_filter('(objectCategory=User)') == {
+        'filter_0': 'user'}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_objectclass_filter_index(session: AsyncSession) -> None:
+    """Test objectClass filter is served by GIN index of array."""
+    assert 'ix_Directory_objectClasses' in await _get_filter_plan(
+        session, '(objectclass=user)')
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_objectclass_sync(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test objectClass array follows attribute values on add and modify."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    async def search(filter_: str) -> list[int]:
+        node, params = parse_str_filter(Filter.parse(filter_), BASE_DN)
+        return list(await session.scalars(
+            select(Directory.id).where(compile_filter(node, params))))
+
+    request = AddRequest(entry='ou=classes,dc=md,dc=test', attributes=[
+        PartialAttribute(
+            type='objectClass', vals=['top', 'organizationalUnit', 'Top']),
+    ])
+    result = [response async for response in request.handle(
+        ldap_session, session)]
+    assert result[0].result_code == LDAPCodes.SUCCESS
+
+    directory = await get_directory(session, ['ou=classes'])
+    assert directory.object_classes == [  # type: ignore
+        'top', 'organizationalunit']
+    assert directory.id in await search(  # type: ignore
+        '(objectclass=organizationalunit)')
+
+    for operation, vals in (
+        (Operation.DELETE, ['organizationalUnit']),
+        (Operation.ADD, ['container']),
+    ):
+        request = ModifyRequest(object='ou=classes,dc=md,dc=test', changes=[
+            Changes(operation=operation, modification=PartialAttribute(
+                type='objectClass', vals=vals)),
+        ])
+        result = [response async for response in request.handle(
+            ldap_session, session)]
+        assert result[0].result_code == LDAPCodes.SUCCESS
+
+    await session.refresh(directory)
+    assert sorted(directory.object_classes) == [  # type: ignore
+        'container', 'top']
+    assert directory.id in await search(  # type: ignore
+        '(objectclass=container)')
+    assert directory.id not in await search(  # type: ignore
+        '(objectclass=organizationalunit)')
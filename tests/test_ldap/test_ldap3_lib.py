@@ -8,10 +8,17 @@ from asyncio import BaseEventLoop
 from functools import partial
 
 import pytest
-from ldap3 import Connection
+from ldap3 import MODIFY_ADD, MODIFY_REPLACE, Connection
+from ldap3.protocol.microsoft import dir_sync_control
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
+from ldap_protocol.utils import reserve_usn
+from models.ldap3 import directory_changes
 from tests.conftest import TestCreds
 
+DIRSYNC_OID = '1.2.840.113556.1.4.841'
+
 
 @pytest.mark.asyncio()
 @pytest.mark.usefixtures('setup_session')
@@ -56,3 +63,149 @@ async def test_ldap3_search_memberof(
     assert result
     assert ldap_client.entries
     assert ldap_client.entries[1].entry_dn == member
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_ldap3_search_in_chain(
+        ldap_client: Connection,
+        event_loop: BaseEventLoop,
+        creds: TestCreds) -> None:
+    """Test LDAP_MATCHING_RULE_IN_CHAIN extensible match filter."""
+    admins = 'cn=domain admins,cn=groups,dc=md,dc=test'
+    developers = 'cn=developers,cn=groups,dc=md,dc=test'
+    user1 = 'cn=user1,ou=moscow,ou=russia,ou=users,dc=md,dc=test'
+
+    await event_loop.run_in_executor(
+        None, partial(ldap_client.rebind, user=creds.un, password=creds.pw))
+    await event_loop.run_in_executor(None, partial(
+        ldap_client.modify, developers,
+        {'memberOf': [(MODIFY_ADD, [admins])]}))
+
+    async def search(filter_: str) -> set[str]:
+        await event_loop.run_in_executor(None, partial(
+            ldap_client.search, 'dc=md,dc=test', filter_))
+        return {  # base object data is returned for any filter
+            entry.entry_dn for entry in ldap_client.entries[1:]}
+
+    assert await search(
+        f'(memberOf:1.2.840.113556.1.4.1941:={admins})') == {
+            developers, 'cn=user0,ou=users,dc=md,dc=test', user1}
+    assert await search(
+        f'(member:1.2.840.113556.1.4.1941:={user1})') == {
+            admins, developers}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_ldap3_search_without_values(
+        ldap_client: Connection,
+        event_loop: BaseEventLoop,
+        creds: TestCreds) -> None:
+    """Test `1.1` returns only DN and typesOnly returns only types."""
+    await event_loop.run_in_executor(
+        None, partial(ldap_client.rebind, user=creds.un, password=creds.pw))
+
+    await event_loop.run_in_executor(
+        None,
+        partial(
+            ldap_client.search, 'ou=users,dc=md,dc=test',
+            '(sAMAccountName=user0)',
+            attributes=['1.1'],
+        ))
+    assert [entry['dn'] for entry in ldap_client.response] == [
+        'cn=user0,ou=users,dc=md,dc=test']
+    assert ldap_client.response[0]['raw_attributes'] == {}
+
+    await event_loop.run_in_executor(
+        None,
+        partial(
+            ldap_client.search, 'ou=users,dc=md,dc=test',
+            '(sAMAccountName=user0)',
+            attributes=['*', 'memberOf'], types_only=True,
+        ))
+    attributes = ldap_client.response[0]['raw_attributes']
+    assert {'objectClass', 'sAMAccountName', 'memberOf'} <= attributes.keys()
+    assert not any(attributes.values())
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_ldap3_dirsync(
+        ldap_client: Connection,
+        event_loop: BaseEventLoop,
+        creds: TestCreds) -> None:
+    """Test DirSync control returns entries changed after cookie."""
+    dn = 'cn=user0,ou=users,dc=md,dc=test'
+    await event_loop.run_in_executor(
+        None, partial(ldap_client.rebind, user=creds.un, password=creds.pw))
+
+    entries, cookie = await _dirsync(ldap_client, event_loop, None)
+    assert dn in entries
+    assert 'dc=md,dc=test' not in entries
+
+    entries, cookie = await _dirsync(ldap_client, event_loop, cookie)
+    assert entries == []
+
+    await event_loop.run_in_executor(
+        None,
+        partial(
+            ldap_client.modify, dn,
+            {'description': [(MODIFY_REPLACE, ['synced'])]},
+        ))
+
+    entries, _ = await _dirsync(ldap_client, event_loop, cookie)
+    assert entries == [dn]
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.usefixtures('session')
+async def test_ldap3_dirsync_uncommitted(
+        ldap_client: Connection,
+        event_loop: BaseEventLoop,
+        engine: AsyncEngine,
+        creds: TestCreds) -> None:
+    """Test DirSync cookie is below USN of concurrent write transaction."""
+    await event_loop.run_in_executor(
+        None, partial(ldap_client.rebind, user=creds.un, password=creds.pw))
+
+    async with engine.connect() as conn, AsyncSession(bind=conn) as writer:
+        await reserve_usn(writer)
+        usn = await writer.scalar(select(directory_changes.next_value()))
+
+        _, cookie = await _dirsync(ldap_client, event_loop, None)
+        assert int(cookie) < usn
+
+        await writer.commit()
+
+    _, cookie = await _dirsync(ldap_client, event_loop, None)
+    assert int(cookie) >= usn
+
+
+async def _dirsync(
+    ldap_client: Connection,
+    event_loop: BaseEventLoop,
+    cookie: bytes | None,
+) -> tuple[list[str], bytes]:
+    """Search with DirSync control.
+
+    :return tuple[list[str], bytes]: changed entries and a new cookie
+    """
+    await event_loop.run_in_executor(
+        None,
+        partial(
+            ldap_client.search, 'dc=md,dc=test', '(objectclass=*)',
+            controls=[dir_sync_control(
+                criticality=True, object_security=False,
+                ancestors_first=True, public_data_only=False,
+                incremental_values=False, max_length=0,
+                cookie=cookie)],
+        ))
+    control = ldap_client.result['controls'][DIRSYNC_OID]
+    return (
+        [entry.entry_dn for entry in ldap_client.entries],
+        control['value']['cookie'])
@@ -0,0 +1,117 @@
+"""Test change notifications.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.sql.expression import Select
+
+from api.main.schema import SearchRequest
+from ldap_protocol.controls import LDAP_SERVER_NOTIFICATION_OID, Control
+from ldap_protocol.dialogue import LDAPCodes, Operation, Session
+from ldap_protocol.ldap_requests import modify, modify_dn
+from ldap_protocol.ldap_requests.modify import Changes
+from ldap_protocol.ldap_responses import PartialAttribute, SearchResultEntry
+from ldap_protocol.notifications import CHANNEL, change_notifier
+from models.ldap3 import Directory, User
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_change_notification(
+        session: AsyncSession,
+        ldap_session: Session,
+        engine: AsyncEngine) -> None:
+    """Test notification search yields only changed matching entries."""
+    user = await session.scalar(
+        select(User).filter_by(sam_accout_name='user0'))
+    group_id = await session.scalar(
+        select(Directory.id).filter_by(name='domain admins'))
+    await ldap_session.set_user(user)
+
+    request = SearchRequest(
+        base_object='ou=users,dc=md,dc=test',
+        scope=2,
+        deref_aliases=0,
+        size_limit=0,
+        time_limit=0,
+        types_only=False,
+        filter='(objectClass=user)',
+        attributes=['cn'],
+    )
+    request.set_controls([Control(
+        control_type=LDAP_SERVER_NOTIFICATION_OID, criticality=True)])
+
+    responses = request.handle(ldap_session, session)
+    response = asyncio.ensure_future(anext(responses))
+
+    while not len(change_notifier):
+        await asyncio.sleep(0.01)
+
+    async with engine.connect() as conn:
+        for directory_id in (group_id, user.directory_id):
+            await conn.execute(select(func.pg_notify(
+                CHANNEL, str(directory_id))))
+        await conn.commit()
+
+    entry = await asyncio.wait_for(response, 5)
+
+    assert isinstance(entry, SearchResultEntry)
+    assert entry.object_name == 'cn=user0,ou=users,dc=md,dc=test'
+
+    ldap_session.closed.set()
+
+    with pytest.raises(StopAsyncIteration):
+        await anext(responses)
+
+    assert not len(change_notifier)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_bulk_change_notifications(
+        session: AsyncSession,
+        ldap_session: Session,
+        monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test renamed subtree and groups of changed memberOf are notified."""
+    notified: set[str] = set()
+
+    async def notify_changes(session: AsyncSession, ids: Select) -> None:
+        notified.update(await session.scalars(
+            select(Directory.name).where(Directory.id.in_(ids))))
+
+    monkeypatch.setattr(modify, 'notify_changes', notify_changes)
+    monkeypatch.setattr(modify_dn, 'notify_changes', notify_changes)
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    request = modify.ModifyRequest(
+        object='cn=user0,ou=users,dc=md,dc=test',
+        changes=[Changes(
+            operation=Operation.ADD,
+            modification=PartialAttribute(
+                type='memberOf',
+                vals=['cn=developers,cn=groups,dc=md,dc=test']),
+        )],
+    )
+    async for response in request.handle(ldap_session, session):
+        assert response.result_code == LDAPCodes.SUCCESS
+
+    assert notified == {'developers'}
+    notified.clear()
+
+    request = modify_dn.ModifyDNRequest(
+        entry='ou=russia,ou=users,dc=md,dc=test',
+        newrdn='ou=russia2',
+        deleteoldrdn=True,
+        new_superior=None,
+    )
+    async for response in request.handle(ldap_session, session):
+        assert response.result_code == LDAPCodes.SUCCESS
+
+    assert notified == {'moscow', 'user1'}
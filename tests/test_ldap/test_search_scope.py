@@ -0,0 +1,104 @@
+"""Test search scope evaluation.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.main.schema import SearchRequest
+from ldap_protocol.dialogue import LDAPCodes, Session
+from ldap_protocol.ldap_requests import ModifyDNRequest
+from ldap_protocol.ldap_responses import SearchResultEntry
+from models.ldap3 import User
+
+BASE_DN = 'dc=md,dc=test'
+
+
+def _request(base_object: str, scope: int) -> SearchRequest:
+    return SearchRequest(
+        base_object=base_object,
+        scope=scope,
+        deref_aliases=0,
+        size_limit=0,
+        time_limit=0,
+        types_only=True,
+        filter='(objectClass=*)',
+        attributes=[],
+    )
+
+
+async def _search(
+    session: AsyncSession, ldap_session: Session,
+    base_object: str, scope: int,
+) -> set[str]:
+    return {
+        response.object_name
+        async for response in _request(base_object, scope).handle(
+            ldap_session, session)
+        if isinstance(response, SearchResultEntry)}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_search_scope_after_move(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test one-level and subtree scopes follow renamed entries."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    assert await _search(session, ldap_session, BASE_DN, 1) == {
+        'cn=groups,dc=md,dc=test', 'ou=users,dc=md,dc=test'}
+    assert await _search(
+        session, ldap_session, 'ou=russia,ou=users,dc=md,dc=test', 2) == {
+            'ou=russia,ou=users,dc=md,dc=test',
+            'ou=moscow,ou=russia,ou=users,dc=md,dc=test',
+            'cn=user1,ou=moscow,ou=russia,ou=users,dc=md,dc=test'}
+
+    request = ModifyDNRequest(
+        entry='ou=moscow,ou=russia,ou=users,dc=md,dc=test',
+        newrdn='ou=msk',
+        deleteoldrdn=True,
+        new_superior='cn=groups,dc=md,dc=test',
+    )
+    async for response in request.handle(ldap_session, session):
+        assert response.result_code == LDAPCodes.SUCCESS
+
+    assert await _search(
+        session, ldap_session, 'ou=russia,ou=users,dc=md,dc=test', 2) == {
+            'ou=russia,ou=users,dc=md,dc=test'}
+    assert await _search(
+        session, ldap_session, 'cn=groups,dc=md,dc=test', 1) == {
+            'cn=domain admins,cn=groups,dc=md,dc=test',
+            'cn=developers,cn=groups,dc=md,dc=test',
+            'ou=msk,cn=groups,dc=md,dc=test'}
+    assert await _search(
+        session, ldap_session, 'cn=groups,dc=md,dc=test', 2) == {
+            'cn=groups,dc=md,dc=test',
+            'cn=domain admins,cn=groups,dc=md,dc=test',
+            'cn=developers,cn=groups,dc=md,dc=test',
+            'ou=msk,cn=groups,dc=md,dc=test',
+            'cn=user1,ou=msk,cn=groups,dc=md,dc=test'}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+@pytest.mark.parametrize(('scope', 'cond'), [
+    (1, '"parentId" = $0'),
+    (2, 'Index Cond: (dir_id = $0)'),
+])
+async def test_search_scope_plan(
+        session: AsyncSession, scope: int, cond: str) -> None:
+    """Test scope is evaluated by parent id and ancestors table."""
+    query = _request('ou=users,dc=md,dc=test', scope).build_query(BASE_DN)
+    compiled = query.compile(dialect=postgresql.dialect(paramstyle='named'))
+
+    await session.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = '\n'.join(await session.scalars(
+        text(f'EXPLAIN {compiled}'), compiled.params))
+
+    assert cond in plan
+    assert 'cardinality' not in plan
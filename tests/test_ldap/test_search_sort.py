@@ -0,0 +1,191 @@
+"""Test server side sort and virtual list view controls.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import asn1
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.main.schema import SearchRequest
+from ldap_protocol.controls import (
+    LDAP_CONTROL_VLVREQUEST,
+    LDAP_CONTROL_VLVRESPONSE,
+    LDAP_SERVER_RESP_SORT_OID,
+    LDAP_SERVER_SORT_OID,
+    Control,
+)
+from ldap_protocol.dialogue import LDAPCodes, Session
+from ldap_protocol.ldap_responses import SearchResultDone, SearchResultEntry
+from models.ldap3 import User
+
+BASE_DN = 'dc=md,dc=test'
+
+
+def _sort_control(
+        attribute_type: str, reverse: bool = False,
+        criticality: bool = True) -> Control:
+    enc = asn1.Encoder()
+    enc.start()
+    enc.enter(asn1.Numbers.Sequence)
+    enc.enter(asn1.Numbers.Sequence)
+    enc.write(attribute_type.encode(), asn1.Numbers.OctetString)
+    if reverse:
+        enc.write(
+            b'\xff', nr=1, typ=asn1.Types.Primitive, cls=asn1.Classes.Context)
+    enc.leave()
+    enc.leave()
+    return Control(
+        control_type=LDAP_SERVER_SORT_OID,
+        criticality=criticality, control_value=enc.output())
+
+
+def _vlv_control(
+        before: int, after: int,
+        offset: int = 0, content_count: int = 0,
+        assertion_value: str | None = None) -> Control:
+    enc = asn1.Encoder()
+    enc.start()
+    enc.enter(asn1.Numbers.Sequence)
+    enc.write(before, asn1.Numbers.Integer)
+    enc.write(after, asn1.Numbers.Integer)
+    if assertion_value is None:
+        enc.enter(0, asn1.Classes.Context)
+        enc.write(offset, asn1.Numbers.Integer)
+        enc.write(content_count, asn1.Numbers.Integer)
+        enc.leave()
+    else:
+        enc.write(
+            assertion_value.encode(), nr=1,
+            typ=asn1.Types.Primitive, cls=asn1.Classes.Context)
+    enc.leave()
+    return Control(
+        control_type=LDAP_CONTROL_VLVREQUEST,
+        criticality=True, control_value=enc.output())
+
+
+def _decode(control: Control) -> list:
+    dec = asn1.Decoder()
+    dec.start(control.value_bytes)
+    dec.enter()
+    values = []
+    while not dec.eof():
+        values.append(dec.read()[1])
+    return values
+
+
+async def _search(
+    session: AsyncSession, ldap_session: Session, *controls: Control,
+) -> tuple[list[str], SearchResultDone]:
+    request = SearchRequest(
+        base_object='ou=users,dc=md,dc=test',
+        scope=2,
+        deref_aliases=0,
+        size_limit=0,
+        time_limit=0,
+        types_only=True,
+        filter='(objectClass=*)',
+        attributes=['cn'],
+    )
+    request.set_controls(list(controls))
+    names = []
+
+    async for response in request.handle(ldap_session, session):
+        if isinstance(response, SearchResultEntry):
+            names.append(response.object_name.split(',')[0][3:])
+        elif isinstance(response, SearchResultDone):
+            return names, response
+
+    raise AssertionError('Search is not done')
+
+
+def _response(done: SearchResultDone, oid: str) -> list:
+    controls = {control.control_type: control for control in done.controls}
+    return _decode(controls[oid])
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_search_sort(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test entries are ordered by native columns."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    names, _ = await _search(session, ldap_session)
+
+    sorted_names, done = await _search(
+        session, ldap_session, _sort_control('cn', reverse=True))
+    assert done.result_code == LDAPCodes.SUCCESS
+    assert _response(done, LDAP_SERVER_RESP_SORT_OID) == [LDAPCodes.SUCCESS]
+    assert sorted_names == sorted(names, key=str.lower, reverse=True)
+
+    sorted_names, _ = await _search(
+        session, ldap_session, _sort_control('sAMAccountName'))
+    assert sorted_names[:2] == ['user0', 'user1']  # entries without key last
+    assert set(sorted_names) == set(names)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_search_sort_not_indexed(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test sort key without index fails critical sort only."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    names, done = await _search(
+        session, ldap_session, _sort_control('description'))
+    assert done.result_code == LDAPCodes.UNAVAILABLE_CRITICAL_EXTENSION
+    assert not names
+    assert _response(done, LDAP_SERVER_RESP_SORT_OID) == [
+        LDAPCodes.UNWILLING_TO_PERFORM, b'description']
+
+    names, done = await _search(
+        session, ldap_session,
+        _sort_control('description', criticality=False))
+    assert done.result_code == LDAPCodes.SUCCESS
+    assert names
+    assert _response(done, LDAP_SERVER_RESP_SORT_OID)[0] == \
+        LDAPCodes.UNWILLING_TO_PERFORM
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_search_vlv(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test list view windows by offset and by assertion value."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+
+    names, _ = await _search(session, ldap_session, _sort_control('cn'))
+    count = len(names)
+
+    window, done = await _search(
+        session, ldap_session,
+        _sort_control('cn'), _vlv_control(1, 1, offset=2))
+    assert done.result_code == LDAPCodes.SUCCESS
+    assert window == names[:3]
+    assert _response(done, LDAP_CONTROL_VLVRESPONSE) == [
+        2, count, LDAPCodes.SUCCESS]
+
+    window, done = await _search(  # scaled by client count estimate
+        session, ldap_session,
+        _sort_control('cn'),
+        _vlv_control(0, 0, offset=20, content_count=20))
+    assert window == names[-1:]
+
+    window, done = await _search(
+        session, ldap_session,
+        _sort_control('cn'), _vlv_control(0, 1, assertion_value='R'))
+    target = next(
+        i for i, name in enumerate(names) if name.lower() >= 'r')
+    assert window == names[target:target + 2]
+    assert _response(done, LDAP_CONTROL_VLVRESPONSE)[0] == target + 1
+
+    window, done = await _search(
+        session, ldap_session, _vlv_control(0, 1, offset=1))
+    assert done.result_code == LDAPCodes.SORT_CONTROL_MISSING
+    assert not window
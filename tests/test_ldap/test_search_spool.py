@@ -0,0 +1,70 @@
+"""Test search results spool.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.main.schema import SearchRequest
+from ldap_protocol.dialogue import Session
+from ldap_protocol.ldap_requests.search import search_spool
+from ldap_protocol.ldap_responses import SearchResultEntry
+from models.ldap3 import User
+
+
+async def _search(session: AsyncSession, ldap_session: Session) -> list[str]:
+    request = SearchRequest(
+        base_object='dc=md,dc=test',
+        scope=2,
+        deref_aliases=0,
+        size_limit=0,
+        time_limit=0,
+        types_only=True,
+        filter='(objectClass=*)',
+        attributes=[],
+    )
+    return [
+        response.object_name
+        async for response in request.handle(ldap_session, session)
+        if isinstance(response, SearchResultEntry)]
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_search_spool(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test result is spooled, or spilled to file over spool size."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+    search_spool.clear()
+
+    names = await _search(session, ldap_session)
+    assert search_spool.stats['spooled'] == 1
+    assert search_spool.stats['peak_size'] > 0
+    assert search_spool.stats['size'] == 0  # sent entries are released
+
+    max_bytes = ldap_session.settings.SEARCH_SPOOL_MAX_BYTES
+    ldap_session.settings.SEARCH_SPOOL_MAX_BYTES = 1
+    try:
+        assert await _search(session, ldap_session) == names
+    finally:
+        ldap_session.settings.SEARCH_SPOOL_MAX_BYTES = max_bytes
+
+    assert search_spool.stats['spooled'] == 1
+    assert search_spool.stats['overflows'] == 1
+    assert search_spool.stats['size'] == 0
+
+    settings = ldap_session.settings
+    max_total_bytes = settings.SEARCH_SPOOL_TOTAL_MAX_BYTES
+    settings.SEARCH_SPOOL_TOTAL_MAX_BYTES = 1  # process-wide limit
+    try:
+        assert await _search(session, ldap_session) == names
+    finally:
+        settings.SEARCH_SPOOL_TOTAL_MAX_BYTES = max_total_bytes
+
+    assert search_spool.stats['spooled'] == 1
+    assert search_spool.stats['overflows'] == 2
+    assert search_spool.stats['size'] == 0
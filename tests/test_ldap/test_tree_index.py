@@ -0,0 +1,138 @@
+"""Test directory tree index and DN resolution.
+
+Copyright (c) 2024 MultiFactor
+License: https://github.com/MultiDirectoryLab/MultiDirectory/blob/main/LICENSE
+"""
+
+import math
+
+import pytest
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ldap_protocol.dialogue import LDAPCodes, Session
+from ldap_protocol.ldap_requests import AddRequest
+from ldap_protocol.utils import (
+    get_directory,
+    get_directory_ids,
+    get_groups,
+    get_user,
+    tree_index,
+)
+from models.ldap3 import Path, User
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_tree_index(session: AsyncSession) -> None:
+    """Test paths are resolved by index, stale entries are dropped."""
+    tree_index.clear()
+
+    directory = await get_directory(session, ['ou=users'])
+    assert directory is not None
+    assert tree_index.get_id(['ou=users']) == directory.id
+
+    user = await get_user(session, 'cn=User0,ou=Users,dc=md,dc=test')
+    assert user is not None
+    assert user.sam_accout_name == 'user0'
+
+    await session.execute(  # renamed by another app replica
+        update(Path)
+        .where(Path.endpoint_id == directory.id)
+        .values(path=['ou=people']))
+
+    assert await get_directory(session, ['ou=users']) is None
+    assert tree_index.get_id(['ou=users']) is None
+
+    renamed = await get_directory(session, ['ou=people'])
+    assert renamed is not None
+    assert renamed.id == directory.id
+    assert tree_index.get_id(['ou=people']) == directory.id
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_tree_index_local_write(
+        session: AsyncSession, ldap_session: Session) -> None:
+    """Test entry, added by this process, is indexed on the first lookup."""
+    await ldap_session.set_user(await session.scalar(
+        select(User).filter_by(sam_accout_name='user0')))
+    await tree_index.refresh(session)
+
+    request = AddRequest(entry='ou=indexed,dc=md,dc=test', attributes=[])
+    result = [response async for response in request.handle(
+        ldap_session, session)]
+    assert result[0].result_code == LDAPCodes.SUCCESS
+
+    directory = await get_directory(session, ['ou=indexed'])
+    assert directory is not None
+    assert tree_index.get_id(['ou=indexed']) == directory.id
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_tree_index_round_trips(
+        session: AsyncSession, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test indexed and not indexed DNs are resolved with one query."""
+    user_dn = 'cn=user0,ou=users,dc=md,dc=test'
+    await get_user(session, user_dn)  # load catalogue and index
+    monkeypatch.setattr(tree_index, '_refresh_interval', math.inf)
+    statements = []
+
+    def count(_, __, statement: str, *args: object) -> None:
+        statements.append(statement)
+
+    connection = session.sync_session.bind
+    event.listen(connection, 'before_cursor_execute', count)
+    try:
+        tree_index.discard(tree_index.get_id(['ou=users']))  # type: ignore
+        assert await get_directory(session, ['ou=users']) is not None
+        assert len(statements) == 1
+
+        assert await get_directory(session, ['ou=users']) is not None
+        assert len(statements) == 2
+
+        tree_index.discard(tree_index.get_id(  # type: ignore
+            ['ou=users', 'cn=user0']))
+        assert await get_user(session, user_dn) is not None
+        assert len(statements) == 3
+
+        assert await get_user(session, user_dn) is not None
+        assert len(statements) == 4
+    finally:
+        event.remove(connection, 'before_cursor_execute', count)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('setup_session')
+async def test_get_directory_ids(session: AsyncSession) -> None:
+    """Test DNs are normalized and resolved in one query."""
+    group_dn = 'cn=developers,cn=groups,dc=md,dc=test'
+    statements = []
+
+    def count(_, __, statement: str, *args: object) -> None:
+        if '"Paths"' in statement:
+            statements.append(statement)
+
+    connection = session.sync_session.bind
+    event.listen(connection, 'before_cursor_execute', count)
+    try:
+        ids = await get_directory_ids(session, [
+            'CN=Developers, CN=Groups,DC=md,DC=test',
+            group_dn,
+            'dc=md,dc=test',
+            'cn=developers,cn=groups,dc=other,dc=test',
+            *(f'cn=missing{i},cn=groups,dc=md,dc=test' for i in range(5000)),
+        ])
+    finally:
+        event.remove(connection, 'before_cursor_execute', count)
+
+    directory = await get_directory(session, ['cn=groups', 'cn=developers'])
+    assert ids == {group_dn: directory.id}  # type: ignore
+    assert len(statements) == 1
+
+    groups = await get_groups(
+        ['CN=Developers,CN=Groups,DC=MD,DC=TEST', 'ou=users,dc=md,dc=test'],
+        session)
+    assert [group.directory_id for group in groups] == [
+        directory.id]  # type: ignore